@@ -2,12 +2,23 @@
 from __future__ import annotations
 
 import base64
+import collections
+import concurrent.futures
+import hmac
+import io
 import os
 import hashlib
+import struct
+import threading
+import time
+from typing import Union
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.fernet import Fernet, InvalidToken
 
 from SuperHelper.Core.Utils import TypeCheck
@@ -20,18 +31,75 @@ __all__ = [
 class Cryptographer:
     """A utility class for cryptographic functions."""
 
-    def __init__(self, salt: bytes, auth_key: bytes, encrypt: bool = True) -> None:
+    nonce_length: int = 12
+    """Length of the nonce of AEAD tokens."""
+    tag_length: int = 16
+    """Length of the authentication tag of AEAD tokens."""
+    key_check_length: int = 4
+    """Length of the key-check value."""
+    kdf_algorithms: tuple[str, ...] = ("pbkdf2", "scrypt")
+    """Names of the key derivation functions, whose indices are their identifiers."""
+    default_kdf: str = "pbkdf2"
+    """Name of the default key derivation function."""
+    default_kdf_costs: dict[str, int] = {"pbkdf2": 10000, "scrypt": 14}
+    """Default costs of the key derivation functions: iterations of PBKDF2, and log2 of the parameter N of scrypt."""
+    maximum_kdf_costs: dict[str, int] = {"pbkdf2": (1 << 32) - 1, "scrypt": 22}
+    """Maximum costs of the key derivation functions, where scrypt takes 1 KiB of memory per unit of N."""
+    stream_chunk_size: int = 1 << 16
+    """Default number of bytes of plain data per chunk of encrypted streams."""
+    stream_header: struct.Struct = struct.Struct(">7sI")
+    """Header of encrypted streams: the nonce prefix and the chunk size."""
+    stream_nonce: struct.Struct = struct.Struct(">7sIB")
+    """Nonce of a chunk of encrypted streams: the nonce prefix, the chunk index and the last chunk marker."""
+
+    # The in-memory LRU cache of derived keys, see `Cryptographer.set_key_cache_size`
+    _key_cache: collections.OrderedDict[bytes, bytes] = collections.OrderedDict()
+    _key_cache_size: int = 32
+    _key_cache_lock: threading.Lock = threading.Lock()
+    # The executor of the key derivations of `Cryptographer.make_future`, made on first use
+    _executor: concurrent.futures.ThreadPoolExecutor = None
+
+    def __init__(self, salt: bytes, auth_key: bytes, encrypt: bool = True, kdf: str = "pbkdf2",
+                 kdf_cost: int = None) -> None:
         """Initialises a `Cryptographer` instance.
         Args:
             salt (bytes): The raw salt, in bytes.
             auth_key (bytes): The authentication key, in bytes.
             encrypt (bool): True to make an encrypter, otherwise False.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
         """
         self.salt = salt
-        self.kdf = self.make_kdf(self.salt)
+        self.kdf_name = kdf
+        self.kdf_cost = Cryptographer.default_kdf_costs[kdf] if kdf_cost is None else kdf_cost
+        self.kdf = self.make_kdf(self.salt, self.kdf_name, self.kdf_cost)
         self.auth_hash = hashlib.sha256(auth_key).digest()
-        self.key = self.kdf.derive(self.auth_hash)
+        self.key = self.derive_key()
         self.is_encrypt = encrypt
+        self.aead = None
+        self.fernet = None
+
+    def derive_key(self) -> bytes:
+        """Derives the key from the authentication key, or gets it from the cache of derived keys.
+
+        Returns:
+            The derived key, in bytes.
+        """
+        # The cache is keyed by a hash, hence neither the salt nor the authentication key is kept in it
+        cache_key = hashlib.sha256(b"".join((self.salt, self.auth_hash, self.kdf_name.encode(),
+                                            self.kdf_cost.to_bytes(4, "big")))).digest()
+        with Cryptographer._key_cache_lock:
+            key = Cryptographer._key_cache.get(cache_key)
+            if key is not None:
+                Cryptographer._key_cache.move_to_end(cache_key)
+                return key
+        key = self.kdf.derive(self.auth_hash)
+        with Cryptographer._key_cache_lock:
+            if Cryptographer._key_cache_size > 0:
+                Cryptographer._key_cache[cache_key] = key
+                while len(Cryptographer._key_cache) > Cryptographer._key_cache_size:
+                    Cryptographer._key_cache.popitem(last=False)
+        return key
 
     def encrypt(self, raw_data: bytes) -> bytes:
         """Encrypts raw data.
@@ -48,8 +116,7 @@ class Cryptographer:
         TypeCheck.ensure_bytes(raw_data, "raw_data")
         if not self.is_encrypt:
             raise ValueError("Not an encrypter!")
-        fernet = Cryptographer.make_fernet(self.key)
-        return fernet.encrypt(raw_data)
+        return self.get_fernet().encrypt(raw_data)
 
     def decrypt(self, encrypted_data: bytes) -> bytes:
         """Decrypts the encrypted data.
@@ -63,12 +130,179 @@ class Cryptographer:
         TypeCheck.ensure_bytes(encrypted_data, "encrypted_data")
         if self.is_encrypt:
             raise ValueError("Not a decrypter!")
-        fernet = Cryptographer.make_fernet(self.key)
         try:
-            return fernet.decrypt(encrypted_data)
+            return self.get_fernet().decrypt(encrypted_data)
         except InvalidToken:
             raise
 
+    def encrypt_aead(self, raw_data: bytes) -> bytes:
+        """Encrypts raw data into a binary AEAD token.
+
+        Unlike `Cryptographer.encrypt`, the token is not Base64-encoded, hence it is only
+        `Cryptographer.nonce_length + Cryptographer.tag_length` bytes longer than the raw data.
+
+        Args:
+            raw_data (bytes): The raw data to be encrypted.
+
+        Returns:
+            The encrypted data, in bytes, which is the nonce followed by the AES-GCM ciphertext and tag.
+
+        Raises:
+            ValueError: A decrypter is used to encrypt.
+        """
+        TypeCheck.ensure_bytes(raw_data, "raw_data")
+        if not self.is_encrypt:
+            raise ValueError("Not an encrypter!")
+        nonce = os.urandom(Cryptographer.nonce_length)
+        return nonce + self.get_aead().encrypt(nonce, raw_data, None)
+
+    def decrypt_aead(self, encrypted_data: bytes) -> bytes:
+        """Decrypts the binary AEAD token.
+
+        Args:
+            encrypted_data (bytes): The token created by `Cryptographer.encrypt_aead`.
+
+        Returns:
+            The decrypted data, in bytes.
+
+        Raises:
+            ValueError: An encrypter is used to decrypt.
+            InvalidToken: The token is invalid or the authentication key is wrong.
+        """
+        TypeCheck.ensure_bytes(encrypted_data, "encrypted_data")
+        if self.is_encrypt:
+            raise ValueError("Not a decrypter!")
+        nonce, data = encrypted_data[:Cryptographer.nonce_length], encrypted_data[Cryptographer.nonce_length:]
+        try:
+            return self.get_aead().decrypt(nonce, data, None)
+        except (InvalidTag, ValueError):
+            raise InvalidToken
+
+    def encrypt_stream(self, src: io.IOBase, dst: io.IOBase, chunk_size: int = None) -> int:
+        """Encrypts a stream of raw data, chunk by chunk.
+
+        Only one chunk is held in memory at a time. Every chunk is encrypted with AES-GCM under a nonce made of a
+        random prefix, the index of the chunk and a marker of the last chunk, hence reordered, dropped or truncated
+        chunks fail authentication on decryption.
+
+        Args:
+            src (io.IOBase): The binary file to read raw data from.
+            dst (io.IOBase): The binary file to write encrypted data to.
+            chunk_size (int): The number of bytes of raw data per chunk, defaults to
+                `Cryptographer.stream_chunk_size`.
+
+        Returns:
+            The number of bytes of raw data encrypted.
+
+        Raises:
+            ValueError: A decrypter is used to encrypt, or the chunk size is not positive.
+        """
+        if not self.is_encrypt:
+            raise ValueError("Not an encrypter!")
+        chunk_size = Cryptographer.stream_chunk_size if chunk_size is None else chunk_size
+        if not 0 < chunk_size < 1 << 32:
+            raise ValueError("Chunk size must be positive!")
+        prefix = os.urandom(Cryptographer.stream_header.size - 4)
+        header = Cryptographer.stream_header.pack(prefix, chunk_size)
+        dst.write(header)
+        aead = self.get_aead()
+        length = index = 0
+        chunk = src.read(chunk_size)
+        while True:
+            # Read ahead to tell whether this is the last chunk
+            next_chunk = src.read(chunk_size) if len(chunk) == chunk_size else b""
+            nonce = Cryptographer.stream_nonce.pack(prefix, index, not next_chunk)
+            dst.write(aead.encrypt(nonce, chunk, header))
+            length += len(chunk)
+            if not next_chunk:
+                return length
+            chunk = next_chunk
+            index += 1
+
+    def decrypt_stream(self, src: io.IOBase, dst: io.IOBase) -> int:
+        """Decrypts a stream made by `Cryptographer.encrypt_stream`, chunk by chunk.
+
+        Only one chunk is held in memory at a time, hence the leading chunks are already written to `dst` when a later
+        chunk turns out to be invalid.
+
+        Args:
+            src (io.IOBase): The binary file to read encrypted data from.
+            dst (io.IOBase): The binary file to write raw data to.
+
+        Returns:
+            The number of bytes of raw data decrypted.
+
+        Raises:
+            ValueError: An encrypter is used to decrypt.
+            InvalidToken: The stream is invalid, truncated or reordered, or the authentication key is wrong.
+        """
+        if self.is_encrypt:
+            raise ValueError("Not a decrypter!")
+        header = src.read(Cryptographer.stream_header.size)
+        if len(header) != Cryptographer.stream_header.size:
+            raise InvalidToken
+        prefix, chunk_size = Cryptographer.stream_header.unpack(header)
+        frame_size = chunk_size + Cryptographer.tag_length
+        aead = self.get_aead()
+        length = index = 0
+        frame = src.read(frame_size)
+        while True:
+            next_frame = src.read(frame_size) if len(frame) == frame_size else b""
+            nonce = Cryptographer.stream_nonce.pack(prefix, index, not next_frame)
+            try:
+                chunk = aead.decrypt(nonce, frame, header)
+            except (InvalidTag, ValueError):
+                raise InvalidToken
+            dst.write(chunk)
+            length += len(chunk)
+            if not next_frame:
+                return length
+            frame = next_frame
+            index += 1
+
+    def get_fernet(self) -> Fernet:
+        """Gets the Fernet of the derived key, which is made once per instance.
+
+        Returns:
+            A Fernet instance.
+        """
+        if self.fernet is None:
+            self.fernet = Cryptographer.make_fernet(self.key)
+        return self.fernet
+
+    def get_aead(self) -> AESGCM:
+        """Gets the AES-GCM cipher of the derived key, which is made once per instance.
+
+        Returns:
+            An AESGCM instance.
+        """
+        if self.aead is None:
+            self.aead = AESGCM(self.key)
+        return self.aead
+
+    def get_key_check(self) -> bytes:
+        """Gets the key-check value of the derived key.
+
+        The value is a truncated HMAC of the derived key, hence it tells whether an authentication key is right without
+        revealing the derived key.
+
+        Returns:
+            The key-check value, in bytes.
+        """
+        return hmac.digest(self.key, b"SuperHelper key check", "sha256")[:Cryptographer.key_check_length]
+
+    def verify_key_check(self, key_check: bytes) -> bool:
+        """Verifies the key-check value against the derived key.
+
+        Args:
+            key_check (bytes): The key-check value made by `Cryptographer.get_key_check`.
+
+        Returns:
+            True if the authentication key is right, otherwise False.
+        """
+        TypeCheck.ensure_bytes(key_check, "key_check")
+        return hmac.compare_digest(self.get_key_check(), key_check)
+
     def get_salt_string(self) -> str:
         """String-ify the raw salt.
 
@@ -78,34 +312,97 @@ class Cryptographer:
         return Cryptographer.encode_salt(self.salt)
 
     @staticmethod
-    def make_encrypter(salt: str, key: str) -> Cryptographer:
+    def make_encrypter(salt: str, key: str, kdf: str = "pbkdf2", kdf_cost: int = None) -> Cryptographer:
         """Makes a Fernet encrypter for salt and key.
 
         Args:
             salt (str): The Base64-encoded string of the raw salt.
             key (str): The authentication key.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
 
         Returns:
             A `Cryptographer` instance, which can be used to encrypt data.
         """
         TypeCheck.ensure_str(salt, "salt")
         TypeCheck.ensure_str(key, "key")
-        return Cryptographer(Cryptographer.decode_salt(salt), key.encode(), True)
+        return Cryptographer(Cryptographer.decode_salt(salt), key.encode(), True, kdf, kdf_cost)
 
     @staticmethod
-    def make_decrypter(salt: str, key: str) -> Cryptographer:
+    def make_decrypter(salt: str, key: str, kdf: str = "pbkdf2", kdf_cost: int = None) -> Cryptographer:
         """Makes a Fernet decrypter for salt and key.
 
         Args:
             salt (str): The Base64-encoded string of the raw salt.
             key (str): The authentication key.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
 
         Returns:
             A `Cryptographer` instance, which can be used to decrypt data.
         """
         TypeCheck.ensure_str(salt, "salt")
         TypeCheck.ensure_str(key, "key")
-        return Cryptographer(Cryptographer.decode_salt(salt), key.encode(), False)
+        return Cryptographer(Cryptographer.decode_salt(salt), key.encode(), False, kdf, kdf_cost)
+
+    @staticmethod
+    def make_future(salt: str, key: str, encrypt: bool = True, kdf: str = "pbkdf2", kdf_cost: int = None,
+                    executor: concurrent.futures.Executor = None) -> concurrent.futures.Future:
+        """Makes an encrypter or a decrypter in an executor, so that the key derivation overlaps other work.
+
+        Args:
+            salt (str): The Base64-encoded string of the raw salt.
+            key (str): The authentication key.
+            encrypt (bool): True to make an encrypter, otherwise False.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
+            executor (concurrent.futures.Executor): The executor to run the key derivation in, defaults to a thread
+                pool shared by all the calls.
+
+        Returns:
+            A Future of the `Cryptographer` instance.
+        """
+        TypeCheck.ensure_str(salt, "salt")
+        TypeCheck.ensure_str(key, "key")
+        if executor is None:
+            with Cryptographer._key_cache_lock:
+                if Cryptographer._executor is None:
+                    Cryptographer._executor = concurrent.futures.ThreadPoolExecutor(
+                        thread_name_prefix="Cryptographer")
+                executor = Cryptographer._executor
+        return executor.submit(Cryptographer, Cryptographer.decode_salt(salt), key.encode(), encrypt, kdf, kdf_cost)
+
+    @staticmethod
+    def set_key_cache_size(size: int) -> None:
+        """Sets the maximum number of derived keys in the cache, dropping the least recently used keys beyond it.
+
+        Args:
+            size (int): The maximum number of derived keys, 0 to disable the cache.
+
+        Returns:
+            None
+        """
+        TypeCheck.ensure_int(size, "size")
+        with Cryptographer._key_cache_lock:
+            Cryptographer._key_cache_size = max(size, 0)
+            while len(Cryptographer._key_cache) > Cryptographer._key_cache_size:
+                Cryptographer._key_cache.popitem(last=False)
+
+    @staticmethod
+    def clear_key_cache() -> None:
+        """Clears the cache of derived keys.
+
+        Returns:
+            None
+        """
+        with Cryptographer._key_cache_lock:
+            Cryptographer._key_cache.clear()
+
+    @staticmethod
+    def _reset_after_fork() -> None:
+        # The lock may be held by a thread which does not exist in the child, and so do the threads of the executor
+        Cryptographer._key_cache_lock = threading.Lock()
+        Cryptographer._executor = None
 
     @staticmethod
     def make_salt() -> bytes:
@@ -143,24 +440,81 @@ class Cryptographer:
         return base64.b64decode(bytes(salt, "utf-8"))
 
     @staticmethod
-    def make_kdf(salt: bytes) -> PBKDF2HMAC:
+    def make_kdf(salt: bytes, kdf: str = "pbkdf2", kdf_cost: int = None) -> Union[PBKDF2HMAC, Scrypt]:
         """Makes a key derivation function from raw salt.
 
         Args:
             salt (bytes): The raw salt, in bytes.
+            kdf (str): The name of the key derivation function, either PBKDF2-SHA512 (`pbkdf2`) or scrypt (`scrypt`).
+            kdf_cost (int): The number of iterations of PBKDF2, or log2 of the parameter N of scrypt (with r = 8 and
+                p = 1), defaults to the default cost of the key derivation function.
 
         Returns:
-            A PBKDF2HMAC instance, which can be used to derive key from the authentication key.
+            A PBKDF2HMAC or Scrypt instance, which can be used to derive key from the authentication key.
+
+        Raises:
+            ValueError: The key derivation function is unknown, or the cost is out of range.
         """
         TypeCheck.ensure_bytes(salt, "salt")
+        if kdf not in Cryptographer.kdf_algorithms:
+            raise ValueError(f"Unknown key derivation function '{kdf}'!")
+        kdf_cost = Cryptographer.default_kdf_costs[kdf] if kdf_cost is None else kdf_cost
+        if not 1 <= kdf_cost <= Cryptographer.maximum_kdf_costs[kdf]:
+            raise ValueError(f"Cost of '{kdf}' must be from 1 to {Cryptographer.maximum_kdf_costs[kdf]}!")
+        if kdf == "scrypt":
+            return Scrypt(
+                salt=salt,
+                length=32,
+                n=1 << kdf_cost,
+                r=8,
+                p=1,
+                backend=default_backend(),
+            )
         return PBKDF2HMAC(
             algorithm=hashes.SHA512(),
             length=32,
             salt=salt,
-            iterations=10000,
+            iterations=kdf_cost,
             backend=default_backend(),
         )
 
+    @staticmethod
+    def calibrate(kdf: str, target: float) -> int:
+        """Finds the cost of a key derivation function whose derivation takes about `target` seconds on this host.
+
+        Args:
+            kdf (str): The name of the key derivation function.
+            target (float): The target time of a derivation, in seconds.
+
+        Returns:
+            The cost, see `Cryptographer.make_kdf`.
+
+        Raises:
+            ValueError: The key derivation function is unknown.
+        """
+        if kdf not in Cryptographer.kdf_algorithms:
+            raise ValueError(f"Unknown key derivation function '{kdf}'!")
+
+        def measure(cost: int) -> float:
+            started = time.perf_counter()
+            Cryptographer.make_kdf(Cryptographer.make_salt(), kdf, cost).derive(b"calibration")
+            return time.perf_counter() - started
+
+        maximum_cost = Cryptographer.maximum_kdf_costs[kdf]
+        if kdf == "scrypt":
+            # The time of scrypt is linear in N, double it until the target is reached
+            cost = 1
+            while cost < maximum_cost and measure(cost + 1) <= target:
+                cost += 1
+            return cost
+        # The time of PBKDF2 is linear in the iterations, extrapolate from a sample long enough to be measured
+        iterations = 1000
+        elapsed = measure(iterations)
+        while elapsed < 0.05:
+            iterations *= 2
+            elapsed = measure(iterations)
+        return max(1, min(maximum_cost, int(iterations * target / elapsed)))
+
     @staticmethod
     def make_fernet(key: bytes) -> Fernet:
         """Makes a Fernet encrypter/decrypter from the derived key.
@@ -173,3 +527,7 @@ class Cryptographer:
         """
         TypeCheck.ensure_bytes(key, "key")
         return Fernet(base64.urlsafe_b64encode(key))
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Cryptographer._reset_after_fork)
@@ -1,5 +1,18 @@
-from .__main__ import main
+from .api import EmbedParams, embed, extract
+from .async_api import AsyncStenographer
 
 __all__ = [
     "main",
+    "EmbedParams",
+    "embed",
+    "extract",
+    "AsyncStenographer",
 ]
+
+
+def __getattr__(name: str):
+    # The CLI is only imported once it is looked up, hence the library API does not import it
+    if name == "main":
+        from .__main__ import main
+        return main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,16 +1,42 @@
-import bz2
+import collections
+import concurrent.futures
 import functools
 import io
 import logging
+import os
+import pathlib
 import re
 import sys
+import tempfile
+import time
+from typing import Iterator, Optional, Union
 
 import click
 import cryptography.fernet
+import numpy as np
 from PIL import Image
 
 from SuperHelper.Core.Config import Config, pass_config
-from SuperHelper.Core.Utils import BitOps, Cryptographer
+from SuperHelper.Core.Utils import Cryptographer
+from SuperHelper.Modules.Stenographer.archive import ArchiveMember, is_archive, pack_archive, read_member, \
+    read_preamble, read_toc, read_toc_token
+from SuperHelper.Modules.Stenographer.archive import preamble_format as archive_preamble
+from SuperHelper.Modules.Stenographer.batch import BatchResult, create_jobs_from_directory, create_one, \
+    extract_jobs_from_directory, extract_one, find_images, read_manifest, run_batch, scan_images
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+from SuperHelper.Modules.Stenographer.carrier import MappedCarrier, decode_rows, load_pixels, load_region, \
+    open_carrier
+from SuperHelper.Modules.Stenographer.compression import available_codecs, choose_codec, compress, decompress, \
+    sample_file
+from SuperHelper.Modules.Stenographer.container import read_container, read_first_token, write_container
+from SuperHelper.Modules.Stenographer.header import AnyHeader, BinaryHeader, Header, KdfCostError, \
+    acceptable_kdf_costs, fix, kdf_cost_factor, parse_header
+from SuperHelper.Modules.Stenographer.key_trial import find_key, read_keys
+from SuperHelper.Modules.Stenographer.png_writer import png_presets, save_png
+from SuperHelper.Modules.Stenographer.pool import PoolEntry, choose_carrier, predict_length, save_index, \
+    update_index
+from SuperHelper.Modules.Stenographer.shard import payload_digest, shard_capacity, split_payload
+from SuperHelper.Modules.Stenographer.template import shared_templates
 
 MODULE_NAME: str = "Stenographer"
 pass_config_no_lock = functools.partial(pass_config, module_name=MODULE_NAME, lock=False)
@@ -19,141 +45,348 @@ __name__ = f"SuperHelper.Builtins.{MODULE_NAME}"
 logger = logging.getLogger(__name__)
 
 
-class Header:
-    """Provides for the preparation of the creation of steganography."""
+@pass_config_no_lock()
+def build_header(config: dict[str, ...], data_length: int, salt: str, compression: int, density: int,
+                 chunked: bool = False, aead: bool = False, binary: bool = False, codec: str = "bz2",
+                 key_check: bytes = None, kdf: str = Header.kdf, kdf_cost: int = Header.kdf_cost,
+                 shard_index: int = 0, shard_count: int = 0, digest: bytes = None) -> AnyHeader:
+    compression = config["default_compression"] if compression not in config["available_compression"] else compression
+    density = config["default_density"] if density not in config["available_density"] else density
+    if binary:
+        return BinaryHeader(data_length, compression, density, salt, chunked, aead, codec, key_check, kdf, kdf_cost,
+                            shard_index, shard_count, digest)
+    if codec != Header.codec:
+        raise ValueError(f"Codec '{codec}' requires the binary header!")
+    if (kdf, kdf_cost) != (Header.kdf, Header.kdf_cost):
+        raise ValueError("Key derivation function requires the binary header!")
+    if shard_count:
+        raise ValueError("Shards require the binary header!")
+    return Header(data_length, compression, density, salt, chunked, aead)
 
-    # Padding character, used when header is too short
-    # after writing all the required metadata
-    padding_character: str = "-"
 
-    # Separator is used to make regex easier
-    separator: str = "?"
+@pass_config()
+def patch_config(config: Config) -> None:
+    cfg = {
+        "available_compression": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+        "available_density": [1, 2, 3],
+        "default_compression": 9,
+        "default_codec": "bz2",
+        "default_density": 1,
+        "default_chunk_size": 0,
+        "flag_aead": False,
+        "default_jobs": 0,
+        "flag_binary_header": False,
+        "default_auth_key": "bGs21Gt@31",
+        "default_kdf": Cryptographer.default_kdf,
+        "default_kdf_cost": 0,
+        "maximum_kdf_cost_factor": kdf_cost_factor,
+        "default_png_preset": "default",
+        "flag_show_image_on_completion": False,
+        "flag_file_open_mode": "rb",
+    }
+    config.apply_module_patch(MODULE_NAME, cfg)
+
 
-    # Various types of length for the header
-    maximum_data_length: int = 8
-    maximum_flag_length: int = 3
-    salt_length: int = 24
-    separator_length: int = 2
-    header_length: int = maximum_data_length + maximum_flag_length + salt_length + separator_length
+def embed_data(input_file: io.IOBase, image_file: Image.Image, crypto: Cryptographer, codec: str, compression: int,
+               density: int, aead: bool, binary_header: bool) -> Optional[np.ndarray]:
+    data = input_file.read()
+    if data is None:
+        logger.error("Input file is not readable!")
+        return None
+    if len(data) == 0:
+        logger.error("Input file is empty or exhausted!")
+        return None
 
-    # Regex pattern of the header
-    # data_length?flag?salt
-    pattern: str = r"(\d{1,8})\?(\d{1,3})\?"
-    hash_pattern: str = r"((?:[A-Za-z0-9+/]{4})+(?:[A-Za-z0-9+/]{2}==" + \
-                        r"|[A-Za-z0-9+/]{3}=)?)"
-    padding_pattern: str = r"-*"
-    pattern: re.Pattern = re.compile(f"^{pattern + hash_pattern + padding_pattern}$")
+    data = compress(data, codec, compression)
+    return embed_payload(data, image_file, crypto, codec, compression, density, aead, binary_header)
 
-    def __str__(self) -> str:
-        """Returns the header."""
-        return self.header
 
-    def __repr__(self) -> str:
-        """Same as __str__, returns the header."""
-        return str(self)
+def embed_payload(data: bytes, image_file: Image.Image, crypto: Cryptographer, codec: str, compression: int,
+                  density: int, aead: bool, binary_header: bool, shard_index: int = 0, shard_count: int = 0,
+                  digest: bytes = None) -> Optional[np.ndarray]:
+    # Encrypts the compressed data and writes it after its header into the leading pixels
+    if aead:
+        data = crypto.encrypt_aead(data)
+    else:
+        data = crypto.encrypt(data)
+        data = fix(data)
+    # Craft the finished input_file
+    header = build_header(
+        data_length=len(data),
+        compression=compression,
+        density=density,
+        salt=crypto.get_salt_string(),
+        aead=aead,
+        binary=binary_header,
+        codec=codec,
+        key_check=crypto.get_key_check(),
+        kdf=crypto.kdf_name,
+        kdf_cost=crypto.kdf_cost,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        digest=digest,
+    )
+    # 2. Serialise header and prepend input_file with header
+    data = header.to_bytes() + data
+    # For Fernet tokens, only whole pixels are written, the bits of the trailing partial
+    # pixel fall into the padding appended by fix() and are discarded on extraction
+    return embed_bytes(data, image_file, density, not aead)
 
-    def __init__(self, data_length: int, compression: int, density: int,
-                 salt: str) -> None:
-        self.header: str = str()
-        self.data_length: int = data_length
-        self.compression: int = compression
-        self.density: int = density
-        self.salt: str = salt
 
-        self.generate()
+def embed_bytes(data: bytes, image_file: Image.Image, density: int, whole_pixels: bool = False) -> Optional[np.ndarray]:
+    # Writes the serialised header and data into the leading pixels
+    x_dim, y_dim = image_file.size
 
-    def generate(self) -> None:
-        """
-        Generates a header created from input_file given during
-        Header initialisation.
+    # Make sure there are enough space to store all bits
+    no_of_pixel = x_dim * y_dim
+    no_of_rgb = no_of_pixel * 3
+    no_of_storable_bit = no_of_rgb * density
+    no_of_stored_bit = len(data) * 8
+    if no_of_storable_bit < no_of_stored_bit:
+        # If there are not enough, raise error
+        logger.error("Data is too big to be stored!")
+        return None
 
-        There is no need to call this method, unless any metadata has been
-        modified after initialisation.
-        """
-        # Create a flag from compression level and density level.
-        # Bit 6 - 2: Compression level (0 (no compression) - 9)
-        # Bit 1 - 0: Density level (1 - 3)
-        flag = (self.compression << 2) + self.density
+    no_of_written_bit = no_of_stored_bit - no_of_stored_bit % (3 * density) if whole_pixels else no_of_stored_bit
+    try:
+        region = load_region(image_file, no_of_written_bit, density)
+        plane = BitPlane(region, density)
+    except Exception or BaseException:
+        logger.exception("Cannot load image_file file!")
+        return None
 
-        result_header = Header.separator.join(
-            (str(self.data_length), str(flag), self.salt))
+    plane.write(data, n_bits=no_of_written_bit)
+    return region
 
-        result_header += Header.padding_character * (Header.header_length - len(result_header))
 
-        assert Header.pattern.match(result_header)
+def embed_archive(input_files: list[io.IOBase], image_file: Image.Image, crypto: Cryptographer, codec: str,
+                  compression: int, density: int, aead: bool, binary_header: bool) -> Optional[np.ndarray]:
+    members = []
+    for input_file in input_files:
+        data = input_file.read()
+        if data is None:
+            logger.error("Input file is not readable!")
+            return None
+        members.append((pathlib.Path(getattr(input_file, "name", f"member{len(members)}")).name, data))
+    try:
+        data = pack_archive(members, crypto, codec, compression, aead)
+    except ValueError as ex:
+        logger.error(str(ex))
+        return None
+    # The archive is a container, which is told apart from the chunked container by its magic number
+    header = build_header(
+        data_length=len(members),
+        compression=compression,
+        density=density,
+        salt=crypto.get_salt_string(),
+        chunked=True,
+        aead=aead,
+        binary=binary_header,
+        codec=codec,
+        key_check=crypto.get_key_check(),
+        kdf=crypto.kdf_name,
+        kdf_cost=crypto.kdf_cost,
+    )
+    return embed_bytes(header.to_bytes() + data, image_file, density)
 
-        # Assign as a class attribute
-        self.header = result_header
 
+def embed_chunked_data(input_file: io.IOBase, image_file: Image.Image, crypto: Cryptographer, codec: str,
+                       compression: int, density: int, aead: bool, binary_header: bool,
+                       chunk_size: int) -> Optional[np.ndarray]:
+    # The number of pixels the container takes is only known once it is written, and pixels are stored column by
+    # column across all the rows, hence the whole carrier is loaded. Memory is bounded by the size of the carrier,
+    # only the input file is held one chunk at a time.
+    try:
+        pixels = load_pixels(image_file)
+        plane = BitPlane(pixels, density)
+    except Exception or BaseException:
+        logger.exception("Cannot load image_file file!")
+        return None
 
-def validate_header(b: bytes) -> bool:
+    # The container is streamed right after the header, which is written last
+    # since the number of chunks is only known at the end
+    header_length = BinaryHeader.header_length if binary_header else Header.header_length
     try:
-        s = str(b, "utf-8")
-        return True if Header.pattern.match(s) else False
-    except UnicodeDecodeError:
-        return False
+        no_of_chunk, no_of_bit = write_container(
+            input_file, plane, header_length * 8, crypto, codec, compression, chunk_size, aead)
+    except ValueError as ex:
+        logger.error(str(ex))
+        return None
+    header = build_header(
+        data_length=no_of_chunk,
+        compression=compression,
+        density=density,
+        salt=crypto.get_salt_string(),
+        chunked=True,
+        aead=aead,
+        binary=binary_header,
+        codec=codec,
+        key_check=crypto.get_key_check(),
+        kdf=crypto.kdf_name,
+        kdf_cost=crypto.kdf_cost,
+    )
+    plane.write(header.to_bytes())
 
+    _, columns = BitPlane.region_for(header_length * 8 + no_of_bit, density, pixels.shape[0])
+    return pixels[:, :columns]
 
-def fix(data: bytes, is_encrypt: bool = True) -> bytes:
-    if is_encrypt:
-        return data + b"++"
-    else:
-        return data[:-2]
+
+@pass_config_no_lock()
+def accepted_kdf_costs(config: dict[str, ...] = None) -> dict[str, int]:
+    # Costs of the key derivation read from headers are bounded by a few times the calibrated cost, or the default
+    # cost if it is higher, before any key is derived
+    calibrated_cost = config["default_kdf_cost"]
+    return acceptable_kdf_costs(config["maximum_kdf_cost_factor"],
+                                {config["default_kdf"]: calibrated_cost} if calibrated_cost else None)
 
 
 @pass_config_no_lock()
-def build_header(config: dict[str, ...], data_length: int, salt: str, compression: int, density: int) -> Header:
+def resolve_kdf(kdf: Optional[str], kdf_cost: Optional[int], config: dict[str, ...] = None) -> tuple[str, int]:
+    if kdf is None:
+        kdf = config["default_kdf"]
+    # The calibrated cost only applies to the default key derivation function
+    if kdf_cost is None and kdf == config["default_kdf"]:
+        kdf_cost = config["default_kdf_cost"] or None
+    kdf_cost = Cryptographer.default_kdf_costs.get(kdf) if kdf_cost is None else kdf_cost
+    if kdf_cost is not None and kdf_cost > accepted_kdf_costs().get(kdf, kdf_cost):
+        logger.warning(f"Cost of '{kdf}' is above the highest cost that steg extract accepts by default, "
+                       f"raise 'maximum_kdf_cost_factor' to extract the steganography!")
+    return kdf, kdf_cost
+
+
+@pass_config_no_lock()
+def write_steganography(input_file: Union[io.IOBase, list[io.IOBase]], image_file: Union[Image.Image, MappedCarrier],
+                        output_file: io.IOBase, auth_key: str,
+                        compression: int, density: int, show_image_on_completion: bool, chunk_size: int = None,
+                        aead: bool = None, binary_header: bool = None, codec: str = None, kdf: str = None,
+                        kdf_cost: int = None, png_preset: str = None, config: dict[str, ...] = None) -> int:
+    auth_key = config["default_auth_key"] if auth_key is None else auth_key
     compression = config["default_compression"] if compression not in config["available_compression"] else compression
     density = config["default_density"] if density not in config["available_density"] else density
-    return Header(data_length, compression, density, salt)
+    show_image_on_completion = config["flag_show_image_on_completion"] \
+        if show_image_on_completion is None else show_image_on_completion
+    chunk_size = config["default_chunk_size"] if chunk_size is None else chunk_size
+    aead = config["flag_aead"] if aead is None else aead
+    codec = config["default_codec"] if codec is None else codec
+    kdf, kdf_cost = resolve_kdf(kdf, kdf_cost)
+    png_preset = config["default_png_preset"] if png_preset is None else png_preset
+    if png_preset not in png_presets:
+        logger.error(f"Unknown PNG preset '{png_preset}'!")
+        return 1
 
+    # Many input files are embedded as an archive
+    input_files = input_file if isinstance(input_file, list) else [input_file]
+    if len(input_files) > 1 and chunk_size > 0:
+        logger.error("Many input files cannot be streamed as a chunked container!")
+        return 1
+    for file in input_files:
+        file.seek(0)
+    if codec == "auto":
+        # Sample the input files to skip compression or to pick the codec
+        candidates = available_codecs() if binary_header is not False else [Header.codec]
+        sample = b"".join(sample_file(file, (1 << 18) // len(input_files)) for file in input_files)
+        codec, compression = choose_codec(sample, compression, candidates)
+    elif codec not in available_codecs():
+        logger.error(f"Codec '{codec}' is not available!")
+        return 1
+    # Codecs other than bzip2 and other key derivations can only be recorded in the binary header
+    if binary_header is None:
+        binary_header = config["flag_binary_header"] or codec != Header.codec or \
+                        (kdf, kdf_cost) != (Header.kdf, Header.kdf_cost)
+    elif not binary_header and codec != Header.codec:
+        logger.error(f"Codec '{codec}' requires the binary header!")
+        return 1
+    elif not binary_header and (kdf, kdf_cost) != (Header.kdf, Header.kdf_cost):
+        logger.error("Key derivation function requires the binary header!")
+        return 1
 
-def parse_header(b: bytes) -> Header:
-    if not validate_header(b):
-        raise ValueError("Invalid header!")
+    try:
+        crypto = Cryptographer.make_encrypter(Cryptographer.encode_salt(Cryptographer.make_salt()), auth_key, kdf,
+                                              kdf_cost)
+    except (KeyError, ValueError) as ex:
+        logger.error(str(ex))
+        return 1
 
-    header_match = Header.pattern.match(str(b, "utf-8"))
+    if len(input_files) > 1:
+        region = embed_archive(input_files, image_file, crypto, codec, compression, density, aead, binary_header)
+    elif chunk_size > 0:
+        # Stream the input file as a chunked container
+        region = embed_chunked_data(input_files[0], image_file, crypto, codec, compression, density, aead,
+                                    binary_header, chunk_size)
+    else:
+        region = embed_data(input_files[0], image_file, crypto, codec, compression, density, aead, binary_header)
+    if region is None:
+        return 1
 
-    hdr_data_length = int(header_match[1])
-    hdr_flag = int(header_match[2])
-    hdr_salt = header_match[3]
-    hdr_density = hdr_flag & 0b11
-    hdr_compression = (hdr_flag - hdr_density) >> 2
+    try:
+        if isinstance(image_file, MappedCarrier):
+            # The data is already written into the mapped copy of the carrier
+            image_file.flush()
+        else:
+            image_file.paste(Image.fromarray(region), (0, 0))
+            save_png(image_file, output_file, png_preset)
+    except OSError:
+        logger.exception("Cannot save image_file to output_file file!")
+        return 1
 
-    # Build and return a Header object
-    return build_header(
-        data_length=hdr_data_length,
-        compression=hdr_compression,
-        density=hdr_density,
-        salt=hdr_salt
-    )
+    if show_image_on_completion:
+        (image_file.to_image() if isinstance(image_file, MappedCarrier) else image_file).show("Demo")
 
+    for file in input_files:
+        file.close()
+    image_file.close()
+    output_file.close()
 
-@pass_config()
-def patch_config(config: Config) -> None:
-    cfg = {
-        "available_compression": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
-        "available_density": [1, 2, 3],
-        "default_compression": 9,
-        "default_density": 1,
-        "default_auth_key": "bGs21Gt@31",
-        "flag_show_image_on_completion": False,
-        "flag_file_open_mode": "rb",
-    }
-    config.apply_module_patch(MODULE_NAME, cfg)
+    return 0
+
+
+def write_shard(data: bytes, image_file: Image.Image, output_file: io.IOBase, crypto: Cryptographer, codec: str,
+                compression: int, density: int, aead: bool, shard_index: int, shard_count: int, digest: bytes,
+                png_preset: str) -> int:
+    region = embed_payload(data, image_file, crypto, codec, compression, density, aead, True, shard_index,
+                           shard_count, digest)
+    if region is None:
+        return 1
+
+    image_file.paste(Image.fromarray(region), (0, 0))
+
+    try:
+        save_png(image_file, output_file, png_preset)
+    except OSError:
+        logger.exception("Cannot save image_file to output_file file!")
+        return 1
+
+    image_file.close()
+    output_file.close()
+    return 0
 
 
 @pass_config_no_lock()
-def write_steganography(input_file: io.IOBase, image_file: Image.Image, output_file: io.IOBase, auth_key: str,
-                        compression: int, density: int, show_image_on_completion: bool,
-                        config: dict[str, ...] = None) -> int:
+def write_sharded_steganography(input_file: io.IOBase, image_files: list[Image.Image], output_files: list[io.IOBase],
+                                auth_key: str, compression: int, density: int, aead: bool = None, codec: str = None,
+                                kdf: str = None, kdf_cost: int = None, max_workers: int = 0, png_preset: str = None,
+                                config: dict[str, ...] = None) -> int:
     auth_key = config["default_auth_key"] if auth_key is None else auth_key
     compression = config["default_compression"] if compression not in config["available_compression"] else compression
     density = config["default_density"] if density not in config["available_density"] else density
-    show_image_on_completion = config["flag_show_image_on_completion"] \
-        if show_image_on_completion is None else show_image_on_completion
+    aead = config["flag_aead"] if aead is None else aead
+    codec = config["default_codec"] if codec is None else codec
+    kdf, kdf_cost = resolve_kdf(kdf, kdf_cost)
+    png_preset = config["default_png_preset"] if png_preset is None else png_preset
+    if png_preset not in png_presets:
+        logger.error(f"Unknown PNG preset '{png_preset}'!")
+        return 1
 
+    if not 0 < len(image_files) <= BinaryHeader.maximum_shard_count:
+        logger.error(f"Number of carrier images must be from 1 to {BinaryHeader.maximum_shard_count}!")
+        return 1
     input_file.seek(0)
+    if codec == "auto":
+        codec, compression = choose_codec(sample_file(input_file), compression)
+    elif codec not in available_codecs():
+        logger.error(f"Codec '{codec}' is not available!")
+        return 1
+
     data = input_file.read()
     if data is None:
         logger.error("Input file is not readable!")
@@ -161,216 +394,470 @@ def write_steganography(input_file: io.IOBase, image_file: Image.Image, output_f
     if len(data) == 0:
         logger.error("Input file is empty or exhausted!")
         return 1
+    # The payload is compressed as a whole, then split, hence every shard is needed to decompress it
+    digest = payload_digest(data, BinaryHeader.digest_length)
+    data = compress(data, codec, compression)
+    capacities = [shard_capacity(image.size, density, BinaryHeader.header_length, aead) for image in image_files]
+    if min(capacities) < 0:
+        logger.error("Image is too small to hold a shard!")
+        return 1
+    try:
+        shards = split_payload(data, capacities)
+    except ValueError as ex:
+        logger.error(str(ex))
+        return 1
 
-    if compression > 0:
-        # Compress using the builtin bzip2 library
-        data = bz2.compress(data, compresslevel=compression)
-
-    crypto = Cryptographer.make_encrypter(Cryptographer.encode_salt(Cryptographer.make_salt()), auth_key)
-    data = crypto.encrypt(data)
-    data = fix(data)
-    # Craft the finished input_file
-    header = build_header(
-        data_length=len(data),
-        compression=compression,
-        density=density,
-        salt=crypto.get_salt_string(),
-    )
-    # 2. Serialise header and prepend input_file with header
-    data = bytes(header.header, "utf-8") + data
-
+    # All the shards share the salt, hence the key is derived once
     try:
-        pix = image_file.load()
-    except Exception or BaseException:
-        logger.exception("Cannot load image_file file!")
+        crypto = Cryptographer.make_encrypter(Cryptographer.encode_salt(Cryptographer.make_salt()), auth_key, kdf,
+                                              kdf_cost)
+    except (KeyError, ValueError) as ex:
+        logger.error(str(ex))
         return 1
 
-    x_dim, y_dim = image_file.size
+    # Encryption, pixel writes and PNG compression mostly release the GIL
+    with concurrent.futures.ThreadPoolExecutor(max_workers or None) as executor:
+        futures = [executor.submit(write_shard, shard, image_file, output_file, crypto, codec, compression, density,
+                                   aead, index, len(shards), digest, png_preset)
+                   for index, (shard, image_file, output_file) in enumerate(zip(shards, image_files, output_files))]
+        return_codes = [future.result() for future in futures]
 
-    # Make sure there are enough space to store all bits
-    no_of_pixel = x_dim * y_dim
-    no_of_rgb = no_of_pixel * 3
-    no_of_storable_bit = no_of_rgb * density
-    no_of_stored_bit = len(data) * 8
-    if no_of_storable_bit < no_of_stored_bit:
-        # If there are not enough, raise error
-        logger.error("Data is too big to be stored!")
+    input_file.close()
+    return 1 if any(return_codes) else 0
+
+
+@pass_config_no_lock()
+def update_steganography(input_file: io.IOBase, steganography: os.PathLike, output_path: os.PathLike,
+                         auth_key: str, png_preset: str = None, raw_size: tuple[int, int] = None,
+                         config: dict[str, ...] = None) -> int:
+    png_preset = config["default_png_preset"] if png_preset is None else png_preset
+    if png_preset not in png_presets:
+        logger.error(f"Unknown PNG preset '{png_preset}'!")
+        return 1
+    try:
+        image = open_carrier(steganography) if raw_size is None else \
+            MappedCarrier.open(steganography, raw_size=raw_size)
+    except Image.UnidentifiedImageError:
+        logger.exception(f"Not an image file!")
+        return 1
+    except (OSError, ValueError):
+        logger.exception("Cannot map steganography file!")
         return 1
 
-    x, y, count, bit_loc = 0, 0, 0, density - 1
-    current_pix = list(pix[0, 0])
-
-    # Firstly, iterate through all the bytes to be written
-    for byte in data:
-        # Secondly, iterate through all the bits of the given byte
-        for i in range(8):
-            # Thirdly, check if the bit is set
-            # If bit is set
-            if BitOps.is_bit_set(byte, i):
-                # Check if the bit at the current location in the image_file is set
-                # If unset then set it, otherwise unchanged
-                current_pix[count] = BitOps.set_bit(current_pix[count], bit_loc)
-            # If bit is unset
-            else:
-                # Check if the bit at the current location in the image_file is set
-                # If set then unset it, otherwise unchanged
-                current_pix[count] = BitOps.unset_bit(current_pix[count], bit_loc)
-            # Move to the next bit
-            # by decrementing index
-            bit_loc -= 1
-            # If reached the final bit
-            if bit_loc == -1:
-                # Move to the next integer
-                # by incrementing the count
-                count += 1
-                # Reset density
-                bit_loc = density - 1
-                # If reached the last RGB
-                if count == 3:
-                    # Save pixel
-                    pix[x, y] = tuple(current_pix)
-                    # Reset count
-                    count = 0
-                    y += 1
-                    # If the entire row of pixel is written
-                    if y == y_dim:
-                        # Move on to the next row and reset
-                        y = 0
-                        x += 1
-                    # Request new pixel to be written
-                    current_pix = list(pix[x, y])
+    header = find_header(image)
+    if header is None:
+        return 1
+    if header.chunked or header.shard_count:
+        logger.error("Only steganography of a single payload can be updated!")
+        return 1
+    # The new data is encrypted with the salt and the key derivation of the header, hence the key is derived once
+    crypto = Cryptographer.make_decrypter(header.salt, auth_key, header.kdf, header.kdf_cost)
+    if header.key_check is not None:
+        if not check_header_key(header, crypto):
+            return 1
+    else:
+        # Without key-check value, the key is checked against the old payload
+        payload = read_payload(image, header)
+        try:
+            crypto.decrypt_aead(payload) if header.aead else crypto.decrypt(fix(payload, False))
+        except cryptography.fernet.InvalidToken:
+            logger.exception("Invalid authentication key!")
+            return 1
 
+    data = input_file.read()
+    if data is None:
+        logger.error("Input file is not readable!")
+        return 1
+    if len(data) == 0:
+        logger.error("Input file is empty or exhausted!")
+        return 1
+    crypto = Cryptographer.make_encrypter(header.salt, auth_key, header.kdf, header.kdf_cost)
+    data = compress(data, header.codec, header.compression)
+
+    output_path = pathlib.Path(output_path)
+    if isinstance(image, MappedCarrier) and not image.has_suffix_of(output_path):
+        # As with `steg create`, mapped steganography keeps its format only if the output file has its suffix
+        mapped, image = image, image.to_image()
+        mapped.close()
+    # Save next to the output file, so that it is only replaced once the rewritten range reads back the same
+    fd, temp_path = tempfile.mkstemp(output_path.suffix if isinstance(image, MappedCarrier) else ".png",
+                                     f".{output_path.name}.", output_path.parent)
+    os.close(fd)
     try:
-        image_file.save(output_file, "png")
+        if isinstance(image, MappedCarrier):
+            return_code = rewrite_mapped_steganography(data, image, temp_path, crypto, header)
+        else:
+            return_code = rewrite_steganography(data, image, temp_path, crypto, header, png_preset)
+        if return_code != 0:
+            return return_code
+        image.close()
+        os.replace(temp_path, output_path)
     except OSError:
         logger.exception("Cannot save image_file to output_file file!")
         return 1
-
-    if show_image_on_completion:
-        image_file.show("Demo")
+    finally:
+        pathlib.Path(temp_path).unlink(missing_ok=True)
 
     input_file.close()
-    image_file.close()
-    output_file.close()
+    return 0
+
 
+def rewrite_steganography(data: bytes, image: Image.Image, temp_path: str, crypto: Cryptographer, header: AnyHeader,
+                          png_preset: str) -> int:
+    # Only the leading pixels that the new payload occupies are loaded and rewritten, within the capacity of the
+    # carrier at the density of the header. The pixels of a longer old payload beyond them are left as they are.
+    region = embed_payload(data, image, crypto, header.codec, header.compression, header.density, header.aead,
+                           isinstance(header, BinaryHeader))
+    if region is None:
+        return 1
+    image.paste(Image.fromarray(region), (0, 0))
+    with open(temp_path, "wb") as temp_file:
+        save_png(image, temp_file, png_preset)
+    with Image.open(temp_path) as saved:
+        rows, columns = region.shape[:2]
+        if not np.array_equal(decode_rows(saved, rows)[:, :columns], region):
+            logger.error("Steganography cannot be verified after the update!")
+            return 1
+    return 0
+
+
+def rewrite_mapped_steganography(data: bytes, image: MappedCarrier, temp_path: str, crypto: Cryptographer,
+                                 header: AnyHeader) -> int:
+    # The file is copied and only the pixels of the new payload are rewritten in the mapped copy, keeping its format
+    copy = image.copy_to(temp_path)
+    try:
+        region = embed_payload(data, copy, crypto, header.codec, header.compression, header.density, header.aead,
+                               isinstance(header, BinaryHeader))
+        if region is None:
+            return 1
+        region = region.copy()
+    finally:
+        copy.close()
+    saved = image.map_file(temp_path)
+    try:
+        rows, columns = region.shape[:2]
+        if not np.array_equal(saved.pixels[:rows, :columns], region):
+            logger.error("Steganography cannot be verified after the update!")
+            return 1
+    finally:
+        saved.close()
     return 0
 
 
 @pass_config_no_lock()
-def extract_header(image: Image.Image, config: dict[str, ...] = None) -> Header:
-    pix = image.load()
-    y_dim = image.size[1]
-    x, y, count = 0, 0, 0
-    result_data = b""
-    density = 1
-
-    # Firstly, the header is retrieved by reading for its known length.
-    # Since the density is unknown, check all density one by one.
-    while density in config["available_density"]:
-        bit_loc = density - 1
-        while len(result_data) < Header.header_length:
-            byte = 0
-            # Read every single bit
-            # Iterate through every single bit of the byte
-            for i in range(8):
-                # If bit is set, set the corresponding bit of 'byte'
-                if BitOps.is_bit_set(pix[x, y][count], bit_loc):
-                    byte = BitOps.set_bit(byte, i)
-                # Move to the next bit by decrement bit index
-                bit_loc -= 1
-                # If all readable bits of the colour integer are consumed
-                if bit_loc == -1:
-                    # Move to the next RGB and reset the bit index
-                    count += 1
-                    bit_loc = density - 1
-                    # If the entire pixel is read
-                    if count == 3:
-                        # Move to the next pixel in the row and reset the count
-                        count = 0
-                        y += 1
-                        # If the entire row of pixels is read
-                        if y == y_dim:
-                            # Move to the next row and reset row index
-                            y = 0
-                            x += 1
-            # Convert the single byte (integer) to bytes
-            # By design, the resulting input_file is strictly stored in 1 byte
-            # and endianness does not matter since it is only 1 byte
-            result_data += byte.to_bytes(1, "big")
-        # If header is invalid
-        # e.g wrong density
+def extract_header(image: Image.Image, config: dict[str, ...] = None) -> Optional[AnyHeader]:
+    # The header is retrieved by reading for its known length. Since the density is unknown,
+    # the leading pixels are loaded once and the header is read for all densities at once.
+    densities = config["available_density"]
+    header_length = max(Header.header_length, BinaryHeader.header_length)
+    region = load_region(image, header_length * 8, min(densities))
+    candidates = BitPlane.read_leading(region, header_length, densities)
+    maximum_kdf_costs = accepted_kdf_costs()
+    for density in densities:
         try:
-            # Invalid header has undecodable byte
-            return parse_header(result_data)
+            # Invalid header has undecodable byte, e.g. wrong density
+            return parse_header(candidates[density], density, maximum_kdf_costs)
+        except KdfCostError:
+            # The checksum of the header matched, hence the density is right and the header is refused
+            raise
         except ValueError:
             # Hence, switch to the next possible density
-            # Reset all values to original
-            density += 1
-            result_data = b""
-            x, y, count = 0, 0, 0
+            continue
 
 
-def extract_steganography(input_file: io.IOBase, output_file: io.IOBase, auth_key: str) -> int:
+def find_header(image: Image.Image) -> Optional[AnyHeader]:
+    # Logs why no header is found
     try:
-        image = Image.open(input_file)
+        header = extract_header(image)
+    except KdfCostError:
+        logger.exception("Steganography is refused!")
+        return None
+    if header is None:
+        logger.error("No steganography found!")
+    return header
+
+
+def check_header_key(header: AnyHeader, crypto: Cryptographer) -> bool:
+    # Rejects a wrong key by the key-check value of the header, before any payload pixel is read
+    if header.key_check is not None and not crypto.verify_key_check(header.key_check):
+        logger.error("Invalid authentication key!")
+        return False
+    return True
+
+
+def check_header_shard(header: AnyHeader) -> bool:
+    # A shard of many cannot be extracted on its own
+    if header.shard_count > 1:
+        logger.error(f"Steganography is shard {header.shard_index + 1} of {header.shard_count}, "
+                     f"extract all the shards together!")
+        return False
+    return True
+
+
+def extract_steganography(input_file: io.IOBase, output_file: io.IOBase, auth_key: str, member: str = None) -> int:
+    try:
+        image = open_carrier(input_file)
+    except Image.UnidentifiedImageError:
+        logger.exception(f"Not an image file!")
+        return 1
+
+    header = find_header(image)
+    if header is None:
+        return 1
+    if not check_header_shard(header):
+        return 1
+    # The key is derived while the payload is decoded, unless it can be checked beforehand
+    crypto_future = Cryptographer.make_future(header.salt, auth_key, False, header.kdf, header.kdf_cost)
+    if header.key_check is not None and not check_header_key(header, crypto_future.result()):
+        return 1
+    if header.chunked and is_archive_steganography(image, header):
+        return extract_archive_member(image, header, output_file, crypto_future.result(), member)
+    if member is not None:
+        logger.error("Steganography is not an archive!")
+        return 1
+    if header.chunked:
+        # The whole carrier is loaded, since the length of the container is unknown, but only one chunk of the
+        # output file is held at a time
+        plane = BitPlane(load_pixels(image), header.density)
+        return extract_chunked_steganography(plane, header, output_file, crypto_future.result())
+    payload = read_payload(image, header)
+    return decrypt_payload(header, payload, crypto_future.result(), output_file)
+
+
+def extract_steganography_with_keys(input_file: io.IOBase, output_file: io.IOBase, keys: list[str],
+                                    max_workers: int = 0, member: str = None) -> tuple[int, Optional[str]]:
+    try:
+        image = open_carrier(input_file)
+    except Image.UnidentifiedImageError:
+        logger.exception(f"Not an image file!")
+        return 1, None
+
+    header = find_header(image)
+    if header is None:
+        return 1, None
+    if not check_header_shard(header):
+        return 1, None
+    # The payload is decoded once, whatever the number of keys
+    plane = payload = probe = None
+    archive = header.chunked and is_archive_steganography(image, header)
+    if member is not None and not archive:
+        logger.error("Steganography is not an archive!")
+        return 1, None
+    try:
+        if archive:
+            if header.key_check is None:
+                # Testing a key only needs the table of contents
+                probe = read_toc_token(BitPlane(load_pixels(image), header.density), header.header_length * 8)
+        elif header.chunked:
+            plane = BitPlane(load_pixels(image), header.density)
+            if header.key_check is None:
+                # Testing a key only needs the first chunk
+                probe = read_first_token(plane, header.header_length * 8)
+        else:
+            payload = read_payload(image, header)
+            if header.key_check is None:
+                probe = payload if header.aead else fix(payload, False)
+    except ValueError:
+        logger.exception("Data is corrupted!")
+        return 1, None
+
+    key = find_key(keys, header.salt, probe, header.key_check, header.aead, header.kdf, header.kdf_cost,
+                   max_workers)
+    if key is None:
+        logger.error("None of the keys is valid!")
+        return 1, None
+    crypto = Cryptographer.make_decrypter(header.salt, key, header.kdf, header.kdf_cost)
+    if archive:
+        return extract_archive_member(image, header, output_file, crypto, member), key
+    if header.chunked:
+        return extract_chunked_steganography(plane, header, output_file, crypto), key
+    return decrypt_payload(header, payload, crypto, output_file), key
+
+
+def extract_sharded_steganography(input_files: list[io.IOBase], output_file: io.IOBase, auth_key: str,
+                                  max_workers: int = 0) -> int:
+    images = []
+    headers = []
+    for input_file in input_files:
+        try:
+            image = open_carrier(input_file)
+        except Image.UnidentifiedImageError:
+            logger.exception(f"Not an image file!")
+            return 1
+        try:
+            header = extract_header(image)
+        except KdfCostError:
+            logger.exception("Steganography is refused!")
+            return 1
+        if header is None or not header.shard_count:
+            logger.error(f"No shard found in {getattr(input_file, 'name', 'input file')}!")
+            return 1
+        images.append(image)
+        headers.append(header)
+
+    # The shards may come in any order, but must all be there, once each
+    first = headers[0]
+    common_fields = (first.shard_count, first.digest, first.salt, first.kdf, first.kdf_cost, first.codec,
+                     first.compression, first.aead)
+    if any((header.shard_count, header.digest, header.salt, header.kdf, header.kdf_cost, header.codec,
+            header.compression, header.aead) != common_fields for header in headers):
+        logger.error("Shards belong to different steganography!")
+        return 1
+    indices = [header.shard_index for header in headers]
+    if sorted(indices) != list(range(first.shard_count)):
+        logger.error(f"Shards are missing or duplicated, "
+                     f"found {len(set(indices))} of {first.shard_count} shards!")
+        return 1
+
+    crypto_future = Cryptographer.make_future(first.salt, auth_key, False, first.kdf, first.kdf_cost)
+    if first.key_check is not None and not check_header_key(first, crypto_future.result()):
+        return 1
+
+    def read_shard(image: Image.Image, header: AnyHeader) -> bytes:
+        payload = read_payload(image, header)
+        crypto = crypto_future.result()
+        return crypto.decrypt_aead(payload) if header.aead else crypto.decrypt(fix(payload, False))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers or None) as executor:
+        try:
+            shards = list(executor.map(read_shard, images, headers))
+        except cryptography.fernet.InvalidToken:
+            logger.exception("Invalid authentication key!")
+            return 1
+        except ValueError:
+            logger.exception("Data is corrupted!")
+            return 1
+    result_data = b"".join(shard for _, shard in sorted(zip(indices, shards), key=lambda item: item[0]))
+
+    try:
+        result_data = decompress(result_data, first.codec, first.compression)
+    except ValueError:
+        logger.exception("Data cannot be decompressed!")
+        return 1
+    if payload_digest(result_data, BinaryHeader.digest_length) != first.digest:
+        logger.error("Data is corrupted!")
+        return 1
+
+    try:
+        output_file.write(result_data)
+        output_file.close()
+    except IOError:
+        logger.exception("Data cannot be writen")
+        return 1
+
+    return 0
+
+
+def is_archive_steganography(image: Image.Image, header: AnyHeader) -> bool:
+    # Archives and chunked containers share the chunked flag, and are told apart by their magic number
+    offset = header.header_length * 8
+    try:
+        plane = BitPlane(load_region(image, offset + archive_preamble.size * 8, header.density), header.density)
+        return is_archive(plane, offset)
+    except ValueError:
+        return False
+
+
+def read_archive_toc(image: Image.Image, header: AnyHeader, crypto: Cryptographer) -> Optional[list[ArchiveMember]]:
+    # Only the pixels of the preamble and of the table of contents are decoded
+    offset = header.header_length * 8
+    capacity = image.size[0] * image.size[1] * 3 * header.density
+    try:
+        plane = BitPlane(load_region(image, offset + archive_preamble.size * 8, header.density), header.density)
+        position, toc_length = read_preamble(plane, offset)
+        if position + toc_length * 8 > capacity:
+            raise ValueError("Table of contents exceeds the capacity of the carrier!")
+        plane = BitPlane(load_region(image, position + toc_length * 8, header.density), header.density)
+        return read_toc(plane, offset, crypto, header.aead)
+    except cryptography.fernet.InvalidToken:
+        logger.exception("Invalid authentication key!")
+    except ValueError:
+        logger.exception("Data is corrupted!")
+    return None
+
+
+def list_steganography(input_file: io.IOBase, auth_key: str) -> Optional[list[ArchiveMember]]:
+    try:
+        image = open_carrier(input_file)
     except Image.UnidentifiedImageError:
         logger.exception(f"Not an image file!")
+        return None
+
+    header = find_header(image)
+    if header is None:
+        return None
+    crypto = Cryptographer.make_decrypter(header.salt, auth_key, header.kdf, header.kdf_cost)
+    if not check_header_key(header, crypto):
+        return None
+    if not header.chunked or not is_archive_steganography(image, header):
+        logger.error("Steganography is not an archive!")
+        return None
+    return read_archive_toc(image, header, crypto)
+
+
+def extract_archive_member(image: Image.Image, header: AnyHeader, output_file: io.IOBase, crypto: Cryptographer,
+                           member: Optional[str]) -> int:
+    members = read_archive_toc(image, header, crypto)
+    if members is None:
+        return 1
+    if member is None:
+        logger.error(f"Steganography is an archive of {len(members)} members, extract one member at a time!")
+        return 1
+    found = next((archive_member for archive_member in members if archive_member.name == member), None)
+    if found is None:
+        logger.error(f"No member '{member}' found!")
+        return 1
+
+    # Only the pixels up to the end of the member are loaded, and only those of the member are decoded
+    end = found.position + found.token_length * 8
+    if end > image.size[0] * image.size[1] * 3 * header.density:
+        logger.error("Data is corrupted!")
+        return 1
+    try:
+        plane = BitPlane(load_region(image, end, header.density), header.density)
+        result_data = read_member(plane, found, crypto, header.codec, header.compression, header.aead)
+    except cryptography.fernet.InvalidToken:
+        logger.exception("Invalid authentication key!")
+        return 1
+    except ValueError:
+        logger.exception("Data is corrupted!")
+        return 1
+
+    try:
+        output_file.write(result_data)
+        output_file.close()
+    except IOError:
+        logger.exception("Data cannot be writen")
         return 1
 
-    header = extract_header(image)
-    pix = image.load()
-    y_dim = image.size[1]
-    data_length = Header.header_length + header.data_length
-    x, y, count = 0, 0, 0
-    result_data = b""
-    bit_loc = header.density - 1
-
-    # Attempt to read input_file
-    while len(result_data) < data_length:
-        byte = 0
-        # Read every single bit
-        # Iterate through every single bit of the byte
-        for i in range(8):
-            # If bit is set, set the corresponding bit of 'byte'
-            if BitOps.is_bit_set(pix[x, y][count], bit_loc):
-                byte = BitOps.set_bit(byte, i)
-            # Move to the next bit by decrement bit index
-            bit_loc -= 1
-            # If all readable bits of the colour integer are consumed
-            if bit_loc == -1:
-                # Move to the next RGB and reset the bit index
-                count += 1
-                bit_loc = header.density - 1
-                # If the entire pixel is read
-                if count == 3:
-                    # Move to the next pixel in the row and reset the count
-                    count = 0
-                    y += 1
-                    # If the entire row of pixels is read
-                    if y == y_dim:
-                        # Move to the next row and reset row index
-                        y = 0
-                        x += 1
-        # Convert the single byte (integer) to bytes
-        # By design, the resulting input_file is strictly stored in 1 byte
-        # and endianness does not matter since it is only 1 byte
-        result_data += byte.to_bytes(1, "big")
+    return 0
+
 
+def read_payload(image: Image.Image, header: AnyHeader) -> bytes:
+    data_length = header.header_length + header.data_length
+    plane = BitPlane(load_region(image, data_length * 8, header.density), header.density)
     # Strip header by slicing its known length
-    result_data = result_data[Header.header_length:]
-    result_data = fix(result_data, False)
+    return plane.read(data_length)[header.header_length:]
+
+
+def decrypt_payload(header: AnyHeader, result_data: bytes, crypto: Cryptographer, output_file: io.IOBase) -> int:
     # Decrypt input_file
-    crypto = Cryptographer.make_decrypter(header.salt, auth_key)
     try:
         # 5. Store decrypted input_file
-        result_data = crypto.decrypt(result_data)
+        if header.aead:
+            result_data = crypto.decrypt_aead(result_data)
+        else:
+            result_data = crypto.decrypt(fix(result_data, False))
     except cryptography.fernet.InvalidToken:
         logger.exception("Invalid authentication key!")
         return 1
 
     # If compressed (as indicated by the header), decompress it
-    if header.compression > 0:
-        result_data = bz2.decompress(result_data)
+    try:
+        result_data = decompress(result_data, header.codec, header.compression)
+    except ValueError:
+        logger.exception("Data cannot be decompressed!")
+        return 1
 
     # Write input_file to output_file file objects
     # Iterate through all file objects
@@ -384,23 +871,36 @@ def extract_steganography(input_file: io.IOBase, output_file: io.IOBase, auth_ke
     return 0
 
 
+def extract_chunked_steganography(plane: BitPlane, header: AnyHeader, output_file: io.IOBase,
+                                  crypto: Cryptographer) -> int:
+    try:
+        no_of_chunk = read_container(plane, header.header_length * 8, crypto, header.codec, header.compression,
+                                     header.aead, output_file)
+    except cryptography.fernet.InvalidToken:
+        logger.exception("Invalid authentication key!")
+        return 1
+    except ValueError:
+        logger.exception("Data is corrupted!")
+        return 1
+    except IOError:
+        logger.exception("Data cannot be writen")
+        return 1
+    if no_of_chunk != header.data_length:
+        logger.error("Data is corrupted!")
+        return 1
+
+    output_file.close()
+    return 0
+
+
 @click.group("steg")
 def main() -> None:
     """Applies steganography on images."""
     patch_config()
 
 
-@main.command("create", help="Creates steganography")
-@click.option("-i", "--image_file", help="Path to custom image_file file", type=click.File("rb"), required=True)
-@click.option("-k", "--key", help="The authentication key", type=str)
-@click.option("-c", "--compress", help="Compression level of the steganography", type=int, default=-1)
-@click.option("-d", "--density", help="Density of the steganography (from 1 to 3)", type=int, default=-1)
-@click.option("-o", "--output_file", help="Path to output file", type=click.File("wb"), required=True)
-@click.option("--show-image", help="Whether to show image_file on creation", type=bool, default=False)
-@click.argument("input_file", type=click.File("rb"), required=True)
-@pass_config_no_lock()
-def create(image_file: io.IOBase, key: str, compress: int, density: int, output_file: io.IOBase, show_image: bool,
-           input_file: io.IOBase, config: dict[str, ...]) -> None:
+def validate_create_options(config: dict[str, ...], compress: int, density: int,
+                            chunk_size: int) -> tuple[int, int, int]:
     density = config["default_density"] if density == -1 else density
     if density not in config["available_density"]:
         raise click.exceptions.BadOptionUsage(
@@ -410,28 +910,452 @@ def create(image_file: io.IOBase, key: str, compress: int, density: int, output_
     if compress not in config["available_compression"]:
         raise click.exceptions.BadOptionUsage(
             "density", "Density must be from 0 (no compress) to 9!")
-    key = config["default_auth_key"] if key is None else key
+    chunk_size = config["default_chunk_size"] if chunk_size == -1 else chunk_size
+    if chunk_size < 0:
+        raise click.exceptions.BadOptionUsage(
+            "chunk_size", "Chunk size must not be negative!")
+    return compress, density, chunk_size
+
+
+def validate_batch_source(manifest: Optional[str], input_dir: Optional[str], output_dir: Optional[str]) -> None:
+    if manifest is None and (input_dir is None or output_dir is None):
+        raise click.exceptions.BadOptionUsage(
+            "manifest", "Either a manifest or both input and output directories are required!")
+    if manifest is not None and input_dir is not None:
+        raise click.exceptions.BadOptionUsage(
+            "manifest", "A manifest cannot be used with directories!")
+
+
+def validate_jobs(config: dict[str, ...], jobs: int) -> int:
+    jobs = config["default_jobs"] if jobs == -1 else jobs
+    if jobs < 0:
+        raise click.exceptions.BadOptionUsage(
+            "jobs", "Number of jobs must not be negative!")
+    return jobs
+
+
+def report_batch(results: Iterator[BatchResult]) -> int:
+    # Prints the result of every job as it completes, then the aggregate throughput
+    started = time.perf_counter()
+    no_of_ok = no_of_failed = total_size = 0
+    for result in results:
+        if result.ok:
+            no_of_ok += 1
+            total_size += result.size
+            click.echo(f"OK     {result.path} ({result.size} bytes in {result.elapsed:.3f}s)")
+        else:
+            no_of_failed += 1
+            click.echo(f"FAILED {result.path}: {result.message}")
+    elapsed = time.perf_counter() - started
+    throughput = total_size / elapsed / (1 << 20) if elapsed > 0 else 0.0
+    click.echo(f"{no_of_ok} succeeded, {no_of_failed} failed, {total_size} bytes in {elapsed:.3f}s "
+               f"({throughput:.2f} MiB/s)")
+    return 1 if no_of_failed else 0
+
+
+def parse_raw_size(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[tuple[int, int]]:
+    # Parses the 'WIDTHxHEIGHT' size of raw carriers
+    if value is None:
+        return None
+    match = re.fullmatch(r"(\d+)x(\d+)", value)
+    if match is None or 0 in (int(match.group(1)), int(match.group(2))):
+        raise click.exceptions.BadParameter("Size must be given as WIDTHxHEIGHT!", ctx, param)
+    return int(match.group(1)), int(match.group(2))
+
+
+def open_create_carrier(image_file: io.IOBase, output_file: io.IOBase,
+                        raw_size: Optional[tuple[int, int]]) -> Union[Image.Image, MappedCarrier]:
+    # Uncompressed carriers are copied to the output file and embedded into in place if the output file is a path with
+    # the suffix of their format, otherwise a PNG image is written as with any other carrier. Standard output is named
+    # '<stdout>', which has no suffix.
+    carrier = open_carrier(image_file) if raw_size is None else MappedCarrier.open(image_file.name, raw_size=raw_size)
+    if not isinstance(carrier, MappedCarrier):
+        return carrier
+    output_path = getattr(output_file, "name", None)
+    if isinstance(output_path, str) and carrier.has_suffix_of(output_path):
+        output_file.close()
+        return carrier.copy_to(output_path)
+    image = carrier.to_image() if carrier.format in ("PAM", "RAW") else Image.open(image_file)
+    carrier.close()
+    return image
+
+
+def refresh_pool(directory: str) -> list[PoolEntry]:
+    # Keeps the persisted index of a pool up to date, opening only the new and changed images
+    entries, changed = update_index(directory)
+    if changed:
+        try:
+            save_index(directory, entries)
+        except OSError:
+            logger.warning("Cannot save the index of the pool!")
+    return entries
 
-    try:
-        image = Image.open(image_file)
-    except Image.UnidentifiedImageError:
-        logger.exception("Not an image file!")
-        sys.exit(1)
 
-    # Perform operation
-    sys.exit(write_steganography(input_file, image, output_file, key, compress, density, show_image))
+@main.command("create", help="Creates steganography")
+@click.option("-i", "--image_file", help="Path to custom image_file file", type=click.File("rb"))
+@click.option("-p", "--pool", help="Path to a pool of carrier images, of which the smallest that fits is used",
+              type=click.Path(exists=True, file_okay=False))
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-c", "--compress", help="Compression level of the steganography", type=int, default=-1)
+@click.option("-d", "--density", help="Density of the steganography (from 1 to 3)", type=int, default=-1)
+@click.option("-s", "--chunk-size", help="Size of chunks in bytes to stream the input file (0 to disable)", type=int,
+              default=-1)
+@click.option("--aead/--fernet", help="Whether to store binary AES-GCM ciphertext instead of a Fernet token",
+              default=None)
+@click.option("--binary-header/--text-header", help="Whether to write the compact binary header (version 2)",
+              default=None)
+@click.option("--codec", help="Compression codec, or 'auto' to pick one by sampling the input file",
+              type=click.Choice(available_codecs() + ["auto"]))
+@click.option("--kdf", help="Key derivation function", type=click.Choice(Cryptographer.kdf_algorithms))
+@click.option("--kdf-cost", help="Cost of the key derivation function (iterations of PBKDF2, log2 N of scrypt)",
+              type=int)
+@click.option("--png-preset", help="Preset of the PNG encoding, trading its size for its speed",
+              type=click.Choice(list(png_presets)))
+@click.option("--raw-size", help="Size of a raw RGB carrier, as WIDTHxHEIGHT", callback=parse_raw_size)
+@click.option("-o", "--output_file", help="Path to output file, a PNG image unless it has the suffix of a BMP, PPM, "
+                                           "PAM or raw carrier, whose format it keeps", type=click.File("wb"),
+              required=True)
+@click.option("--show-image", help="Whether to show image_file on creation", type=bool, default=False)
+@click.argument("input_files", nargs=-1, type=click.File("rb"), required=True)
+@pass_config_no_lock()
+def create(image_file: Optional[io.IOBase], pool: Optional[str], key: str, compress: int, density: int, chunk_size: int,
+           aead: bool, binary_header: bool, codec: str, kdf: Optional[str], kdf_cost: Optional[int],
+           png_preset: Optional[str], raw_size: Optional[tuple[int, int]], output_file: io.IOBase, show_image: bool,
+           input_files: tuple[io.IOBase, ...], config: dict[str, ...]) -> None:
+    compress, density, chunk_size = validate_create_options(config, compress, density, chunk_size)
+    key = config["default_auth_key"] if key is None else key
+    if (image_file is None) == (pool is None):
+        raise click.exceptions.BadOptionUsage(
+            "image_file", "Either a carrier image or a pool is required!")
+
+    if pool is not None:
+        # Predict the size of the steganography, conservatively for the header and the cipher
+        aead = config["flag_aead"] if aead is None else aead
+        length = predict_length(list(input_files), config["default_codec"] if codec is None else codec, compress,
+                                aead, chunk_size, max(Header.header_length, BinaryHeader.header_length))
+        entry = choose_carrier(refresh_pool(pool), length, density)
+        if entry is None:
+            logger.error("No carrier image of the pool is big enough!")
+            sys.exit(1)
+        click.echo(f"Using {entry.name} ({entry.width}x{entry.height})", err=True)
+        image_file = open(pathlib.Path(pool) / entry.name, "rb")
+
+    image = None
+    try:
+        try:
+            image = open_create_carrier(image_file, output_file, raw_size)
+        except Image.UnidentifiedImageError:
+            logger.exception("Not an image file!")
+            sys.exit(1)
+        except (OSError, ValueError):
+            logger.exception("Cannot map image_file file!")
+            sys.exit(1)
+
+        # Many input files are embedded as an archive, whose members are extracted one at a time
+        input_file = list(input_files) if len(input_files) > 1 else input_files[0]
+
+        # Perform operation
+        sys.exit(write_steganography(input_file, image, output_file, key, compress, density, show_image, chunk_size,
+                                     aead, binary_header, codec, kdf, kdf_cost, png_preset))
+    finally:
+        # The carrier is released whether the steganography is written or not, along with the file of a carrier of
+        # the pool, which is opened here instead of by click
+        if image is not None:
+            image.close()
+        if pool is not None:
+            image_file.close()
 
 
 @main.command("extract", help="Extracts steganography")
 @click.option("-k", "--key", help="The authentication key", type=str)
-@click.option("-o", "--output_file", help="Path to output file", type=click.File("wb"), required=True)
+@click.option("--keys-file", help="Path to a file of candidate authentication keys, one per line",
+              type=click.Path(exists=True, dir_okay=False))
+@click.option("-j", "--jobs", help="Number of worker processes to try the keys (0 for the number of CPUs)", type=int,
+              default=-1)
+@click.option("-m", "--member", help="Name of the member to extract from an archive", type=str)
+@click.option("-l", "--list", "list_members", help="Whether to list the members of an archive instead",
+              is_flag=True, default=False)
+@click.option("--raw-size", help="Size of a raw RGB carrier, as WIDTHxHEIGHT", callback=parse_raw_size)
+@click.option("-o", "--output_file", help="Path to output file", type=click.File("wb"))
 @click.argument("steganography", required=True, type=click.File("rb"))
 @pass_config_no_lock()
-def extract(key: str, output_file: io.IOBase, steganography: io.IOBase, config: dict[str, ...]) -> None:
+def extract(key: str, keys_file: Optional[str], jobs: int, member: Optional[str], list_members: bool,
+            raw_size: Optional[tuple[int, int]], output_file: Optional[io.IOBase], steganography: io.IOBase,
+            config: dict[str, ...]) -> None:
+    if key is not None and keys_file is not None:
+        raise click.exceptions.BadOptionUsage(
+            "keys_file", "A keys file cannot be used with a key!")
+    if list_members and (keys_file is not None or member is not None):
+        raise click.exceptions.BadOptionUsage(
+            "list_members", "Listing the members cannot be used with a keys file or a member!")
+    if not list_members and output_file is None:
+        raise click.exceptions.BadOptionUsage(
+            "output_file", "An output file is required!")
+    jobs = validate_jobs(config, jobs)
     key = config["default_auth_key"] if key is None else key
     try:
-        Image.open(steganography)
+        if raw_size is not None:
+            steganography = MappedCarrier.open(steganography.name, raw_size=raw_size)
+        open_carrier(steganography)
     except Image.UnidentifiedImageError:
         logger.exception("Not an image file!")
         sys.exit(1)
-    sys.exit(extract_steganography(steganography, output_file, key))
+    except (OSError, ValueError):
+        logger.exception("Cannot map steganography file!")
+        sys.exit(1)
+    if list_members:
+        members = list_steganography(steganography, key)
+        if members is None:
+            sys.exit(1)
+        # Tab-separated: name, size
+        for archive_member in members:
+            click.echo(f"{archive_member.name}\t{archive_member.size}")
+        sys.exit(0)
+    if keys_file is None:
+        sys.exit(extract_steganography(steganography, output_file, key, member))
+
+    keys = read_keys(keys_file)
+    if not keys:
+        logger.error("Keys file is empty!")
+        sys.exit(1)
+    return_code, key = extract_steganography_with_keys(steganography, output_file, keys, jobs, member)
+    # A key which passed the key-check value may still fail to decrypt the payload
+    if return_code == 0:
+        click.echo(f"Found the authentication key: {key}")
+    sys.exit(return_code)
+
+
+@main.command("update", help="Updates the data of steganography, rewriting only the pixels of the new data")
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-o", "--output_file", help="Path to output file, defaults to updating the steganography in place",
+              type=click.Path(dir_okay=False))
+@click.option("--png-preset", help="Preset of the PNG encoding, trading its size for its speed",
+              type=click.Choice(list(png_presets)))
+@click.option("--raw-size", help="Size of a raw RGB carrier, as WIDTHxHEIGHT", callback=parse_raw_size)
+@click.argument("steganography", required=True, type=click.Path(exists=True, dir_okay=False))
+@click.argument("input_file", required=True, type=click.File("rb"))
+@pass_config_no_lock()
+def update(key: str, output_file: Optional[str], png_preset: Optional[str], raw_size: Optional[tuple[int, int]],
+           steganography: str, input_file: io.IOBase, config: dict[str, ...]) -> None:
+    key = config["default_auth_key"] if key is None else key
+    output_file = steganography if output_file is None else output_file
+    sys.exit(update_steganography(input_file, steganography, output_file, key, png_preset, raw_size))
+
+
+@main.command("create-batch", help="Creates steganography of many files in a process pool")
+@click.option("-i", "--image_file", help="Path to the carrier image of the files of the input directory",
+              type=click.Path(exists=True, dir_okay=False))
+@click.option("-m", "--manifest", help="Path to a CSV manifest of 'input_file,image_file,output_file' rows",
+              type=click.Path(exists=True, dir_okay=False))
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-c", "--compress", help="Compression level of the steganography", type=int, default=-1)
+@click.option("-d", "--density", help="Density of the steganography (from 1 to 3)", type=int, default=-1)
+@click.option("-s", "--chunk-size", help="Size of chunks in bytes to stream the input files (0 to disable)", type=int,
+              default=-1)
+@click.option("--aead/--fernet", help="Whether to store binary AES-GCM ciphertext instead of a Fernet token",
+              default=None)
+@click.option("--binary-header/--text-header", help="Whether to write the compact binary header (version 2)",
+              default=None)
+@click.option("--codec", help="Compression codec, or 'auto' to pick one by sampling every input file",
+              type=click.Choice(available_codecs() + ["auto"]))
+@click.option("--kdf", help="Key derivation function", type=click.Choice(Cryptographer.kdf_algorithms))
+@click.option("--kdf-cost", help="Cost of the key derivation function (iterations of PBKDF2, log2 N of scrypt)",
+              type=int)
+@click.option("-j", "--jobs", help="Number of worker processes (0 for the number of CPUs)", type=int, default=-1)
+@click.argument("input_dir", required=False, type=click.Path(exists=True, file_okay=False))
+@click.argument("output_dir", required=False, type=click.Path(file_okay=False))
+@pass_config_no_lock()
+def create_batch(image_file: Optional[str], manifest: Optional[str], key: str, compress: int, density: int,
+                 chunk_size: int, aead: bool, binary_header: bool, codec: str, kdf: Optional[str],
+                 kdf_cost: Optional[int], jobs: int, input_dir: Optional[str], output_dir: Optional[str],
+                 config: dict[str, ...]) -> None:
+    compress, density, chunk_size = validate_create_options(config, compress, density, chunk_size)
+    validate_batch_source(manifest, input_dir, output_dir)
+    jobs = validate_jobs(config, jobs)
+    key = config["default_auth_key"] if key is None else key
+
+    if manifest is not None:
+        try:
+            batch = read_manifest(manifest, 3)
+        except ValueError:
+            logger.exception("Invalid manifest!")
+            sys.exit(1)
+    else:
+        if image_file is None:
+            raise click.exceptions.BadOptionUsage(
+                "image_file", "A carrier image is required for the input directory!")
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+        batch = create_jobs_from_directory(input_dir, output_dir, image_file)
+
+    options = dict(auth_key=key, compression=compress, density=density, chunk_size=chunk_size, aead=aead,
+                   binary_header=binary_header, codec=codec, kdf=kdf, kdf_cost=kdf_cost)
+    # Carrier images of many jobs are decoded once, into shared memory which the workers copy from
+    reused = [path for path, count in collections.Counter(job[1] for job in batch).items() if count > 1]
+    with shared_templates(reused) as templates:
+        sys.exit(report_batch(run_batch(create_one, batch, options, MODULE_NAME, config, jobs, templates)))
+
+
+@main.command("extract-batch", help="Extracts steganography of many files in a process pool")
+@click.option("-m", "--manifest", help="Path to a CSV manifest of 'steganography,output_file' rows",
+              type=click.Path(exists=True, dir_okay=False))
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-j", "--jobs", help="Number of worker processes (0 for the number of CPUs)", type=int, default=-1)
+@click.argument("input_dir", required=False, type=click.Path(exists=True, file_okay=False))
+@click.argument("output_dir", required=False, type=click.Path(file_okay=False))
+@pass_config_no_lock()
+def extract_batch(manifest: Optional[str], key: str, jobs: int, input_dir: Optional[str], output_dir: Optional[str],
+                  config: dict[str, ...]) -> None:
+    validate_batch_source(manifest, input_dir, output_dir)
+    jobs = validate_jobs(config, jobs)
+    key = config["default_auth_key"] if key is None else key
+
+    if manifest is not None:
+        try:
+            batch = read_manifest(manifest, 2)
+        except ValueError:
+            logger.exception("Invalid manifest!")
+            sys.exit(1)
+    else:
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+        batch = extract_jobs_from_directory(input_dir, output_dir)
+
+    sys.exit(report_batch(run_batch(extract_one, batch, dict(auth_key=key), MODULE_NAME, config, jobs)))
+
+
+@main.command("create-sharded", help="Creates steganography split across many carrier images")
+@click.option("-i", "--image_file", "image_files", help="Path to a carrier image, once per shard", multiple=True,
+              type=click.Path(exists=True, dir_okay=False), required=True)
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-c", "--compress", help="Compression level of the steganography", type=int, default=-1)
+@click.option("-d", "--density", help="Density of the steganography (from 1 to 3)", type=int, default=-1)
+@click.option("--aead/--fernet", help="Whether to store binary AES-GCM ciphertext instead of Fernet tokens",
+              default=None)
+@click.option("--codec", help="Compression codec, or 'auto' to pick one by sampling the input file",
+              type=click.Choice(available_codecs() + ["auto"]))
+@click.option("--kdf", help="Key derivation function", type=click.Choice(Cryptographer.kdf_algorithms))
+@click.option("--kdf-cost", help="Cost of the key derivation function (iterations of PBKDF2, log2 N of scrypt)",
+              type=int)
+@click.option("-j", "--jobs", help="Number of threads embedding the shards (0 for the default)", type=int,
+              default=-1)
+@click.option("--png-preset", help="Preset of the PNG encoding, trading its size for its speed",
+              type=click.Choice(list(png_presets)))
+@click.option("-o", "--output_dir", help="Path to the directory of the shards, named '<input_file>.<index>.png'",
+              type=click.Path(file_okay=False), required=True)
+@click.argument("input_file", type=click.File("rb"), required=True)
+@pass_config_no_lock()
+def create_sharded(image_files: tuple[str, ...], key: str, compress: int, density: int, aead: bool, codec: str,
+                   kdf: Optional[str], kdf_cost: Optional[int], jobs: int, png_preset: Optional[str], output_dir: str,
+                   input_file: io.IOBase, config: dict[str, ...]) -> None:
+    compress, density, _ = validate_create_options(config, compress, density, 0)
+    jobs = validate_jobs(config, jobs)
+    key = config["default_auth_key"] if key is None else key
+
+    images = []
+    for image_file in image_files:
+        try:
+            images.append(Image.open(image_file))
+        except Image.UnidentifiedImageError:
+            logger.exception("Not an image file!")
+            sys.exit(1)
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    name = pathlib.Path(input_file.name).name
+    output_files = [open(pathlib.Path(output_dir) / f"{name}.{index}.png", "wb") for index in range(len(images))]
+
+    return_code = write_sharded_steganography(input_file, images, output_files, key, compress, density, aead, codec,
+                                              kdf, kdf_cost, jobs, png_preset)
+    if return_code != 0:
+        # Leave no partial shard behind
+        for output_file in output_files:
+            output_file.close()
+            pathlib.Path(output_file.name).unlink(missing_ok=True)
+    sys.exit(return_code)
+
+
+@main.command("extract-sharded", help="Extracts steganography split across many carrier images")
+@click.option("-k", "--key", help="The authentication key", type=str)
+@click.option("-j", "--jobs", help="Number of threads reading the shards (0 for the default)", type=int, default=-1)
+@click.option("-o", "--output_file", help="Path to output file", type=click.File("wb"), required=True)
+@click.argument("shards", nargs=-1, required=True, type=click.File("rb"))
+@pass_config_no_lock()
+def extract_sharded(key: str, jobs: int, output_file: io.IOBase, shards: tuple[io.IOBase, ...],
+                    config: dict[str, ...]) -> None:
+    jobs = validate_jobs(config, jobs)
+    key = config["default_auth_key"] if key is None else key
+    sys.exit(extract_sharded_steganography(list(shards), output_file, key, jobs))
+
+
+@main.group("pool")
+def pool_group() -> None:
+    """Manages pools of carrier images."""
+
+
+@pool_group.command("index", help="Indexes the carrier images of a pool, reading only their headers")
+@click.argument("directory", required=True, type=click.Path(exists=True, file_okay=False))
+def pool_index(directory: str) -> None:
+    entries = refresh_pool(directory)
+    click.echo(f"{len(entries)} images indexed")
+    sys.exit(0)
+
+
+@pool_group.command("list", help="Lists the carrier images of a pool and their capacities")
+@click.argument("directory", required=True, type=click.Path(exists=True, file_okay=False))
+@pass_config_no_lock()
+def pool_list(directory: str, config: dict[str, ...]) -> None:
+    # Tab-separated: name, dimensions, mode, capacity in bytes for every density
+    for entry in refresh_pool(directory):
+        capacities = "\t".join(str(entry.capacity(density)) for density in config["available_density"])
+        click.echo(f"{entry.name}\t{entry.width}x{entry.height}\t{entry.mode}\t{capacities}")
+    sys.exit(0)
+
+
+@main.command("calibrate", help="Calibrates the cost of the key derivation function for this host")
+@click.option("--kdf", help="Key derivation function", type=click.Choice(Cryptographer.kdf_algorithms))
+@click.option("-t", "--target", help="Target time of a key derivation, in seconds", type=float, default=0.1)
+@click.option("--save", help="Whether to save the key derivation function and its cost as the defaults",
+              is_flag=True, default=False)
+@click.option("--reset", help="Whether to restore the original key derivation function as the default instead",
+              is_flag=True, default=False)
+@pass_config_with_lock()
+def calibrate(kdf: Optional[str], target: float, save: bool, reset: bool, config: dict[str, ...]) -> None:
+    if reset:
+        config["default_kdf"] = Cryptographer.default_kdf
+        config["default_kdf_cost"] = 0
+        click.echo("Restored the original key derivation function as the default.")
+        sys.exit(0)
+    if target <= 0:
+        raise click.exceptions.BadOptionUsage(
+            "target", "Target time must be positive!")
+    kdf = config["default_kdf"] if kdf is None else kdf
+    cost = Cryptographer.calibrate(kdf, target)
+    # Report the time of the chosen cost, which differs from the target at the bounds of the cost
+    started = time.perf_counter()
+    Cryptographer.make_kdf(Cryptographer.make_salt(), kdf, cost).derive(b"calibration")
+    click.echo(f"{kdf} {cost} ({time.perf_counter() - started:.3f}s per key derivation)")
+    if save:
+        config["default_kdf"] = kdf
+        config["default_kdf_cost"] = cost
+        click.echo("Saved as the default key derivation function.")
+    sys.exit(0)
+
+
+@main.command("scan", help="Scans images for steganography")
+@click.option("-j", "--jobs", help="Number of worker processes (0 for the number of CPUs)", type=int, default=-1)
+@click.option("-a", "--all", "show_all", help="Whether to list images without steganography too", is_flag=True,
+              default=False)
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@pass_config_no_lock()
+def scan(jobs: int, show_all: bool, paths: tuple[str, ...], config: dict[str, ...]) -> None:
+    jobs = validate_jobs(config, jobs)
+    images = find_images(list(paths))
+    started = time.perf_counter()
+    no_of_found = 0
+    # Tab-separated: path, density, compression, data length, codec
+    for result in scan_images(images, MODULE_NAME, config, jobs):
+        if result.found:
+            no_of_found += 1
+            click.echo(f"{result.path}\t{result.density}\t{result.compression}\t{result.data_length}\t{result.codec}")
+        elif show_all:
+            click.echo(f"{result.path}\t-\t-\t-\t{result.message or '-'}")
+    click.echo(f"{no_of_found} of {len(images)} images carry steganography "
+               f"({time.perf_counter() - started:.3f}s)", err=True)
+    sys.exit(0)
@@ -0,0 +1,257 @@
+# This module defines the in-memory library API of Stenographer, which works on pixel arrays without files or config.
+from __future__ import annotations
+
+import io
+from typing import Optional, Union
+
+import numpy as np
+from cryptography.fernet import InvalidToken
+from PIL import Image
+
+from SuperHelper.Core.Utils import Cryptographer
+from SuperHelper.Modules.Stenographer.archive import is_archive, read_member, read_toc
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+from SuperHelper.Modules.Stenographer.compression import available_codecs, compress, decompress
+from SuperHelper.Modules.Stenographer.container import read_container
+from SuperHelper.Modules.Stenographer.header import AnyHeader, BinaryHeader, Header, KdfCostError, \
+    acceptable_kdf_costs, compression_levels, densities, fix, parse_header
+
+__all__ = [
+    "EmbedParams",
+    "seal_payload",
+    "write_payload",
+    "embed",
+    "extract",
+    "read_header",
+]
+
+# Long enough for both headers
+leading_length: int = max(Header.header_length, BinaryHeader.header_length)
+
+
+class EmbedParams:
+    """The parameters of an embedding, given explicitly instead of read from the configuration."""
+
+    def __init__(self, auth_key: str, compression: int = 9, density: int = 1, codec: str = "bz2", aead: bool = False,
+                 binary_header: bool = True, kdf: str = Cryptographer.default_kdf, kdf_cost: int = None,
+                 salt: str = None) -> None:
+        """Initialises an `EmbedParams` instance.
+
+        Args:
+            auth_key (str): The authentication key.
+            compression (int): The compression level, 0 for no compression.
+            density (int): The density, from 1 to 3.
+            codec (str): The name of the compression codec.
+            aead (bool): Whether to encrypt into a binary AEAD token instead of a Fernet token.
+            binary_header (bool): Whether to write the binary header instead of the text header.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
+            salt (str): The Base64-encoded salt shared by every embedding, whose derived key is then cached by
+                `Cryptographer`. A new salt, hence a new key derivation, is made for every embedding if None.
+
+        Raises:
+            ValueError: A parameter is out of range, or cannot be recorded in the text header.
+        """
+        if compression not in compression_levels:
+            raise ValueError("Compression level must be from 0 to 9!")
+        if density not in densities:
+            raise ValueError("Density must be from 1 to 3!")
+        if codec not in available_codecs():
+            raise ValueError(f"Codec '{codec}' is not available!")
+        if kdf not in Cryptographer.kdf_algorithms:
+            raise ValueError(f"Unknown key derivation function '{kdf}'!")
+        kdf_cost = Cryptographer.default_kdf_costs[kdf] if kdf_cost is None else kdf_cost
+        if not binary_header and (codec, kdf, kdf_cost) != (Header.codec, Header.kdf, Header.kdf_cost):
+            raise ValueError("Codec and key derivation function require the binary header!")
+        self.auth_key: str = auth_key
+        self.compression: int = compression
+        self.density: int = density
+        self.codec: str = codec
+        self.aead: bool = aead
+        self.binary_header: bool = binary_header
+        self.kdf: str = kdf
+        self.kdf_cost: int = kdf_cost
+        self.salt: Optional[str] = salt
+
+    def __repr__(self) -> str:
+        return f"EmbedParams(compression={self.compression}, density={self.density}, codec={self.codec}, " \
+               f"aead={self.aead}, binary_header={self.binary_header}, kdf={self.kdf})"
+
+    def make_encrypter(self) -> Cryptographer:
+        """Makes the encrypter of an embedding.
+
+        Returns:
+            A `Cryptographer` instance.
+        """
+        salt = Cryptographer.encode_salt(Cryptographer.make_salt()) if self.salt is None else self.salt
+        return Cryptographer.make_encrypter(salt, self.auth_key, self.kdf, self.kdf_cost)
+
+
+def _pixels_of(carrier: Union[np.ndarray, Image.Image]) -> np.ndarray:
+    # Image.Image carriers are decoded, arrays are used as they are
+    pixels = np.asarray(carrier)
+    if pixels.dtype != np.uint8 or pixels.ndim != 3 or pixels.shape[2] < BitPlane.channels:
+        raise ValueError("The carrier must be an 8-bit image with at least 3 colour channels!")
+    return pixels
+
+
+def seal_payload(data: bytes, params: EmbedParams) -> bytes:
+    """Encrypts compressed data, and prepends its header.
+
+    Args:
+        data (bytes): The compressed payload.
+        params (EmbedParams): The parameters of the embedding.
+
+    Returns:
+        The header and the token, as written into the carrier.
+    """
+    crypto = params.make_encrypter()
+    data = crypto.encrypt_aead(data) if params.aead else fix(crypto.encrypt(data))
+    if params.binary_header:
+        header = BinaryHeader(len(data), params.compression, params.density, crypto.get_salt_string(),
+                              aead=params.aead, codec=params.codec, key_check=crypto.get_key_check(), kdf=params.kdf,
+                              kdf_cost=params.kdf_cost)
+    else:
+        header = Header(len(data), params.compression, params.density, crypto.get_salt_string(), aead=params.aead)
+    return header.to_bytes() + data
+
+
+def write_payload(sealed: bytes, carrier: Union[np.ndarray, Image.Image], params: EmbedParams,
+                  out: np.ndarray = None) -> np.ndarray:
+    """Writes a sealed payload into the pixels of a carrier.
+
+    Args:
+        sealed (bytes): The header and the token, see `seal_payload`.
+        carrier (Union[np.ndarray, Image.Image]): The `uint8` pixel array of shape (height, width, bands), or the
+            image, which is left unchanged.
+        params (EmbedParams): The parameters of the embedding.
+        out (np.ndarray): The array to write the pixels to, see `embed`.
+
+    Returns:
+        The pixel array holding the steganography, i.e. `out` if given.
+
+    Raises:
+        ValueError: The carrier is not supported, `out` has the wrong shape, or the payload is too big to be stored.
+    """
+    pixels = _pixels_of(carrier)
+    if out is not None and (out.shape != pixels.shape or out.dtype != np.uint8):
+        raise ValueError("Output array does not match the carrier!")
+    n_bits = len(sealed) * 8
+    if n_bits > pixels.shape[0] * pixels.shape[1] * BitPlane.channels * params.density:
+        raise ValueError("Data is too big to be stored!")
+    if out is None:
+        out = pixels.copy()
+    elif out is not pixels:
+        np.copyto(out, pixels)
+    # As `steg create`, only whole pixels of Fernet tokens are written, the rest falls into the padding
+    if not params.aead:
+        n_bits -= n_bits % (BitPlane.channels * params.density)
+    BitPlane(out, params.density).write(sealed, n_bits=n_bits)
+    return out
+
+
+def embed(payload: Union[bytes, memoryview], carrier: Union[np.ndarray, Image.Image], params: EmbedParams,
+          out: np.ndarray = None) -> np.ndarray:
+    """Embeds a payload into the pixels of a carrier.
+
+    The output is the same as that of `steg create` with the same parameters, save for the PNG encoding.
+
+    Args:
+        payload (Union[bytes, memoryview]): The payload.
+        carrier (Union[np.ndarray, Image.Image]): The `uint8` pixel array of shape (height, width, bands), or the
+            image, which is left unchanged.
+        params (EmbedParams): The parameters of the embedding.
+        out (np.ndarray): The array to write the pixels to, of the shape of the carrier, which is reused instead of
+            allocating a new one. It may be the carrier itself, to embed in place.
+
+    Returns:
+        The pixel array holding the steganography, i.e. `out` if given.
+
+    Raises:
+        ValueError: The carrier is not supported, `out` has the wrong shape, or the payload is too big to be stored.
+    """
+    sealed = seal_payload(compress(bytes(payload), params.codec, params.compression), params)
+    return write_payload(sealed, carrier, params, out)
+
+
+def read_header(carrier: Union[np.ndarray, Image.Image],
+                maximum_kdf_costs: dict[str, int] = None) -> Optional[AnyHeader]:
+    """Reads the header of steganography, trying every density.
+
+    Args:
+        carrier (Union[np.ndarray, Image.Image]): The pixel array, or the image.
+        maximum_kdf_costs (dict[str, int]): The highest cost of every key derivation function, above which the
+            header is rejected, defaults to `acceptable_kdf_costs()`.
+
+    Returns:
+        The header, or None if there is no steganography.
+
+    Raises:
+        KdfCostError: The header asks for a cost of the key derivation function above the highest.
+        ValueError: The carrier is not supported.
+    """
+    candidates = BitPlane.read_leading(_pixels_of(carrier), leading_length, list(densities))
+    maximum_kdf_costs = acceptable_kdf_costs() if maximum_kdf_costs is None else maximum_kdf_costs
+    for density in densities:
+        try:
+            return parse_header(candidates[density], density, maximum_kdf_costs)
+        except KdfCostError:
+            # The checksum of the header matched, hence the density is right and the header is refused
+            raise
+        except ValueError:
+            continue
+    return None
+
+
+def extract(carrier: Union[np.ndarray, Image.Image], auth_key: str, member: str = None,
+            maximum_kdf_costs: dict[str, int] = None) -> bytes:
+    """Extracts the payload of steganography.
+
+    Args:
+        carrier (Union[np.ndarray, Image.Image]): The pixel array, or the image.
+        auth_key (str): The authentication key.
+        member (str): The name of the member to extract, if the steganography is an archive.
+        maximum_kdf_costs (dict[str, int]): The highest cost of every key derivation function, above which the
+            header is rejected, defaults to `acceptable_kdf_costs()`.
+
+    Returns:
+        The payload.
+
+    Raises:
+        KdfCostError: The header asks for a cost of the key derivation function above the highest.
+        ValueError: There is no steganography, it is a shard or an archive without `member` given, the member is
+            missing, or the data is corrupted.
+        InvalidToken: The authentication key is invalid.
+    """
+    pixels = _pixels_of(carrier)
+    header = read_header(pixels, maximum_kdf_costs)
+    if header is None:
+        raise ValueError("No steganography found!")
+    if header.shard_count > 1:
+        raise ValueError("Steganography is a shard, extract all the shards together!")
+    crypto = Cryptographer.make_decrypter(header.salt, auth_key, header.kdf, header.kdf_cost)
+    if header.key_check is not None and not crypto.verify_key_check(header.key_check):
+        raise InvalidToken
+    plane = BitPlane(pixels, header.density)
+    offset = header.header_length * 8
+
+    if header.chunked and is_archive(plane, offset):
+        if member is None:
+            raise ValueError("Steganography is an archive, a member must be given!")
+        members = {archive_member.name: archive_member for archive_member in read_toc(plane, offset, crypto,
+                                                                                          header.aead)}
+        if member not in members:
+            raise ValueError(f"Member '{member}' is not in the archive!")
+        return read_member(plane, members[member], crypto, header.codec, header.compression, header.aead)
+    if member is not None:
+        raise ValueError("Steganography is not an archive!")
+    if header.chunked:
+        output = io.BytesIO()
+        if read_container(plane, offset, crypto, header.codec, header.compression, header.aead,
+                          output) != header.data_length:
+            raise ValueError("Data is corrupted!")
+        return output.getvalue()
+
+    data = plane.read(header.header_length + header.data_length)[header.header_length:]
+    data = crypto.decrypt_aead(data) if header.aead else crypto.decrypt(fix(data, False))
+    return decompress(data, header.codec, header.compression)
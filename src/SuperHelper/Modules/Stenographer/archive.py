@@ -0,0 +1,202 @@
+# This module defines the archive, a container of many files which can be extracted one at a time.
+from __future__ import annotations
+
+import struct
+
+from SuperHelper.Core.Utils import Cryptographer
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+from SuperHelper.Modules.Stenographer.compression import compress, decompress
+
+__all__ = [
+    "ArchiveMember",
+    "pack_archive",
+    "is_archive",
+    "read_preamble",
+    "read_toc_token",
+    "read_toc",
+    "read_member",
+]
+
+# Archive layout:
+#   Preamble: magic (3 bytes), version (1 byte), length of the TOC token (4 bytes)
+#   TOC token: the encrypted table of contents
+#   Members: the tokens of the individually compressed and encrypted members, back to back
+# Table of contents:
+#   Number of members (4 bytes), then for every member the length of its name (2 bytes), its name (UTF-8),
+#   the offset of its token from the first member (8 bytes), the length of its token (4 bytes) and its size (8 bytes)
+archive_magic: bytes = b"SHA"
+archive_version: int = 1
+preamble_format: struct.Struct = struct.Struct(">3sBI")
+count_format: struct.Struct = struct.Struct(">I")
+name_format: struct.Struct = struct.Struct(">H")
+entry_format: struct.Struct = struct.Struct(">QIQ")
+
+
+class ArchiveMember:
+    """A member of an archive, as listed in its table of contents."""
+
+    def __init__(self, name: str, position: int, token_length: int, size: int) -> None:
+        """Initialises an `ArchiveMember` instance.
+
+        Args:
+            name (str): The name of the member.
+            position (int): The position of the first bit of its token in the carrier.
+            token_length (int): The length of its token.
+            size (int): The size of the member, before compression.
+        """
+        self.name: str = name
+        self.position: int = position
+        self.token_length: int = token_length
+        self.size: int = size
+
+    def __repr__(self) -> str:
+        return f"ArchiveMember(name={self.name!r}, position={self.position}, size={self.size})"
+
+
+def pack_archive(members: list[tuple[str, bytes]], crypto: Cryptographer, codec: str, compression: int,
+                 aead: bool) -> bytes:
+    """Packs files into an archive.
+
+    Args:
+        members (list[tuple[str, bytes]]): The names and the data of the members.
+        crypto (Cryptographer): The encrypter of the members and of the table of contents.
+        codec (str): The name of the compression codec of the members.
+        compression (int): The compression level of the members, 0 for no compression.
+        aead (bool): Whether to encrypt into binary AEAD tokens instead of Fernet tokens.
+
+    Returns:
+        The archive.
+
+    Raises:
+        ValueError: There is no member, or the names are duplicated or too long.
+    """
+    if not members:
+        raise ValueError("Archive must have at least one member!")
+    if len({name for name, _ in members}) != len(members):
+        raise ValueError("Names of the members must be unique!")
+    encrypt = crypto.encrypt_aead if aead else crypto.encrypt
+    toc = count_format.pack(len(members))
+    tokens = []
+    offset = 0
+    for name, data in members:
+        token = encrypt(compress(data, codec, compression))
+        encoded_name = name.encode("utf-8")
+        if len(encoded_name) >= 1 << (name_format.size * 8):
+            raise ValueError(f"Name of member '{name}' is too long!")
+        toc += name_format.pack(len(encoded_name)) + encoded_name + entry_format.pack(offset, len(token), len(data))
+        tokens.append(token)
+        offset += len(token)
+    toc_token = encrypt(toc)
+    return preamble_format.pack(archive_magic, archive_version, len(toc_token)) + toc_token + b"".join(tokens)
+
+
+def is_archive(plane: BitPlane, offset: int) -> bool:
+    """Tells an archive from a chunked container, which share the chunked flag of the header.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from.
+        offset (int): The position of the first bit of the container.
+
+    Returns:
+        Whether the container is an archive.
+    """
+    return plane.read(len(archive_magic), offset) == archive_magic
+
+
+def read_preamble(plane: BitPlane, offset: int) -> tuple[int, int]:
+    """Reads the preamble of an archive.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from.
+        offset (int): The position of the first bit of the archive.
+
+    Returns:
+        A 2-tuple of the position of the TOC token and its length.
+
+    Raises:
+        ValueError: The archive is malformed.
+    """
+    magic, version, toc_length = preamble_format.unpack(plane.read(preamble_format.size, offset))
+    if magic != archive_magic or version != archive_version:
+        raise ValueError("Unsupported archive!")
+    return offset + preamble_format.size * 8, toc_length
+
+
+def read_toc_token(plane: BitPlane, offset: int) -> bytes:
+    """Reads the encrypted table of contents of an archive.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from.
+        offset (int): The position of the first bit of the archive.
+
+    Returns:
+        The token, which can be decrypted to test an authentication key without reading any member.
+
+    Raises:
+        ValueError: The archive is malformed.
+    """
+    position, toc_length = read_preamble(plane, offset)
+    return plane.read(toc_length, position)
+
+
+def read_toc(plane: BitPlane, offset: int, crypto: Cryptographer, aead: bool) -> list[ArchiveMember]:
+    """Reads the table of contents of an archive.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from, which must hold the table of contents.
+        offset (int): The position of the first bit of the archive.
+        crypto (Cryptographer): The decrypter of the table of contents.
+        aead (bool): Whether the table of contents is a binary AEAD token instead of a Fernet token.
+
+    Returns:
+        A list of `ArchiveMember` instances, in the order of the archive.
+
+    Raises:
+        ValueError: The archive is malformed.
+        InvalidToken: The authentication key is invalid.
+    """
+    position, toc_length = read_preamble(plane, offset)
+    token = plane.read(toc_length, position)
+    toc = crypto.decrypt_aead(token) if aead else crypto.decrypt(token)
+    members_position = position + toc_length * 8
+    try:
+        (count,) = count_format.unpack_from(toc)
+        cursor = count_format.size
+        members = []
+        for _ in range(count):
+            (name_length,) = name_format.unpack_from(toc, cursor)
+            cursor += name_format.size
+            name = toc[cursor:cursor + name_length].decode("utf-8")
+            cursor += name_length
+            member_offset, token_length, size = entry_format.unpack_from(toc, cursor)
+            cursor += entry_format.size
+            members.append(ArchiveMember(name, members_position + member_offset * 8, token_length, size))
+    except (struct.error, UnicodeDecodeError):
+        raise ValueError("Malformed table of contents!")
+    return members
+
+
+def read_member(plane: BitPlane, member: ArchiveMember, crypto: Cryptographer, codec: str, compression: int,
+                aead: bool) -> bytes:
+    """Reads a member of an archive, decoding only the pixels of its token.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from, which must hold the member.
+        member (ArchiveMember): The member to read.
+        crypto (Cryptographer): The decrypter of the member.
+        codec (str): The name of the compression codec of the member.
+        compression (int): The compression level of the member, 0 for no compression.
+        aead (bool): Whether the member is a binary AEAD token instead of a Fernet token.
+
+    Returns:
+        The data of the member.
+
+    Raises:
+        ValueError: The member is malformed.
+        InvalidToken: The authentication key is invalid.
+    """
+    token = plane.read(member.token_length, member.position)
+    data = decompress(crypto.decrypt_aead(token) if aead else crypto.decrypt(token), codec, compression)
+    if len(data) != member.size:
+        raise ValueError(f"Member '{member.name}' is corrupted!")
+    return data
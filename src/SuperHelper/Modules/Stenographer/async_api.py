@@ -0,0 +1,227 @@
+# This module defines the asyncio API of Stenographer, which runs every CPU-heavy stage in an executor.
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import os
+from typing import Any, AsyncIterator, Callable, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from SuperHelper.Modules.Stenographer.api import EmbedParams, extract, seal_payload, write_payload
+from SuperHelper.Modules.Stenographer.compression import compress
+from SuperHelper.Modules.Stenographer.png_writer import save_png
+
+__all__ = [
+    "AsyncStenographer",
+    "decode_image",
+    "encode_png",
+]
+
+# A carrier is a pixel array, an image, or an encoded image
+AnyCarrier = Union[np.ndarray, Image.Image, bytes]
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decodes an encoded image.
+
+    Args:
+        data (bytes): The encoded image, of any format that Pillow reads.
+
+    Returns:
+        The `uint8` pixel array of shape (height, width, bands).
+
+    Raises:
+        Image.UnidentifiedImageError: The data is not an image.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image)
+
+
+def encode_png(pixels: np.ndarray, preset: str = "default") -> bytes:
+    """Encodes pixels as a PNG image.
+
+    Args:
+        pixels (np.ndarray): The `uint8` pixel array of shape (height, width, bands).
+        preset (str): The name of the PNG preset, see `png_presets`.
+
+    Returns:
+        The PNG image.
+    """
+    fp = io.BytesIO()
+    # The executor already parallelises the operations, hence every image is deflated by a single thread
+    save_png(Image.fromarray(pixels), fp, preset, workers=1)
+    return fp.getvalue()
+
+
+class AsyncStenographer:
+    """The asyncio API of Stenographer.
+
+    Image decoding, compression, key derivation and encryption, embedding and PNG encoding each run in an executor,
+    hence the event loop is never blocked by them. Extraction past the decoding is a single stage, since the decrypter
+    cannot be sent between processes. With a process executor, the stages run in worker processes and their inputs
+    and outputs are pickled.
+
+    At most `max_concurrency` operations run at once, which is the backpressure: further operations wait for a slot
+    instead of flooding the executor. If `max_pending` is set, operations beyond that many waiting ones are rejected
+    with `asyncio.QueueFull`, so that a service can shed load. An operation which is cancelled, e.g. by a timeout,
+    keeps its slot until its stage running in the executor completes, hence the slots bound the work of the executor.
+    """
+
+    def __init__(self, executor: concurrent.futures.Executor = None, max_concurrency: int = None,
+                 max_pending: int = None) -> None:
+        """Initialises an `AsyncStenographer` instance.
+
+        Args:
+            executor (concurrent.futures.Executor): The thread or process executor of the stages, defaults to a
+                thread pool of `max_concurrency` threads owned by the instance.
+            max_concurrency (int): The maximum number of operations running at once, defaults to the number of CPUs.
+            max_pending (int): The maximum number of operations waiting to run, unbounded if None.
+        """
+        self.max_concurrency: int = max_concurrency or os.cpu_count() or 1
+        self.max_pending: Optional[int] = max_pending
+        self._owns_executor: bool = executor is None
+        self.executor: concurrent.futures.Executor = concurrent.futures.ThreadPoolExecutor(
+            self.max_concurrency, thread_name_prefix="Stenographer") if executor is None else executor
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.running: int = 0
+        """Number of operations running."""
+        self.pending: int = 0
+        """Number of operations waiting to run."""
+
+    def __repr__(self) -> str:
+        return f"AsyncStenographer(max_concurrency={self.max_concurrency}, running={self.running}, " \
+               f"pending={self.pending})"
+
+    async def __aenter__(self) -> AsyncStenographer:
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shuts the executor down, if it is owned by the instance.
+
+        Returns:
+            None
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self) -> AsyncIterator[list[concurrent.futures.Future]]:
+        # Waits for one of the `max_concurrency` slots, unless too many operations are waiting already, and yields
+        # the list of the jobs that the operation submits to the executor
+        if self.max_pending is not None and self._semaphore.locked() and self.pending >= self.max_pending:
+            raise asyncio.QueueFull
+        self.pending += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+        self.running += 1
+        jobs = []
+        try:
+            yield jobs
+        finally:
+            # A job which is still running keeps the slot until it completes
+            if not jobs or jobs[-1].done() or jobs[-1].cancel():
+                self._release()
+            else:
+                loop = asyncio.get_running_loop()
+                jobs[-1].add_done_callback(lambda _: self._release_threadsafe(loop))
+
+    def _release(self) -> None:
+        self.running -= 1
+        self._semaphore.release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Called by the executor once the job of a cancelled operation completes
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The event loop is closed, along with its slots
+            pass
+
+    async def _run(self, jobs: list[concurrent.futures.Future], function: Callable, *args) -> Any:
+        job = self.executor.submit(function, *args)
+        # Only the job of the current stage is kept, not the results of the earlier stages
+        jobs[:] = [job]
+        # Cancelling the awaiter only cancels the job if it has not started yet
+        return await asyncio.wrap_future(job)
+
+    async def _pixels_of(self, jobs: list[concurrent.futures.Future], carrier: AnyCarrier) -> np.ndarray:
+        if isinstance(carrier, (bytes, bytearray, memoryview)):
+            return await self._run(jobs, decode_image, bytes(carrier))
+        if isinstance(carrier, Image.Image):
+            return await self._run(jobs, np.array, carrier)
+        return carrier
+
+    async def embed(self, payload: Union[bytes, memoryview], carrier: AnyCarrier, params: EmbedParams) -> np.ndarray:
+        """Embeds a payload into the pixels of a carrier, see `embed`.
+
+        Args:
+            payload (Union[bytes, memoryview]): The payload.
+            carrier (AnyCarrier): The `uint8` pixel array, the image or the encoded image, which is left unchanged.
+            params (EmbedParams): The parameters of the embedding.
+
+        Returns:
+            The pixel array holding the steganography.
+
+        Raises:
+            ValueError: The carrier is not supported, or the payload is too big to be stored.
+            asyncio.QueueFull: Too many operations are waiting.
+        """
+        async with self._slot() as jobs:
+            return await self._embed(jobs, payload, carrier, params)
+
+    async def _embed(self, jobs: list[concurrent.futures.Future], payload: Union[bytes, memoryview],
+                     carrier: AnyCarrier, params: EmbedParams) -> np.ndarray:
+        pixels = await self._pixels_of(jobs, carrier)
+        data = await self._run(jobs, compress, bytes(payload), params.codec, params.compression)
+        sealed = await self._run(jobs, seal_payload, data, params)
+        return await self._run(jobs, write_payload, sealed, pixels, params)
+
+    async def create(self, payload: Union[bytes, memoryview], carrier: AnyCarrier, params: EmbedParams,
+                     png_preset: str = "default") -> bytes:
+        """Creates steganography as a PNG image.
+
+        Args:
+            payload (Union[bytes, memoryview]): The payload.
+            carrier (AnyCarrier): The `uint8` pixel array, the image or the encoded image, which is left unchanged.
+            params (EmbedParams): The parameters of the embedding.
+            png_preset (str): The name of the PNG preset, see `png_presets`.
+
+        Returns:
+            The PNG image.
+
+        Raises:
+            ValueError: The carrier is not supported, or the payload is too big to be stored.
+            asyncio.QueueFull: Too many operations are waiting.
+        """
+        async with self._slot() as jobs:
+            pixels = await self._embed(jobs, payload, carrier, params)
+            return await self._run(jobs, encode_png, pixels, png_preset)
+
+    async def extract(self, carrier: AnyCarrier, auth_key: str, member: str = None) -> bytes:
+        """Extracts the payload of steganography, see `extract`.
+
+        Args:
+            carrier (AnyCarrier): The pixel array, the image or the encoded image.
+            auth_key (str): The authentication key.
+            member (str): The name of the member to extract, if the steganography is an archive.
+
+        Returns:
+            The payload.
+
+        Raises:
+            ValueError: There is no steganography, or the data is corrupted.
+            InvalidToken: The authentication key is invalid.
+            asyncio.QueueFull: Too many operations are waiting.
+        """
+        async with self._slot() as jobs:
+            pixels = await self._pixels_of(jobs, carrier)
+            return await self._run(jobs, extract, pixels, auth_key, member)
@@ -0,0 +1,336 @@
+# This module defines the batch jobs, which create and extract steganography of many files in a process pool.
+from __future__ import annotations
+
+import concurrent.futures
+import csv
+import logging
+import os
+import pathlib
+import time
+from typing import Callable, Iterator
+
+from SuperHelper.Core.Config import Config, make_config_global
+from SuperHelper.Modules.Stenographer.template import CarrierTemplate
+
+__all__ = [
+    "BatchResult",
+    "read_manifest",
+    "create_jobs_from_directory",
+    "extract_jobs_from_directory",
+    "create_one",
+    "extract_one",
+    "run_batch",
+    "ScanResult",
+    "find_images",
+    "scan_one",
+    "scan_images",
+]
+
+# The logger of the Stenographer module, whose errors are reported as the results of failed jobs
+logger_name: str = "SuperHelper.Builtins.Stenographer"
+
+# The carrier templates of a worker process, by path, set once by `_init_worker`
+_templates: dict[str, CarrierTemplate] = dict()
+
+
+class BatchResult:
+    """The result of a job of a batch."""
+
+    def __init__(self, path: str, ok: bool, size: int = 0, elapsed: float = 0.0, message: str = "") -> None:
+        """Initialises a `BatchResult` instance.
+
+        Args:
+            path (str): The path to the file of the job, i.e. the input file or the steganography.
+            ok (bool): Whether the job succeeded.
+            size (int): The number of bytes of data processed, i.e. the size of the input file or of the output file.
+            elapsed (float): The time taken by the job, in seconds.
+            message (str): The error message of a failed job.
+        """
+        self.path: str = path
+        self.ok: bool = ok
+        self.size: int = size
+        self.elapsed: float = elapsed
+        self.message: str = message
+
+    def __repr__(self) -> str:
+        return f"BatchResult(path={self.path!r}, ok={self.ok}, size={self.size}, elapsed={self.elapsed:.3f})"
+
+
+class ScanResult:
+    """The result of the scan of an image for steganography."""
+
+    def __init__(self, path: str, found: bool, density: int = 0, compression: int = 0, data_length: int = 0,
+                 codec: str = "", chunked: bool = False, aead: bool = False, message: str = "") -> None:
+        """Initialises a `ScanResult` instance.
+
+        Args:
+            path (str): The path to the image.
+            found (bool): Whether a valid header is found.
+            density (int): The density of the header.
+            compression (int): The compression level of the header.
+            data_length (int): The data length of the header, or the number of chunks for chunked containers.
+            codec (str): The name of the compression codec of the header.
+            chunked (bool): Whether the data is a chunked container.
+            aead (bool): Whether the data is binary AEAD ciphertext.
+            message (str): The error message if the image cannot be read.
+        """
+        self.path: str = path
+        self.found: bool = found
+        self.density: int = density
+        self.compression: int = compression
+        self.data_length: int = data_length
+        self.codec: str = codec
+        self.chunked: bool = chunked
+        self.aead: bool = aead
+        self.message: str = message
+
+    def __repr__(self) -> str:
+        return f"ScanResult(path={self.path!r}, found={self.found}, density={self.density}, " \
+               f"compression={self.compression}, data_length={self.data_length})"
+
+
+class _ErrorCapture(logging.Handler):
+    # Keeps the last error logged while a job runs
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.message: str = ""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.message = record.getMessage()
+
+
+def read_manifest(manifest: os.PathLike, n_columns: int) -> list[tuple[str, ...]]:
+    """Reads the jobs of a CSV manifest.
+
+    Blank lines and lines starting with `#` are skipped. Relative paths are relative to the directory of the manifest.
+
+    Args:
+        manifest (os.PathLike): The path to the manifest.
+        n_columns (int): The number of paths of every row.
+
+    Returns:
+        A list of tuples of paths, one tuple per job.
+
+    Raises:
+        ValueError: A row does not have `n_columns` paths.
+    """
+    manifest = pathlib.Path(manifest)
+    jobs = []
+    with open(manifest, newline="") as fp:
+        for line_number, row in enumerate(csv.reader(fp), 1):
+            if not row or not "".join(row).strip() or row[0].lstrip().startswith("#"):
+                continue
+            if len(row) != n_columns:
+                raise ValueError(f"Line {line_number} of the manifest must have {n_columns} paths!")
+            jobs.append(tuple(str(manifest.parent / path.strip()) for path in row))
+    return jobs
+
+
+def create_jobs_from_directory(input_dir: os.PathLike, output_dir: os.PathLike,
+                               image_file: os.PathLike) -> list[tuple[str, str, str]]:
+    """Makes a job for every file of the input directory, all of them hidden in the same carrier image.
+
+    Args:
+        input_dir (os.PathLike): The directory of the input files.
+        output_dir (os.PathLike): The directory of the steganography, named after the input files.
+        image_file (os.PathLike): The path to the carrier image.
+
+    Returns:
+        A list of 3-tuples of the input file, the carrier image and the steganography.
+    """
+    return [(str(path), str(image_file), str(pathlib.Path(output_dir) / f"{path.name}.png"))
+            for path in sorted(pathlib.Path(input_dir).iterdir()) if path.is_file()]
+
+
+def extract_jobs_from_directory(input_dir: os.PathLike, output_dir: os.PathLike) -> list[tuple[str, str]]:
+    """Makes a job for every steganography of the input directory.
+
+    Args:
+        input_dir (os.PathLike): The directory of the steganography.
+        output_dir (os.PathLike): The directory of the output files, named after the steganography without suffix.
+
+    Returns:
+        A list of 2-tuples of the steganography and the output file.
+    """
+    return [(str(path), str(pathlib.Path(output_dir) / path.stem))
+            for path in sorted(pathlib.Path(input_dir).iterdir()) if path.is_file()]
+
+
+def _run_job(path: str, output_path: str, job: Callable[[], int], size: Callable[[], int]) -> BatchResult:
+    # Runs a job, turning its errors into a failed result instead of letting them abort the batch
+    capture = _ErrorCapture()
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(capture)
+    started = time.perf_counter()
+    try:
+        if job() == 0:
+            return BatchResult(path, True, size(), time.perf_counter() - started)
+        message = capture.message or "Unknown error!"
+    except Exception as ex:
+        message = str(ex) or type(ex).__name__
+    finally:
+        logger.removeHandler(capture)
+    # Leave no partial output file behind
+    pathlib.Path(output_path).unlink(missing_ok=True)
+    return BatchResult(path, False, 0, time.perf_counter() - started, message)
+
+
+def create_one(job: tuple[str, str, str], options: dict[str, ...]) -> BatchResult:
+    """Creates the steganography of a job.
+
+    The carrier image is copied from its template if the batch has one, instead of being decoded again.
+
+    Args:
+        job (tuple[str, str, str]): The input file, the carrier image and the steganography.
+        options (dict[str, ...]): The keyword arguments of `write_steganography`, except the files.
+
+    Returns:
+        A `BatchResult` instance.
+    """
+    from PIL import Image
+    from SuperHelper.Modules.Stenographer.__main__ import write_steganography
+
+    input_path, image_path, output_path = job
+
+    def create() -> int:
+        template = _templates.get(image_path)
+        image_file = template.new_image() if template is not None else Image.open(image_path)
+        with open(input_path, "rb") as input_file, image_file as image:
+            pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(output_path, "wb") as output_file:
+                return write_steganography(input_file, image, output_file, show_image_on_completion=False, **options)
+
+    return _run_job(input_path, output_path, create, lambda: os.path.getsize(input_path))
+
+
+def extract_one(job: tuple[str, str], options: dict[str, ...]) -> BatchResult:
+    """Extracts the steganography of a job.
+
+    Args:
+        job (tuple[str, str]): The steganography and the output file.
+        options (dict[str, ...]): The keyword arguments of `extract_steganography`, except the files.
+
+    Returns:
+        A `BatchResult` instance.
+    """
+    from SuperHelper.Modules.Stenographer.__main__ import extract_steganography
+
+    input_path, output_path = job
+
+    def extract() -> int:
+        with open(input_path, "rb") as input_file:
+            pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(output_path, "wb") as output_file:
+                return extract_steganography(input_file, output_file, **options)
+
+    return _run_job(input_path, output_path, extract, lambda: os.path.getsize(output_path))
+
+
+def _init_worker(module_name: str, module_config: dict[str, ...],
+                 templates: dict[str, CarrierTemplate] = None) -> None:
+    # Workers which are not forked start without the global config
+    global _templates
+    make_config_global(Config(modules={module_name: module_config}))
+    _templates = templates or dict()
+
+
+def run_batch(worker: Callable[[tuple, dict[str, ...]], BatchResult], jobs: list[tuple], options: dict[str, ...],
+              module_name: str, module_config: dict[str, ...], max_workers: int = 0,
+              templates: dict[str, CarrierTemplate] = None) -> Iterator[BatchResult]:
+    """Runs the jobs of a batch in a process pool.
+
+    Args:
+        worker (Callable[[tuple, dict[str, ...]], BatchResult]): The function running a job, i.e. `create_one` or
+            `extract_one`.
+        jobs (list[tuple]): The jobs.
+        options (dict[str, ...]): The options passed to every job.
+        module_name (str): The name of the module of the config.
+        module_config (dict[str, ...]): The config of the module, passed to the workers.
+        max_workers (int): The number of worker processes, 0 for the number of CPUs.
+        templates (dict[str, CarrierTemplate]): The templates of the carrier images by path, preferably in shared
+            memory, see `shared_templates`.
+
+    Returns:
+        An iterator of `BatchResult` instances, in the order of completion.
+    """
+    if not jobs:
+        return
+    max_workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                initargs=(module_name, module_config, templates)) as executor:
+        futures = {executor.submit(worker, job, options): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as ex:
+                # The worker process died, e.g. killed for running out of memory
+                yield BatchResult(futures[future][0], False, message=str(ex) or type(ex).__name__)
+
+
+def find_images(paths: list[os.PathLike], suffixes: tuple[str, ...] = (".png",)) -> list[str]:
+    """Finds the images to scan.
+
+    Args:
+        paths (list[os.PathLike]): The paths to images, or to directories which are searched recursively.
+        suffixes (tuple[str, ...]): The suffixes of the images searched in directories, case-insensitive.
+
+    Returns:
+        A list of paths to images.
+    """
+    images = []
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            images.extend(str(image) for image in sorted(path.rglob("*"))
+                          if image.suffix.lower() in suffixes and image.is_file())
+        else:
+            images.append(str(path))
+    return images
+
+
+def scan_one(path: str) -> ScanResult:
+    """Scans an image for steganography.
+
+    Only the leading pixels holding the header are decoded, which for PNG images means only the leading rows.
+
+    Args:
+        path (str): The path to the image.
+
+    Returns:
+        A `ScanResult` instance.
+    """
+    from PIL import Image
+    from SuperHelper.Modules.Stenographer.__main__ import extract_header
+
+    try:
+        with Image.open(path) as image:
+            header = extract_header(image)
+    except Exception as ex:
+        return ScanResult(path, False, message=str(ex) or type(ex).__name__)
+    if header is None:
+        return ScanResult(path, False)
+    return ScanResult(path, True, header.density, header.compression, header.data_length, header.codec,
+                      header.chunked, header.aead)
+
+
+def scan_images(paths: list[str], module_name: str, module_config: dict[str, ...], max_workers: int = 0,
+                chunk_size: int = 64) -> Iterator[ScanResult]:
+    """Scans images for steganography in a process pool.
+
+    Args:
+        paths (list[str]): The paths to the images.
+        module_name (str): The name of the module of the config.
+        module_config (dict[str, ...]): The config of the module, passed to the workers.
+        max_workers (int): The number of worker processes, 0 for the number of CPUs.
+        chunk_size (int): The number of images sent to a worker at a time.
+
+    Returns:
+        An iterator of `ScanResult` instances, in the order of `paths`.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    if max_workers <= 1:
+        # Scanning an image takes milliseconds, not worth starting a worker for
+        yield from map(scan_one, paths)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                initargs=(module_name, module_config)) as executor:
+        yield from executor.map(scan_one, paths, chunksize=chunk_size)
@@ -0,0 +1,221 @@
+# This module defines the BitPlane class, a vectorised view over the low bits of the colour channels of a carrier.
+from __future__ import annotations
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+__all__ = [
+    "BitPlane",
+]
+
+
+class BitPlane:
+    """A vectorised view over the `density` low bits of the colour channels of a carrier.
+
+    The bits are laid out exactly as the original per-pixel loop lays them out:
+
+    * pixels are visited column by column, i.e. from top to bottom, then from left to right;
+    * only the first three channels (RGB) of every pixel carry data, each of them `density` bits;
+    * the first bit stored in a channel goes to the highest of its low bits;
+    * every byte of data is consumed from its least significant bit.
+
+    Long reads and writes are split into stripes of whole columns, which are processed in parallel threads. Since
+    the stripes never share a column, nor a byte of data, the result is the same as that of a serial run.
+    """
+
+    channels: int = 3
+    """Number of channels of a pixel that carry data."""
+
+    minimum_stripe_bits: int = 1 << 22
+    """Minimum number of bits of a stripe, below which reads and writes are not worth splitting."""
+
+    def __init__(self, pixels: np.ndarray, density: int, workers: int = None, minimum_stripe_bits: int = None) -> None:
+        """Initialises a `BitPlane` instance.
+
+        Args:
+            pixels (np.ndarray): The `uint8` pixel array of shape (height, width, bands), modified in place on write.
+            density (int): The number of low bits of every channel that carry data.
+            workers (int): The maximum number of threads of a read or a write, defaults to the number of CPUs.
+            minimum_stripe_bits (int): The minimum number of bits of a stripe, defaults to `minimum_stripe_bits`.
+
+        Raises:
+            ValueError: The pixel array has less than 3 bands.
+        """
+        if pixels.ndim != 3 or pixels.shape[2] < BitPlane.channels:
+            raise ValueError("The carrier must have at least 3 colour channels!")
+        self.pixels: np.ndarray = pixels
+        self.density: int = density
+        self.height, self.width = pixels.shape[:2]
+        self.capacity: int = self.height * self.width * BitPlane.channels * density
+        """Number of bits which can be stored in the carrier."""
+        self._shifts: np.ndarray = np.arange(density - 1, -1, -1, dtype=np.uint8)
+        self._mask: np.uint8 = np.uint8(0xFF ^ ((1 << density) - 1))
+        self.workers: int = workers or os.cpu_count() or 1
+        self.minimum_stripe_bits: int = BitPlane.minimum_stripe_bits if minimum_stripe_bits is None \
+            else minimum_stripe_bits
+
+    @staticmethod
+    def pixels_for(n_bits: int, density: int) -> int:
+        """Calculates the number of pixels occupied by `n_bits` bits.
+
+        Args:
+            n_bits (int): The number of bits to store.
+            density (int): The number of low bits of every channel that carry data.
+
+        Returns:
+            The number of pixels, counting the trailing partially used pixel.
+        """
+        return -(-n_bits // (BitPlane.channels * density))
+
+    @staticmethod
+    def region_for(n_bits: int, density: int, height: int) -> tuple[int, int]:
+        """Calculates the leading region of a carrier that holds the first `n_bits` bits.
+
+        Args:
+            n_bits (int): The number of bits to store.
+            density (int): The number of low bits of every channel that carry data.
+            height (int): The height of the carrier.
+
+        Returns:
+            A 2-tuple of the number of rows and the number of leading columns holding the bits.
+        """
+        no_of_pixel = BitPlane.pixels_for(n_bits, density)
+        return min(no_of_pixel, height), -(-no_of_pixel // height)
+
+    @staticmethod
+    def read_leading(pixels: np.ndarray, length: int, densities: list[int]) -> dict[int, bytes]:
+        """Reads the leading bytes stored in the carrier for several densities at once.
+
+        The low bits of the leading channels are unpacked once, and the bytes of every density are sliced from them.
+
+        Args:
+            pixels (np.ndarray): The `uint8` pixel array of shape (height, width, bands).
+            length (int): The number of bytes to read.
+            densities (list[int]): The densities to read for.
+
+        Returns:
+            A dictionary mapping each density to the bytes read, which are shorter than `length` if the carrier is
+            too small for that density.
+        """
+        n_bits = length * 8
+        plane = BitPlane(pixels, max(densities))
+        n_channel = min(-(-n_bits // min(densities)), plane.capacity // plane.density)
+        block, _ = plane._gather(0, n_channel)
+        bits = (block[:n_channel, None] >> plane._shifts) & 1
+        result = dict()
+        for density in densities:
+            stream = bits[:-(-n_bits // density), plane.density - density:].reshape(-1)
+            stream = stream[:len(stream) - len(stream) % 8][:n_bits]
+            result[density] = np.packbits(stream, bitorder="little").tobytes()
+        return result
+
+    def _gather(self, first: int, last: int) -> tuple[np.ndarray, int]:
+        # Copies the columns spanning channels [first, last) into a flat array in storage order
+        # and returns it with the index of its first channel.
+        column_size = self.height * BitPlane.channels
+        x_start, x_stop = first // column_size, -(-last // column_size)
+        block = self.pixels[:, x_start:x_stop, :BitPlane.channels].transpose(1, 0, 2).reshape(-1)
+        return block, x_start * column_size
+
+    def _scatter(self, block: np.ndarray, base: int) -> None:
+        # Writes back a flat array returned by `_gather`
+        column_size = self.height * BitPlane.channels
+        x_start = base // column_size
+        x_stop = x_start + len(block) // column_size
+        self.pixels[:, x_start:x_stop, :BitPlane.channels] = \
+            block.reshape(x_stop - x_start, self.height, BitPlane.channels).transpose(1, 0, 2)
+
+    def _span(self, offset: int, n_bits: int) -> tuple[int, int]:
+        if offset < 0 or offset + n_bits > self.capacity:
+            raise ValueError("Bit range exceeds the capacity of the carrier!")
+        return offset // self.density, -(-(offset + n_bits) // self.density)
+
+    def _stripes(self, offset: int, n_bits: int) -> list[tuple[int, int]]:
+        # Splits a bit range into stripes of (position, number of bits), whose boundaries are both column boundaries,
+        # so that no two stripes gather the same column, and byte boundaries of the data
+        column_bits = self.height * BitPlane.channels * self.density
+        unit = column_bits * 8 // math.gcd(column_bits, 8)
+        n_stripe = min(self.workers, n_bits // max(self.minimum_stripe_bits, 1))
+        if n_stripe <= 1 or offset % 8:
+            return [(offset, n_bits)]
+        end = offset + n_bits
+        boundaries = [offset]
+        for i in range(1, n_stripe):
+            boundary = (offset + n_bits * i // n_stripe) // unit * unit
+            if boundaries[-1] < boundary < end:
+                boundaries.append(boundary)
+        boundaries.append(end)
+        return [(start, stop - start) for start, stop in zip(boundaries, boundaries[1:])]
+
+    def read(self, length: int, offset: int = 0) -> bytes:
+        """Reads bytes stored in the carrier.
+
+        Args:
+            length (int): The number of bytes to read.
+            offset (int): The position of the first bit to read.
+
+        Returns:
+            The bytes read.
+
+        Raises:
+            ValueError: The bytes to read exceed the capacity of the carrier.
+        """
+        self._span(offset, length * 8)
+        stripes = self._stripes(offset, length * 8)
+        if len(stripes) == 1:
+            return self._read(length, offset)
+        with ThreadPoolExecutor(len(stripes)) as executor:
+            return b"".join(executor.map(lambda stripe: self._read(stripe[1] // 8, stripe[0]), stripes))
+
+    def _read(self, length: int, offset: int) -> bytes:
+        n_bits = length * 8
+        first, last = self._span(offset, n_bits)
+        block, base = self._gather(first, last)
+        bits = (block[first - base:last - base, None] >> self._shifts) & 1
+        head = offset - first * self.density
+        return np.packbits(bits.reshape(-1)[head:head + n_bits], bitorder="little").tobytes()
+
+    def write(self, data: bytes, offset: int = 0, n_bits: int = None) -> None:
+        """Writes bytes into the carrier.
+
+        Args:
+            data (bytes): The bytes to write.
+            offset (int): The position of the first bit to write.
+            n_bits (int): The number of leading bits of `data` to write, defaults to all of them.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: The bytes to write exceed the capacity of the carrier.
+        """
+        n_bits = len(data) * 8 if n_bits is None else min(n_bits, len(data) * 8)
+        if n_bits == 0:
+            return
+        self._span(offset, n_bits)
+        stripes = self._stripes(offset, n_bits)
+        if len(stripes) == 1:
+            return self._write(data, offset, n_bits)
+
+        def write_stripe(stripe: tuple[int, int]) -> None:
+            start, stripe_bits = stripe
+            position = (start - offset) // 8
+            self._write(data[position:position + -(-stripe_bits // 8)], start, stripe_bits)
+
+        with ThreadPoolExecutor(len(stripes)) as executor:
+            list(executor.map(write_stripe, stripes))
+
+    def _write(self, data: bytes, offset: int, n_bits: int) -> None:
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")[:n_bits]
+        first, last = self._span(offset, len(bits))
+        block, base = self._gather(first, last)
+        values = block[first - base:last - base]
+        current = ((values[:, None] >> self._shifts) & 1).reshape(-1)
+        head = offset - first * self.density
+        current[head:head + len(bits)] = bits
+        low = (current.reshape(-1, self.density) << self._shifts).sum(axis=1, dtype=np.uint8)
+        block[first - base:last - base] = (values & self._mask) | low
+        self._scatter(block, base)
@@ -0,0 +1,338 @@
+# This module defines the functions to load the pixels of carrier images.
+from __future__ import annotations
+
+import io
+import os
+import pathlib
+import re
+import shutil
+import struct
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+
+__all__ = [
+    "MappedCarrier",
+    "open_carrier",
+    "load_pixels",
+    "load_region",
+    "decode_rows",
+]
+
+# Magic numbers of the uncompressed formats which can be mapped
+mapped_magics: tuple[bytes, ...] = (b"BM", b"P6", b"P7")
+# Bit masks of the channels of 32-bit BMP images with bit fields, in BGRA order
+bmp_bgra_masks: tuple[int, ...] = (0x00FF0000, 0x0000FF00, 0x000000FF)
+pnm_header: re.Pattern = re.compile(rb"P6(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)\s")
+pam_header_end: bytes = b"ENDHDR\n"
+# Suffixes of the files of every format which can be mapped
+mapped_suffixes: dict[str, tuple[str, ...]] = {
+    "BMP": (".bmp", ".dib"),
+    "PPM": (".ppm", ".pnm"),
+    "PAM": (".pam",),
+    "RAW": (".rgb", ".rgba", ".raw"),
+}
+
+
+class MappedCarrier:
+    """A carrier image of an uncompressed format, whose pixels are mapped from the file instead of decoded.
+
+    BMP (24-bit, or 32-bit BGRA), PPM (8-bit P6), PAM (8-bit RGB or RGB_ALPHA) and raw RGB or RGBA images are
+    supported. The pixels are a view over the colour channels of the mapping, in the layout of `BitPlane`, hence
+    reading them only touches the pages of the file that hold the data, and writing them writes to the file.
+    """
+
+    def __init__(self, path: os.PathLike, image_format: str, size: tuple[int, int], mode: str, offset: int,
+                 row_stride: int, bottom_up: bool = False, bgr: bool = False, writable: bool = False) -> None:
+        """Initialises a `MappedCarrier` instance, mapping the pixels of the file.
+
+        Args:
+            path (os.PathLike): The path to the image.
+            image_format (str): The format of the image, 'BMP', 'PPM', 'PAM' or 'RAW'.
+            size (tuple[int, int]): The width and the height of the image.
+            mode (str): The mode of the image, 'RGB' or 'RGBA'.
+            offset (int): The position of the pixels in the file.
+            row_stride (int): The number of bytes per row in the file, padding included.
+            bottom_up (bool): Whether the rows are stored from the bottom up.
+            bgr (bool): Whether the channels are stored in BGR order.
+            writable (bool): Whether to map the file for writing.
+
+        Raises:
+            ValueError: The file is too short for the image.
+            OSError: The file cannot be mapped.
+        """
+        self.path: pathlib.Path = pathlib.Path(path)
+        self.format: str = image_format
+        self.size: tuple[int, int] = size
+        self.mode: str = mode
+        self.writable: bool = writable
+        self._layout: tuple = (image_format, size, mode, offset, row_stride, bottom_up, bgr)
+        width, height = size
+        bands = len(mode)
+        if offset + row_stride * height > self.path.stat().st_size or width * bands > row_stride:
+            raise ValueError("Image data is truncated!")
+        self._map: Optional[np.memmap] = np.memmap(self.path, np.uint8, "r+" if writable else "r", offset,
+                                                   (height, row_stride))
+        # Splitting the row into pixels leaves the padding out without copying
+        pixels = self._map[:, :width * bands].reshape(height, width, bands)
+        if bottom_up:
+            pixels = pixels[::-1]
+        # All the bands, in the order of the file, to decode the image with its alpha channel
+        self._bands: Optional[np.ndarray] = pixels
+        self.pixels: Optional[np.ndarray] = pixels[..., 2::-1] if bgr else pixels[..., :BitPlane.channels]
+        """View of shape (height, width, 3) over the colour channels, in RGB order."""
+
+    def __repr__(self) -> str:
+        return f"MappedCarrier(path={str(self.path)!r}, format={self.format}, size={self.size}, mode={self.mode})"
+
+    @staticmethod
+    def open(path: os.PathLike, writable: bool = False, raw_size: tuple[int, int] = None,
+             raw_mode: str = "RGB") -> MappedCarrier:
+        """Maps an image of an uncompressed format.
+
+        Args:
+            path (os.PathLike): The path to the image.
+            writable (bool): Whether to map the file for writing.
+            raw_size (tuple[int, int]): The width and the height of a raw image, which has no header.
+            raw_mode (str): The mode of a raw image, 'RGB' or 'RGBA'.
+
+        Returns:
+            A `MappedCarrier` instance.
+
+        Raises:
+            ValueError: The image is not of a supported format, or is truncated.
+            OSError: The file cannot be read or mapped.
+        """
+        if raw_size is not None:
+            if raw_mode not in ("RGB", "RGBA"):
+                raise ValueError(f"Unsupported mode '{raw_mode}'!")
+            return MappedCarrier(path, "RAW", raw_size, raw_mode, 0, raw_size[0] * len(raw_mode), writable=writable)
+        with open(path, "rb") as fp:
+            head = fp.read(1024)
+        if head[:2] == b"BM":
+            return MappedCarrier._open_bmp(path, head, writable)
+        if head[:2] == b"P6":
+            match = pnm_header.match(head)
+            if match is None or int(match.group(3)) != 255:
+                raise ValueError("Only 8-bit PPM images can be mapped!")
+            width, height = int(match.group(1)), int(match.group(2))
+            return MappedCarrier(path, "PPM", (width, height), "RGB", match.end(), width * 3, writable=writable)
+        if head[:3] == b"P7\n" and pam_header_end in head:
+            end = head.index(pam_header_end)
+            fields = dict(line.split(None, 1) for line in head[3:end].decode("ascii").splitlines()
+                          if line.strip() and not line.startswith("#"))
+            mode = {("3", "RGB"): "RGB", ("4", "RGB_ALPHA"): "RGBA"}.get(
+                (fields.get("DEPTH", "").strip(), fields.get("TUPLTYPE", "").strip()))
+            if mode is None or fields.get("MAXVAL", "").strip() != "255":
+                raise ValueError("Only 8-bit RGB or RGBA PAM images can be mapped!")
+            width, height = int(fields["WIDTH"]), int(fields["HEIGHT"])
+            return MappedCarrier(path, "PAM", (width, height), mode, end + len(pam_header_end), width * len(mode),
+                                 writable=writable)
+        raise ValueError("Image cannot be mapped!")
+
+    @staticmethod
+    def _open_bmp(path: os.PathLike, head: bytes, writable: bool) -> MappedCarrier:
+        (offset,) = struct.unpack_from("<I", head, 10)
+        info_size, width, height, _, bpp, compression = struct.unpack_from("<IiiHHI", head, 14)
+        if info_size < 40 or width <= 0 or height == 0:
+            raise ValueError("Unsupported BMP image!")
+        if compression == 3 and bpp == 32:
+            # Bit fields follow the info header, or are part of the V4 and V5 headers
+            if struct.unpack_from("<III", head, 54) != bmp_bgra_masks:
+                raise ValueError("Unsupported BMP image!")
+        elif compression != 0 or bpp not in (24, 32):
+            raise ValueError("Only uncompressed 24-bit or 32-bit BMP images can be mapped!")
+        mode = "RGB" if bpp == 24 else "RGBA"
+        # Rows are padded to 4 bytes
+        row_stride = (width * bpp // 8 + 3) // 4 * 4
+        return MappedCarrier(path, "BMP", (width, abs(height)), mode, offset, row_stride, bottom_up=height > 0,
+                             bgr=True, writable=writable)
+
+    def copy_to(self, path: os.PathLike) -> MappedCarrier:
+        """Copies the image to a new file, and maps the copy for writing.
+
+        Args:
+            path (os.PathLike): The path to the copy.
+
+        Returns:
+            A writable `MappedCarrier` instance of the copy.
+
+        Raises:
+            OSError: The image cannot be copied or mapped.
+        """
+        shutil.copyfile(self.path, path)
+        return self.map_file(path, True)
+
+    def map_file(self, path: os.PathLike, writable: bool = False) -> MappedCarrier:
+        """Maps another file of the same layout as the image, e.g. a copy of it.
+
+        Args:
+            path (os.PathLike): The path to the file.
+            writable (bool): Whether to map the file for writing.
+
+        Returns:
+            A `MappedCarrier` instance of the file.
+
+        Raises:
+            ValueError: The file is too short for the image.
+            OSError: The file cannot be mapped.
+        """
+        image_format, size, mode, offset, row_stride, bottom_up, bgr = self._layout
+        return MappedCarrier(path, image_format, size, mode, offset, row_stride, bottom_up, bgr, writable)
+
+    def has_suffix_of(self, path: os.PathLike) -> bool:
+        """Tells whether a path has a suffix of the format of the image.
+
+        Args:
+            path (os.PathLike): The path.
+
+        Returns:
+            True if the suffix of the path, case-insensitive, is one of the format of the image.
+        """
+        return pathlib.Path(path).suffix.lower() in mapped_suffixes[self.format]
+
+    def flush(self) -> None:
+        """Writes the modified pixels to the file.
+
+        Returns:
+            None
+        """
+        if self.writable and self._map is not None:
+            self._map.flush()
+
+    def close(self) -> None:
+        """Flushes and unmaps the image, after which it cannot be used.
+
+        Returns:
+            None
+        """
+        self.flush()
+        self.pixels = self._bands = self._map = None
+
+    def to_image(self) -> Image.Image:
+        """Decodes all the bands into a new image, alpha channel included.
+
+        Returns:
+            An `Image.Image` instance of the mode of the image.
+        """
+        bgr = self._layout[-1]
+        # Indexing the bands of BGR images copies them in RGB order
+        return Image.fromarray(self._bands[..., (2, 1, 0, 3)[:len(self.mode)]] if bgr else
+                               np.ascontiguousarray(self._bands))
+
+
+def open_carrier(fp: Union[io.IOBase, os.PathLike, MappedCarrier]) -> Union[Image.Image, MappedCarrier]:
+    """Opens a carrier image, which is mapped if it is a file of an uncompressed format, and decoded otherwise.
+
+    Args:
+        fp (Union[io.IOBase, os.PathLike, MappedCarrier]): The image file or its path, or a carrier which is
+            already mapped.
+
+    Returns:
+        A `MappedCarrier` instance, or a lazily opened `Image.Image` instance.
+
+    Raises:
+        Image.UnidentifiedImageError: The file is not an image.
+    """
+    if isinstance(fp, MappedCarrier):
+        return fp
+    path = fp if isinstance(fp, (str, os.PathLike)) else getattr(fp, "name", None)
+    if isinstance(path, (str, os.PathLike)):
+        try:
+            with open(path, "rb") as file:
+                magic = file.read(2)
+            if magic in mapped_magics:
+                return MappedCarrier.open(path)
+        except (OSError, ValueError):
+            pass
+    return Image.open(fp)
+
+
+def load_pixels(image: Union[Image.Image, MappedCarrier]) -> np.ndarray:
+    """Loads the pixels of the image.
+
+    Args:
+        image (Union[Image.Image, MappedCarrier]): The carrier image.
+
+    Returns:
+        A `uint8` array of shape (height, width, bands), which is a view over the mapping of mapped carriers.
+    """
+    if isinstance(image, MappedCarrier):
+        return image.pixels
+    return np.array(image)
+
+
+def _is_row_decodable(image: Image.Image) -> bool:
+    # Only lazily opened, non-interlaced PNG images with a single IDAT stream can be decoded row by row
+    if image.format != "PNG" or getattr(image, "fp", None) is None or len(image.tile) != 1:
+        return False
+    tile = image.tile[0]
+    return tile[0] == "zip" and tuple(tile[1]) == (0, 0) + image.size and not image.info.get("interlace")
+
+
+def decode_rows(image: Image.Image, rows: int) -> np.ndarray:
+    """Decodes the leading rows of the image.
+
+    If the image is a lazily opened PNG image, only the IDAT chunks holding the leading rows are read and inflated,
+    and the image itself is left unloaded. Otherwise, the whole image is decoded.
+
+    Args:
+        image (Image.Image): The image to decode.
+        rows (int): The number of leading rows to decode.
+
+    Returns:
+        A writable `uint8` array of shape (rows, width, bands) of the leading rows.
+    """
+    width, height = image.size
+    rows = min(rows, height)
+    if rows == height or not _is_row_decodable(image):
+        return np.array(image.crop((0, 0, width, rows)))
+
+    name, _, offset, args = image.tile[0]
+    target = Image.new(image.mode, (width, rows))
+    decoder = Image._getdecoder(image.mode, name, args)
+    decoder.setimage(target.im, (0, 0, width, rows))
+    fp = image.fp
+    # The tile offset points to the data of the first IDAT chunk
+    fp.seek(offset - 8)
+    buffer = b""
+    try:
+        while True:
+            length, chunk_type = struct.unpack(">I4s", fp.read(8))
+            if chunk_type != b"IDAT":
+                raise OSError("Image data is truncated!")
+            buffer += fp.read(length)
+            # Skip the CRC
+            fp.read(4)
+            consumed, _ = decoder.decode(buffer)
+            if consumed < 0:
+                break
+            buffer = buffer[consumed:]
+    finally:
+        decoder.cleanup()
+    return np.array(target)
+
+
+def load_region(image: Union[Image.Image, MappedCarrier], n_bits: int, density: int) -> np.ndarray:
+    """Loads the leading region of the image that holds the first `n_bits` bits.
+
+    Pixels are stored column by column, hence only the leading rows are decoded if the bits fit into the first column.
+
+    Args:
+        image (Union[Image.Image, MappedCarrier]): The carrier image.
+        n_bits (int): The number of bits stored.
+        density (int): The density of the steganography.
+
+    Returns:
+        A `uint8` array of shape (rows, columns, bands) of the region, which is a view over the mapping of mapped
+        carriers, and a writable copy otherwise.
+    """
+    rows, columns = BitPlane.region_for(n_bits, density, image.size[1])
+    if isinstance(image, MappedCarrier):
+        return image.pixels[:rows, :columns]
+    if rows < image.size[1] and _is_row_decodable(image):
+        return decode_rows(image, rows)[:, :columns].copy()
+    return np.array(image.crop((0, 0, columns, rows)))
@@ -0,0 +1,246 @@
+# This module defines the registry of compression codecs and the automatic codec selection.
+from __future__ import annotations
+
+import bz2
+import functools
+import io
+import lzma
+import math
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+__all__ = [
+    "Codec",
+    "codec_ids",
+    "register_codec",
+    "get_codec",
+    "available_codecs",
+    "compress",
+    "decompress",
+    "compress_bz2_parallel",
+    "estimate_entropy",
+    "sample_file",
+    "choose_codec",
+]
+
+codec_ids: dict[str, int] = {
+    "bz2": 0,
+    "zlib": 1,
+    "lzma": 2,
+    "zstd": 3,
+    "lz4": 4,
+}
+"""Identifiers of the known codecs, as recorded in the header. `bz2` is the only codec of the text header."""
+
+
+class Codec:
+    """A compression codec of the registry."""
+
+    def __init__(self, name: str, compressor: Callable[[bytes, int], bytes],
+                 decompressor: Callable[[bytes], bytes]) -> None:
+        """Initialises a `Codec` instance.
+
+        Args:
+            name (str): The name of the codec, which must be one of `codec_ids`.
+            compressor (Callable[[bytes, int], bytes]): The function compressing data at a level (from 1 to 9).
+            decompressor (Callable[[bytes], bytes]): The function decompressing data.
+        """
+        self.name: str = name
+        self.identifier: int = codec_ids[name]
+        self.compress: Callable[[bytes, int], bytes] = compressor
+        self.decompress: Callable[[bytes], bytes] = decompressor
+
+
+_registry: dict[str, Codec] = dict()
+
+
+def register_codec(codec: Codec) -> None:
+    """Registers a codec, replacing any codec of the same name.
+
+    Args:
+        codec (Codec): The codec to register.
+
+    Returns:
+        None
+    """
+    _registry[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """Gets a registered codec.
+
+    Args:
+        name (str): The name of the codec.
+
+    Returns:
+        The `Codec` instance.
+
+    Raises:
+        ValueError: The codec is unknown or its package is not installed.
+    """
+    if name not in _registry:
+        raise ValueError(f"Codec '{name}' is not available!")
+    return _registry[name]
+
+
+def available_codecs() -> list[str]:
+    """Lists the names of the registered codecs.
+
+    Returns:
+        A list of codec names, ordered by their identifiers.
+    """
+    return sorted(_registry, key=codec_ids.get)
+
+
+def compress(data: bytes, codec: str, level: int) -> bytes:
+    """Compresses data with a registered codec.
+
+    Args:
+        data (bytes): The data to compress.
+        codec (str): The name of the codec.
+        level (int): The compression level, 0 for no compression.
+
+    Returns:
+        The compressed data.
+    """
+    return get_codec(codec).compress(data, level) if level > 0 else data
+
+
+def decompress(data: bytes, codec: str, level: int) -> bytes:
+    """Decompresses data with a registered codec.
+
+    Args:
+        data (bytes): The data to decompress.
+        codec (str): The name of the codec.
+        level (int): The compression level, 0 for no compression.
+
+    Returns:
+        The decompressed data.
+    """
+    return get_codec(codec).decompress(data) if level > 0 else data
+
+
+def compress_bz2_parallel(data: bytes, level: int, block_size: int = 1 << 20, workers: int = None) -> bytes:
+    """Compresses data with bzip2, splitting it into blocks which are compressed in parallel.
+
+    The blocks are compressed in a thread pool, since bzip2 releases the GIL, and are concatenated into a multi-stream
+    bzip2 file, which `bz2.decompress` decompresses as a whole.
+
+    Args:
+        data (bytes): The data to compress.
+        level (int): The compression level (from 1 to 9).
+        block_size (int): The number of bytes per block, data not bigger than that is compressed in one stream.
+        workers (int): The number of threads, defaults to the number of CPUs.
+
+    Returns:
+        The compressed data.
+    """
+    if len(data) <= block_size:
+        return bz2.compress(data, compresslevel=level)
+    view = memoryview(data)
+    blocks = [view[i:i + block_size] for i in range(0, len(data), block_size)]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return b"".join(executor.map(functools.partial(bz2.compress, compresslevel=level), blocks))
+
+
+register_codec(Codec("bz2", compress_bz2_parallel, bz2.decompress))
+register_codec(Codec("zlib", lambda data, level: zlib.compress(data, level), zlib.decompress))
+register_codec(Codec("lzma", lambda data, level: lzma.compress(data, preset=level), lzma.decompress))
+
+try:
+    import zstandard
+
+    register_codec(Codec("zstd", lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                         lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)))
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+
+    register_codec(Codec("lz4", lambda data, level: lz4.frame.compress(data, compression_level=level),
+                         lz4.frame.decompress))
+except ImportError:
+    pass
+
+
+def estimate_entropy(sample: bytes) -> float:
+    """Estimates the Shannon entropy of data from a sample.
+
+    Args:
+        sample (bytes): The sample of the data.
+
+    Returns:
+        The entropy in bits per byte, from 0 to 8.
+    """
+    if not sample:
+        return 0.0
+    counts = np.bincount(np.frombuffer(sample, dtype=np.uint8), minlength=256)
+    probabilities = counts[counts > 0] / len(sample)
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+def sample_file(file: io.IOBase, size: int = 1 << 18, windows: int = 4) -> bytes:
+    """Samples evenly spaced windows of a seekable file, then rewinds it to where it was.
+
+    Args:
+        file (io.IOBase): The file to sample.
+        size (int): The total size of the sample.
+        windows (int): The number of windows.
+
+    Returns:
+        The sample, which is the whole file if it is smaller than `size`.
+    """
+    start = file.tell()
+    length = file.seek(0, io.SEEK_END) - start
+    try:
+        if length <= size:
+            file.seek(start)
+            return file.read(length)
+        window = size // windows
+        sample = b""
+        for i in range(windows):
+            file.seek(start + (length - window) * i // max(windows - 1, 1))
+            sample += file.read(window)
+        return sample
+    finally:
+        file.seek(start)
+
+
+def choose_codec(sample: bytes, level: int, candidates: list[str] = None, entropy_threshold: float = 7.5,
+                 minimum_saving: float = 0.03, tolerance: float = 0.05) -> tuple[str, int]:
+    """Chooses a codec for data from a sample.
+
+    Data which looks already compressed (e.g. zip, jpg or mp4) is not compressed at all. Otherwise, the sample is
+    compressed with every candidate and the fastest codec among those within `tolerance` of the best ratio is chosen.
+
+    Args:
+        sample (bytes): The sample of the data.
+        level (int): The compression level to use.
+        candidates (list[str]): The names of the candidate codecs, defaults to all the registered codecs.
+        entropy_threshold (float): The entropy (in bits per byte) above which the data is not compressed.
+        minimum_saving (float): The fraction of the size that a codec must save to be worth compressing with.
+        tolerance (float): The fraction of the best compressed size within which codecs are ranked by speed.
+
+    Returns:
+        A 2-tuple of the name of the codec and the compression level, which is 0 if the data should not be compressed.
+    """
+    candidates = available_codecs() if candidates is None else candidates
+    if level == 0 or not sample or estimate_entropy(sample) > entropy_threshold:
+        return "bz2", 0
+    results = []
+    for name in candidates:
+        started = time.perf_counter()
+        size = len(get_codec(name).compress(sample, level))
+        results.append((size, time.perf_counter() - started, name))
+    best_size = min(size for size, _, _ in results)
+    if best_size > len(sample) * (1 - minimum_saving):
+        return "bz2", 0
+    _, _, name = min((elapsed, size, name) for size, elapsed, name in results
+                     if size <= math.ceil(best_size * (1 + tolerance)))
+    return name, level
@@ -0,0 +1,148 @@
+# This module defines the chunked container, which streams data between files and carriers one chunk at a time.
+import io
+import struct
+
+from SuperHelper.Core.Utils import Cryptographer
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+from SuperHelper.Modules.Stenographer.compression import compress, decompress
+
+__all__ = [
+    "write_container",
+    "read_container",
+    "read_first_token",
+]
+
+# Container layout:
+#   Preamble: magic (3 bytes), version (1 byte), chunk size (4 bytes)
+#   Frames: length of token (4 bytes) + token, where each token is the
+#   encrypted chunk index (4 bytes), last chunk marker (1 byte) and the
+#   individually compressed chunk
+container_magic: bytes = b"SHC"
+container_version: int = 1
+preamble_format: struct.Struct = struct.Struct(">3sBI")
+frame_format: struct.Struct = struct.Struct(">I")
+chunk_format: struct.Struct = struct.Struct(">IB")
+
+
+def write_container(input_file: io.IOBase, plane: BitPlane, offset: int, crypto: Cryptographer, codec: str,
+                    compression: int, chunk_size: int, aead: bool) -> tuple[int, int]:
+    """Streams the input file into the carrier as a chunked container.
+
+    Only one chunk of the input file is held in memory at a time. The carrier is not streamed, hence memory is
+    bounded by the size of the carrier rather than by the chunk size.
+
+    Args:
+        input_file (io.IOBase): The file to read data from.
+        plane (BitPlane): The bit plane of the carrier to write to.
+        offset (int): The position of the first bit of the container.
+        crypto (Cryptographer): The encrypter of the chunks.
+        codec (str): The name of the compression codec of the chunks.
+        compression (int): The compression level of the chunks, 0 for no compression.
+        chunk_size (int): The number of bytes of the input file per chunk.
+        aead (bool): Whether to encrypt the chunks into binary AEAD tokens instead of Fernet tokens.
+
+    Returns:
+        A 2-tuple of the number of chunks and the number of bits written.
+
+    Raises:
+        ValueError: The input file is empty, or the data is too big to be stored.
+    """
+    position = offset
+    index = 0
+
+    def write(data: bytes) -> None:
+        nonlocal position
+        if position + len(data) * 8 > plane.capacity:
+            raise ValueError("Data is too big to be stored!")
+        plane.write(data, position)
+        position += len(data) * 8
+
+    write(preamble_format.pack(container_magic, container_version, chunk_size))
+    chunk = input_file.read(chunk_size)
+    if not chunk:
+        raise ValueError("Input file is empty or exhausted!")
+    while chunk:
+        # Read ahead to tell whether this is the last chunk
+        next_chunk = input_file.read(chunk_size)
+        data = compress(chunk, codec, compression)
+        data = chunk_format.pack(index, not next_chunk) + data
+        token = crypto.encrypt_aead(data) if aead else crypto.encrypt(data)
+        write(frame_format.pack(len(token)) + token)
+        chunk = next_chunk
+        index += 1
+    return index, position - offset
+
+
+def _read_preamble(plane: BitPlane, offset: int) -> tuple[int, int]:
+    # Returns the position of the first frame and the maximum token length
+    magic, version, chunk_size = preamble_format.unpack(plane.read(preamble_format.size, offset))
+    if magic != container_magic or version != container_version:
+        raise ValueError("Unsupported container!")
+    # Bound the token length by the worst case of the Fernet token of an incompressible chunk
+    return offset + preamble_format.size * 8, 4 * (chunk_size * 2 + chunk_format.size + 128) // 3
+
+
+def _read_token(plane: BitPlane, position: int, maximum_token_length: int) -> tuple[bytes, int]:
+    # Returns the token of the frame at the position and the position of the next frame
+    (token_length,) = frame_format.unpack(plane.read(frame_format.size, position))
+    position += frame_format.size * 8
+    if token_length > maximum_token_length:
+        raise ValueError("Malformed chunk!")
+    return plane.read(token_length, position), position + token_length * 8
+
+
+def read_first_token(plane: BitPlane, offset: int) -> bytes:
+    """Reads the encrypted token of the first chunk of a chunked container.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from.
+        offset (int): The position of the first bit of the container.
+
+    Returns:
+        The token, which can be decrypted to test an authentication key without reading the whole container.
+
+    Raises:
+        ValueError: The container is malformed.
+    """
+    position, maximum_token_length = _read_preamble(plane, offset)
+    token, _ = _read_token(plane, position, maximum_token_length)
+    return token
+
+
+def read_container(plane: BitPlane, offset: int, crypto: Cryptographer, codec: str, compression: int, aead: bool,
+                   output_file: io.IOBase) -> int:
+    """Streams a chunked container from the carrier into the output file.
+
+    Only one chunk of the output file is held in memory at a time, hence the leading chunks are already written to
+    the output file when a later chunk turns out to be invalid. The carrier is not streamed, hence memory is bounded
+    by the size of the carrier rather than by the chunk size.
+
+    Args:
+        plane (BitPlane): The bit plane of the carrier to read from.
+        offset (int): The position of the first bit of the container.
+        crypto (Cryptographer): The decrypter of the chunks.
+        codec (str): The name of the compression codec of the chunks.
+        compression (int): The compression level of the chunks, 0 for no compression.
+        aead (bool): Whether the chunks are binary AEAD tokens instead of Fernet tokens.
+        output_file (io.IOBase): The file to write data to.
+
+    Returns:
+        The number of chunks read.
+
+    Raises:
+        ValueError: The container is malformed, truncated or reordered.
+        InvalidToken: The authentication key is invalid.
+    """
+    position, maximum_token_length = _read_preamble(plane, offset)
+    index = 0
+    while True:
+        token, position = _read_token(plane, position, maximum_token_length)
+        data = crypto.decrypt_aead(token) if aead else crypto.decrypt(token)
+        chunk_index, is_last = chunk_format.unpack(data[:chunk_format.size])
+        if chunk_index != index:
+            raise ValueError("Chunks are reordered!")
+        data = data[chunk_format.size:]
+        output_file.write(decompress(data, codec, compression))
+        index += 1
+        if is_last:
+            return index
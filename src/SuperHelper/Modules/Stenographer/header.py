@@ -0,0 +1,371 @@
+# This module defines the headers of steganography: the text header and the fixed-layout binary header.
+from __future__ import annotations
+
+import re
+import struct
+import zlib
+from typing import Optional, Union
+
+from SuperHelper.Core.Utils import Cryptographer
+from SuperHelper.Modules.Stenographer.compression import codec_ids
+
+__all__ = [
+    "Header",
+    "BinaryHeader",
+    "AnyHeader",
+    "densities",
+    "compression_levels",
+    "kdf_cost_factor",
+    "acceptable_kdf_costs",
+    "KdfCostError",
+    "match_header",
+    "validate_header",
+    "parse_header",
+    "fix",
+]
+
+densities: tuple[int, ...] = (1, 2, 3)
+compression_levels: range = range(10)
+
+kdf_cost_factor: int = 4
+"""Default of how many times the work of the calibrated or default cost a header may ask for."""
+
+
+def acceptable_kdf_costs(factor: int = kdf_cost_factor, base_costs: dict[str, int] = None) -> dict[str, int]:
+    """Calculates the highest costs of the key derivation functions accepted from headers.
+
+    The key derivation function and its cost are read from the header before any key can be checked, hence a crafted
+    header could otherwise make the extraction hang, or exhaust the memory with scrypt.
+
+    Args:
+        factor (int): How many times the work of the base cost is accepted.
+        base_costs (dict[str, int]): The calibrated cost of some key derivation functions. The base cost is the
+            higher of the calibrated and the default cost, so that steganography created with the default cost is
+            accepted on slow machines too.
+
+    Returns:
+        A dictionary of the highest cost of every key derivation function.
+    """
+    base_costs = base_costs or dict()
+    costs = {kdf: max(cost, base_costs.get(kdf, cost)) for kdf, cost in Cryptographer.default_kdf_costs.items()}
+    # The work of PBKDF2 is linear in its cost, that of scrypt is exponential in it
+    costs = {kdf: cost + max(factor, 1).bit_length() - 1 if kdf == "scrypt" else cost * max(factor, 1)
+             for kdf, cost in costs.items()}
+    return {kdf: min(cost, Cryptographer.maximum_kdf_costs[kdf]) for kdf, cost in costs.items()}
+
+
+class KdfCostError(ValueError):
+    """The header asks for a cost of the key derivation function above the accepted ceiling."""
+
+
+class BinaryHeader:
+    """The fixed-layout binary header (version 2) of steganography.
+
+    Layout (big-endian):
+
+    * Magic number (2 bytes), which never starts with a digit, unlike the text header
+    * Version (1 byte)
+    * Flags (1 byte): bit 0 for chunked containers, bit 1 for binary AEAD ciphertext, bit 2 for the key-check value,
+      bit 3 for shards, bit 7 - 4 for the codec
+    * Mode (1 byte): bit 5 - 2 for compression level, bit 1 - 0 for density
+    * Data length (4 bytes), or the number of chunks for chunked containers
+    * Raw salt (16 bytes)
+    * Key-check value (4 bytes), zeroed if absent
+    * Key derivation function (1 byte): 0 for PBKDF2-SHA512, 1 for scrypt
+    * Cost of the key derivation function (4 bytes), see `Cryptographer.make_kdf`
+    * Shard index (2 bytes) and shard count (2 bytes), zeroed if the data is not sharded
+    * Digest of the whole data of the shards (8 bytes), i.e. the truncated SHA-256 of the raw data, zeroed if absent
+    * CRC-32 of all the fields above (4 bytes)
+
+    The layout of version 2 is final as of 1.3.0, the first release to write it. Any change of the layout must bump
+    the version, and keep parsing the headers of the earlier versions.
+    """
+
+    magic: bytes = b"SH"
+    version: int = 2
+    chunked_flag: int = 1 << 0
+    aead_flag: int = 1 << 1
+    key_check_flag: int = 1 << 2
+    sharded_flag: int = 1 << 3
+    codec_shift: int = 4
+
+    digest_length: int = 8
+    fields: struct.Struct = struct.Struct(f">2sBBBI16s{Cryptographer.key_check_length}sBIHH{digest_length}s")
+    checksum: struct.Struct = struct.Struct(">I")
+    header_length: int = fields.size + checksum.size
+
+    maximum_data_length: int = (1 << 32) - 1
+    maximum_shard_count: int = (1 << 16) - 1
+
+    def __init__(self, data_length: int, compression: int, density: int, salt: str, chunked: bool = False,
+                 aead: bool = False, codec: str = "bz2", key_check: bytes = None, kdf: str = "pbkdf2",
+                 kdf_cost: int = None, shard_index: int = 0, shard_count: int = 0, digest: bytes = None) -> None:
+        """Initialises a `BinaryHeader` instance.
+
+        Args:
+            data_length (int): The length of the data, or the number of chunks for chunked containers.
+            compression (int): The compression level.
+            density (int): The density.
+            salt (str): The Base64-encoded string of the raw salt.
+            chunked (bool): Whether the data is a chunked container.
+            aead (bool): Whether the data is binary AEAD ciphertext.
+            codec (str): The name of the compression codec.
+            key_check (bytes): The key-check value of the derived key, see `Cryptographer.get_key_check`.
+            kdf (str): The name of the key derivation function.
+            kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
+            shard_index (int): The index of the shard.
+            shard_count (int): The number of shards, 0 if the data is not sharded.
+            digest (bytes): The digest of the whole data of the shards.
+
+        Raises:
+            ValueError: The data length is too big to be stored, the codec or the key derivation function is unknown,
+                the key-check value or the digest has the wrong length, or the cost or the shard is out of range.
+        """
+        if not 0 <= data_length <= BinaryHeader.maximum_data_length:
+            raise ValueError("Data length is too big to be stored!")
+        if codec not in codec_ids:
+            raise ValueError(f"Unknown codec '{codec}'!")
+        if key_check is not None and len(key_check) != Cryptographer.key_check_length:
+            raise ValueError("Invalid key-check value!")
+        if kdf not in Cryptographer.kdf_algorithms:
+            raise ValueError(f"Unknown key derivation function '{kdf}'!")
+        kdf_cost = Cryptographer.default_kdf_costs[kdf] if kdf_cost is None else kdf_cost
+        if not 1 <= kdf_cost <= Cryptographer.maximum_kdf_costs[kdf]:
+            raise ValueError("Cost of the key derivation function is out of range!")
+        if not 0 <= shard_count <= BinaryHeader.maximum_shard_count or \
+                not 0 <= shard_index < max(shard_count, 1):
+            raise ValueError("Shard is out of range!")
+        if digest is not None and len(digest) != BinaryHeader.digest_length:
+            raise ValueError("Invalid digest!")
+        self.data_length: int = data_length
+        self.compression: int = compression
+        self.density: int = density
+        self.salt: str = salt
+        self.chunked: bool = chunked
+        self.aead: bool = aead
+        self.codec: str = codec
+        self.key_check: bytes = key_check
+        self.kdf: str = kdf
+        self.kdf_cost: int = kdf_cost
+        self.shard_index: int = shard_index
+        self.shard_count: int = shard_count
+        self.digest: bytes = digest
+
+    def __repr__(self) -> str:
+        return f"BinaryHeader(data_length={self.data_length}, compression={self.compression}, " \
+               f"density={self.density}, chunked={self.chunked}, aead={self.aead}, codec={self.codec})"
+
+    def to_bytes(self) -> bytes:
+        """Serialises the header.
+
+        Returns:
+            The header, in bytes.
+        """
+        flags = (BinaryHeader.chunked_flag if self.chunked else 0) | (BinaryHeader.aead_flag if self.aead else 0)
+        flags |= BinaryHeader.key_check_flag if self.key_check is not None else 0
+        flags |= BinaryHeader.sharded_flag if self.shard_count else 0
+        flags |= codec_ids[self.codec] << BinaryHeader.codec_shift
+        mode = (self.compression << 2) | self.density
+        key_check = self.key_check if self.key_check is not None else bytes(Cryptographer.key_check_length)
+        digest = self.digest if self.digest is not None else bytes(BinaryHeader.digest_length)
+        fields = BinaryHeader.fields.pack(BinaryHeader.magic, BinaryHeader.version, flags, mode, self.data_length,
+                                          Cryptographer.decode_salt(self.salt), key_check,
+                                          Cryptographer.kdf_algorithms.index(self.kdf), self.kdf_cost,
+                                          self.shard_index, self.shard_count, digest)
+        return fields + BinaryHeader.checksum.pack(zlib.crc32(fields))
+
+    @staticmethod
+    def from_bytes(b: bytes, maximum_kdf_costs: dict[str, int] = None) -> BinaryHeader:
+        """Parses the header.
+
+        Args:
+            b (bytes): The serialised header, trailing bytes are ignored.
+            maximum_kdf_costs (dict[str, int]): The highest cost of every key derivation function, above which the
+                header is rejected, defaults to `acceptable_kdf_costs()`.
+
+        Returns:
+            A `BinaryHeader` instance.
+
+        Raises:
+            KdfCostError: The header asks for a cost of the key derivation function above the highest.
+            ValueError: The header is invalid.
+        """
+        if len(b) < BinaryHeader.header_length or b[:2] != BinaryHeader.magic:
+            raise ValueError("Invalid header!")
+        fields = b[:BinaryHeader.fields.size]
+        (checksum,) = BinaryHeader.checksum.unpack_from(b, BinaryHeader.fields.size)
+        if zlib.crc32(fields) != checksum:
+            raise ValueError("Invalid header!")
+        maximum_kdf_costs = acceptable_kdf_costs() if maximum_kdf_costs is None else maximum_kdf_costs
+        _, version, flags, mode, data_length, salt, key_check, kdf, kdf_cost, shard_index, shard_count, digest = \
+            BinaryHeader.fields.unpack(fields)
+        if version != BinaryHeader.version:
+            raise ValueError("Unsupported header version!")
+        codec = {identifier: name for name, identifier in codec_ids.items()}.get(flags >> BinaryHeader.codec_shift)
+        if codec is None:
+            raise ValueError("Unknown codec!")
+        if kdf >= len(Cryptographer.kdf_algorithms):
+            raise ValueError("Unknown key derivation function!")
+        if kdf_cost > maximum_kdf_costs[Cryptographer.kdf_algorithms[kdf]]:
+            raise KdfCostError("Cost of the key derivation function is above the accepted ceiling!")
+        return BinaryHeader(data_length, mode >> 2, mode & 0b11, Cryptographer.encode_salt(salt),
+                            bool(flags & BinaryHeader.chunked_flag), bool(flags & BinaryHeader.aead_flag), codec,
+                            key_check if flags & BinaryHeader.key_check_flag else None,
+                            Cryptographer.kdf_algorithms[kdf], kdf_cost, shard_index,
+                            shard_count if flags & BinaryHeader.sharded_flag else 0,
+                            digest if flags & BinaryHeader.sharded_flag else None)
+
+
+class Header:
+    """Provides for the preparation of the creation of steganography."""
+
+    # Padding character, used when header is too short
+    # after writing all the required metadata
+    padding_character: str = "-"
+
+    # Separator is used to make regex easier
+    separator: str = "?"
+
+    # Various types of length for the header
+    maximum_data_length: int = 8
+    maximum_flag_length: int = 3
+    salt_length: int = 24
+    separator_length: int = 2
+    header_length: int = maximum_data_length + maximum_flag_length + salt_length + separator_length
+
+    # Regex pattern of the header
+    # data_length?flag?salt
+    pattern: str = r"(\d{1,8})\?(\d{1,3})\?"
+    hash_pattern: str = r"((?:[A-Za-z0-9+/]{4})+(?:[A-Za-z0-9+/]{2}==" + \
+                        r"|[A-Za-z0-9+/]{3}=)?)"
+    padding_pattern: str = r"-*"
+    pattern: re.Pattern = re.compile(f"^{pattern + hash_pattern + padding_pattern}$")
+
+    # Flag bits of the payload formats
+    chunked_flag: int = 1 << 6
+    aead_flag: int = 1 << 7
+
+    # The text header only supports bzip2 compression
+    codec: str = "bz2"
+
+    # The text header has no room for the key-check value
+    key_check: Optional[bytes] = None
+
+    # The text header only supports the original key derivation
+    kdf: str = Cryptographer.default_kdf
+    kdf_cost: int = Cryptographer.default_kdf_costs[Cryptographer.default_kdf]
+
+    # The text header cannot record shards
+    shard_index: int = 0
+    shard_count: int = 0
+    digest: Optional[bytes] = None
+
+    def __str__(self) -> str:
+        """Returns the header."""
+        return self.header
+
+    def __repr__(self) -> str:
+        """Same as __str__, returns the header."""
+        return str(self)
+
+    def __init__(self, data_length: int, compression: int, density: int,
+                 salt: str, chunked: bool = False, aead: bool = False) -> None:
+        self.header: str = str()
+        self.data_length: int = data_length
+        self.compression: int = compression
+        self.density: int = density
+        self.salt: str = salt
+        self.chunked: bool = chunked
+        self.aead: bool = aead
+
+        self.generate()
+
+    def generate(self) -> None:
+        """
+        Generates a header created from input_file given during
+        Header initialisation.
+
+        There is no need to call this method, unless any metadata has been
+        modified after initialisation.
+        """
+        # Create a flag from compression level and density level.
+        # Bit 7: Binary AEAD ciphertext instead of Fernet token
+        # Bit 6: Chunked container, data length is the number of chunks
+        # Bit 5 - 2: Compression level (0 (no compression) - 9)
+        # Bit 1 - 0: Density level (1 - 3)
+        flag = (self.compression << 2) + self.density
+        if self.chunked:
+            flag += Header.chunked_flag
+        if self.aead:
+            flag += Header.aead_flag
+
+        result_header = Header.separator.join(
+            (str(self.data_length), str(flag), self.salt))
+
+        result_header += Header.padding_character * (Header.header_length - len(result_header))
+
+        assert Header.pattern.match(result_header)
+
+        # Assign as a class attribute
+        self.header = result_header
+
+    def to_bytes(self) -> bytes:
+        """Returns the header, in bytes."""
+        return bytes(self.header, "utf-8")
+
+
+# Either the text header or the binary header (version 2)
+AnyHeader = Union[Header, BinaryHeader]
+
+
+def match_header(b: bytes) -> Optional[re.Match]:
+    # A header is pure ASCII and starts with a digit, which rules out most
+    # candidates before the regex is even run
+    if len(b) != Header.header_length or not b[:1].isdigit() or not b.isascii():
+        return None
+    return Header.pattern.match(str(b, "ascii"))
+
+
+def validate_header(b: bytes) -> bool:
+    return match_header(b) is not None
+
+
+def fix(data: bytes, is_encrypt: bool = True) -> bytes:
+    if is_encrypt:
+        return data + b"++"
+    else:
+        return data[:-2]
+
+
+def parse_header(b: bytes, density: int = None, maximum_kdf_costs: dict[str, int] = None) -> AnyHeader:
+    """Parses either header, which are told apart by their leading bytes.
+
+    The binary header starts with its magic number, the text header with a digit.
+
+    Args:
+        b (bytes): The leading bytes of the steganography, trailing bytes are ignored.
+        density (int): The density the bytes were read at, which the binary header must record.
+        maximum_kdf_costs (dict[str, int]): The highest cost of every key derivation function, see
+            `BinaryHeader.from_bytes`.
+
+    Returns:
+        A `Header` or a `BinaryHeader` instance.
+
+    Raises:
+        KdfCostError: The binary header asks for a cost of the key derivation function above the highest.
+        ValueError: The header is invalid.
+    """
+    if b[:len(BinaryHeader.magic)] == BinaryHeader.magic:
+        header = BinaryHeader.from_bytes(b, maximum_kdf_costs)
+        if density is not None and header.density != density:
+            raise ValueError("Invalid header!")
+        return header
+    header_match = match_header(b[:Header.header_length])
+    if header_match is None:
+        raise ValueError("Invalid header!")
+    flag = int(header_match[2])
+    hdr_density, hdr_compression = flag & 0b11, (flag >> 2) & 0b1111
+    if hdr_density not in densities or hdr_compression not in compression_levels:
+        raise ValueError("Invalid header!")
+    return Header(int(header_match[1]), hdr_compression, hdr_density, header_match[3],
+                  bool(flag & Header.chunked_flag), bool(flag & Header.aead_flag))
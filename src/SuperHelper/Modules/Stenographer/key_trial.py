@@ -0,0 +1,113 @@
+# This module defines the key trial, which tests many authentication keys against the same steganography.
+from __future__ import annotations
+
+import concurrent.futures
+import os
+from typing import Optional
+
+from cryptography.fernet import InvalidToken
+
+from SuperHelper.Core.Utils import Cryptographer
+
+__all__ = [
+    "read_keys",
+    "try_keys",
+    "find_key",
+]
+
+# The arguments of `try_keys` shared by all the tasks of a worker process, set once by `_init_worker`
+_worker_args: tuple = ()
+
+
+def read_keys(keys_file: os.PathLike) -> list[str]:
+    """Reads the candidate keys of a keys file, one key per line.
+
+    Empty lines and duplicates are skipped, and the line endings are stripped. Any other whitespace is kept.
+
+    Args:
+        keys_file (os.PathLike): The path to the keys file.
+
+    Returns:
+        A list of keys, in the order of the file.
+    """
+    with open(keys_file, encoding="utf-8") as fp:
+        keys = (line.rstrip("\r\n") for line in fp)
+        return list(dict.fromkeys(key for key in keys if key))
+
+
+def try_keys(keys: list[str], salt: str, probe: Optional[bytes], key_check: Optional[bytes], aead: bool,
+             kdf: str = "pbkdf2", kdf_cost: int = None) -> Optional[str]:
+    """Tests keys, one after another.
+
+    Every test derives the key, then checks it against the key-check value, or decrypts the probe if there
+    is no key-check value.
+
+    Args:
+        keys (list[str]): The keys to test.
+        salt (str): The Base64-encoded string of the raw salt.
+        probe (Optional[bytes]): The token to decrypt, used without key-check value.
+        key_check (Optional[bytes]): The key-check value of the header.
+        aead (bool): Whether the probe is a binary AEAD token instead of a Fernet token.
+        kdf (str): The name of the key derivation function.
+        kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
+
+    Returns:
+        The first right key, or None if all the keys are wrong.
+    """
+    for key in keys:
+        crypto = Cryptographer.make_decrypter(salt, key, kdf, kdf_cost)
+        if key_check is not None:
+            if crypto.verify_key_check(key_check):
+                return key
+            continue
+        try:
+            crypto.decrypt_aead(probe) if aead else crypto.decrypt(probe)
+            return key
+        except InvalidToken:
+            continue
+    return None
+
+
+def _init_worker(*args) -> None:
+    # Sends the probe to a worker once, instead of once per task
+    global _worker_args
+    _worker_args = args
+
+
+def _try_keys_in_worker(keys: list[str]) -> Optional[str]:
+    return try_keys(keys, *_worker_args)
+
+
+def find_key(keys: list[str], salt: str, probe: Optional[bytes], key_check: Optional[bytes], aead: bool,
+             kdf: str = "pbkdf2", kdf_cost: int = None, max_workers: int = 0, batch_size: int = 8) -> Optional[str]:
+    """Finds the right key among many keys, deriving them in a process pool.
+
+    The keys are tested in batches, and the pending batches are cancelled at the first right key.
+
+    Args:
+        keys (list[str]): The keys to test.
+        salt (str): The Base64-encoded string of the raw salt.
+        probe (Optional[bytes]): The token to decrypt, used without key-check value.
+        key_check (Optional[bytes]): The key-check value of the header.
+        aead (bool): Whether the probe is a binary AEAD token instead of a Fernet token.
+        kdf (str): The name of the key derivation function.
+        kdf_cost (int): The cost of the key derivation function, defaults to its default cost.
+        max_workers (int): The number of worker processes, 0 for the number of CPUs.
+        batch_size (int): The number of keys tested per task.
+
+    Returns:
+        The right key, or None if all the keys are wrong. If several keys are right, any of them may be returned.
+    """
+    batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(batches))
+    if max_workers <= 1:
+        return try_keys(keys, salt, probe, key_check, aead, kdf, kdf_cost)
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                initargs=(salt, probe, key_check, aead, kdf, kdf_cost)) as executor:
+        futures = [executor.submit(_try_keys_in_worker, batch) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            key = future.result()
+            if key is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                return key
+    return None
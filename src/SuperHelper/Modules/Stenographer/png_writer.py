@@ -0,0 +1,255 @@
+# This module defines the streaming PNG writer, which deflates independent segments of the image data in parallel.
+from __future__ import annotations
+
+import collections
+import io
+import os
+import struct
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+__all__ = [
+    "PNGWriter",
+    "png_presets",
+    "filter_types",
+    "filter_rows",
+    "save_png",
+]
+
+png_signature: bytes = b"\x89PNG\r\n\x1a\n"
+# Colour types of the PNG format, for 8-bit channels
+colour_types: dict[str, int] = {"RGB": 2, "RGBA": 6}
+filter_types: tuple[str, ...] = ("none", "sub", "up", "average", "paeth", "adaptive")
+"""Names of the row filters, 'adaptive' picks the best of the others for every row."""
+png_presets: dict[str, tuple[int, str]] = {
+    "fast": (1, "sub"),
+    "default": (6, "adaptive"),
+    "small": (9, "adaptive"),
+}
+"""Compression level and row filter of every preset."""
+
+# Size of the window of deflate, which is the dictionary a segment is primed with
+window_size: int = 1 << 15
+# Header of the zlib stream, by compression level (the check bits make the header a multiple of 31)
+zlib_headers: dict[int, bytes] = {0: b"\x78\x01", 1: b"\x78\x01", 2: b"\x78\x5e", 3: b"\x78\x5e", 4: b"\x78\x5e",
+                                  5: b"\x78\x5e", 6: b"\x78\x9c", 7: b"\x78\xda", 8: b"\x78\xda", 9: b"\x78\xda"}
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _deflate(data: bytes, dictionary: bytes, level: int, final: bool) -> bytes:
+    # Deflates a segment into raw deflate blocks, which end on a byte boundary so that segments can be concatenated
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                  **(dict(zdict=dictionary) if dictionary else dict()))
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def filter_rows(rows: np.ndarray, previous: np.ndarray, bpp: int, filter_type: str) -> np.ndarray:
+    """Filters rows of an image, see the PNG specification.
+
+    Args:
+        rows (np.ndarray): The `uint8` rows of shape (height, row length).
+        previous (np.ndarray): The `uint8` row above the first row, zeroed for the first row of the image.
+        bpp (int): The number of bytes per pixel.
+        filter_type (str): The name of the row filter, see `filter_types`.
+
+    Returns:
+        The filtered rows of shape (height, row length + 1), each led by its filter type.
+    """
+    x = rows.astype(np.int16)
+    up = np.concatenate((previous[None], rows[:-1])).astype(np.int16)
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up_left = np.zeros_like(x)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    def paeth() -> np.ndarray:
+        pa, pb, pc = np.abs(up - up_left), np.abs(left - up_left), np.abs(left + up - 2 * up_left)
+        return x - np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+
+    filters = {
+        "none": lambda: x,
+        "sub": lambda: x - left,
+        "up": lambda: x - up,
+        "average": lambda: x - ((left + up) >> 1),
+        "paeth": paeth,
+    }
+    if filter_type == "adaptive":
+        # Pick the filter of least sum of absolute values, taken as signed bytes, for every row
+        candidates = np.stack([filters[name]().astype(np.uint8) for name in filter_types[:-1]])
+        scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+        kinds = scores.argmin(axis=0).astype(np.uint8)
+        filtered = candidates[kinds, np.arange(len(rows))]
+    else:
+        kinds = np.full(len(rows), filter_types.index(filter_type), dtype=np.uint8)
+        filtered = filters[filter_type]().astype(np.uint8)
+    return np.concatenate((kinds[:, None], filtered), axis=1)
+
+
+class PNGWriter:
+    """A streaming writer of 8-bit RGB and RGBA PNG images.
+
+    Rows are filtered as they are written and buffered into segments, which are deflated in parallel threads. Every
+    segment is primed with the last window of the segment before it, and all but the last end with a sync flush, hence
+    the segments concatenate into a single zlib stream. Only a bounded number of segments are held at once.
+    """
+
+    def __init__(self, fp: io.IOBase, size: tuple[int, int], mode: str, level: int = 6,
+                 filter_type: str = "adaptive", workers: int = None, segment_size: int = 1 << 20,
+                 icc_profile: Optional[bytes] = None, transparency: Optional[tuple[int, ...]] = None) -> None:
+        """Initialises a `PNGWriter` instance, writing the leading chunks of the image.
+
+        Args:
+            fp (io.IOBase): The file to write to.
+            size (tuple[int, int]): The width and the height of the image.
+            mode (str): The mode of the image, 'RGB' or 'RGBA'.
+            level (int): The compression level, from 0 (no compression) to 9.
+            filter_type (str): The name of the row filter, see `filter_types`.
+            workers (int): The number of threads deflating the segments, defaults to the number of CPUs.
+            segment_size (int): The number of bytes of filtered rows per segment.
+            icc_profile (Optional[bytes]): The ICC profile of the image.
+            transparency (Optional[tuple[int, ...]]): The transparent colour of RGB images.
+
+        Raises:
+            ValueError: The mode, the compression level or the row filter is not supported.
+        """
+        if mode not in colour_types:
+            raise ValueError(f"Unsupported mode '{mode}'!")
+        if level not in zlib_headers:
+            raise ValueError("Compression level must be from 0 to 9!")
+        if filter_type not in filter_types:
+            raise ValueError(f"Unknown filter '{filter_type}'!")
+        self.fp: io.IOBase = fp
+        self.width, self.height = size
+        self.mode: str = mode
+        self.level: int = level
+        self.filter_type: str = filter_type
+        self.bpp: int = len(mode)
+        self.segment_size: int = max(segment_size, 1)
+        self.workers: int = workers or os.cpu_count() or 1
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(self.workers)
+        self._pending: collections.deque[Future] = collections.deque()
+        self._buffer: list[bytes] = []
+        self._buffered: int = 0
+        self._dictionary: bytes = b""
+        self._adler: int = 1
+        self._started: bool = False
+        self._previous: np.ndarray = np.zeros(self.width * self.bpp, dtype=np.uint8)
+        self.rows_written: int = 0
+        """Number of rows written."""
+
+        fp.write(png_signature)
+        fp.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, colour_types[mode], 0, 0, 0)))
+        if icc_profile:
+            fp.write(_chunk(b"iCCP", b"ICC Profile\x00\x00" + zlib.compress(icc_profile)))
+        if transparency is not None and mode == "RGB":
+            fp.write(_chunk(b"tRNS", struct.pack(">HHH", *transparency)))
+
+    def __enter__(self) -> PNGWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(cancel_futures=True)
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Writes the next rows of the image.
+
+        Args:
+            rows (np.ndarray): The `uint8` pixel array of shape (height, width, bands).
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: The rows have the wrong shape, or exceed the height of the image.
+        """
+        if rows.shape[1:] != (self.width, self.bpp):
+            raise ValueError("Rows do not match the image!")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("Rows exceed the height of the image!")
+        if len(rows) == 0:
+            return
+        flat = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), -1)
+        filtered = filter_rows(flat, self._previous, self.bpp, self.filter_type).tobytes()
+        self._previous = flat[-1].copy()
+        self.rows_written += len(rows)
+        self._adler = zlib.adler32(filtered, self._adler)
+        self._buffer.append(filtered)
+        self._buffered += len(filtered)
+        if self._buffered >= self.segment_size:
+            self._submit(False)
+
+    def _submit(self, final: bool) -> None:
+        data = b"".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        self._pending.append(self._executor.submit(_deflate, data, self._dictionary, self.level, final))
+        self._dictionary = (self._dictionary + data)[-window_size:]
+        # Bound the memory by waiting for the oldest segments
+        while len(self._pending) > 2 * self.workers or (final and self._pending):
+            self._write_segment(self._pending.popleft().result(), final and not self._pending)
+
+    def _write_segment(self, data: bytes, final: bool) -> None:
+        if not self._started:
+            data = zlib_headers[self.level] + data
+            self._started = True
+        if final:
+            data += struct.pack(">I", self._adler)
+        if data:
+            self.fp.write(_chunk(b"IDAT", data))
+
+    def close(self) -> None:
+        """Writes the remaining rows and the trailing chunk of the image.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: Fewer rows than the height of the image were written.
+        """
+        try:
+            if self.rows_written != self.height:
+                raise ValueError("Rows fall short of the height of the image!")
+            self._submit(True)
+            self.fp.write(_chunk(b"IEND", b""))
+        finally:
+            self._executor.shutdown()
+
+
+def save_png(image: Image.Image, fp: io.IOBase, preset: str = "default", workers: int = None,
+             block_rows: int = 256) -> None:
+    """Saves an image as PNG with the streaming writer, or with Pillow for modes it does not support.
+
+    Args:
+        image (Image.Image): The image to save.
+        fp (io.IOBase): The file to write to.
+        preset (str): The name of the preset, see `png_presets`.
+        workers (int): The number of threads deflating the image data, defaults to the number of CPUs.
+        block_rows (int): The number of rows copied out of the image at once.
+
+    Returns:
+        None
+
+    Raises:
+        KeyError: The preset is unknown.
+        OSError: The image cannot be written.
+    """
+    level, filter_type = png_presets[preset]
+    if image.mode not in colour_types:
+        image.save(fp, "png", compress_level=level)
+        return
+    transparency = image.info.get("transparency")
+    with PNGWriter(fp, image.size, image.mode, level, filter_type, workers,
+                   icc_profile=image.info.get("icc_profile"),
+                   transparency=transparency if isinstance(transparency, tuple) else None) as writer:
+        width, height = image.size
+        for y in range(0, height, block_rows):
+            writer.write_rows(np.asarray(image.crop((0, y, width, min(y + block_rows, height)))))
@@ -0,0 +1,250 @@
+# This module defines the carrier pool, an index of cover images from which a carrier is picked for a payload.
+from __future__ import annotations
+
+import io
+import json
+import math
+import os
+import pathlib
+from typing import Optional
+
+from PIL import Image
+
+from SuperHelper.Modules.Stenographer.archive import count_format, entry_format, name_format
+from SuperHelper.Modules.Stenographer.archive import preamble_format as archive_preamble
+from SuperHelper.Modules.Stenographer.compression import available_codecs, choose_codec, compress, sample_file
+from SuperHelper.Modules.Stenographer.container import chunk_format, frame_format
+from SuperHelper.Modules.Stenographer.container import preamble_format as container_preamble
+from SuperHelper.Modules.Stenographer.shard import token_length
+
+__all__ = [
+    "PoolEntry",
+    "index_file_name",
+    "load_index",
+    "save_index",
+    "update_index",
+    "choose_carrier",
+    "predict_length",
+]
+
+index_file_name: str = ".steg-pool.json"
+"""Name of the index file, in the directory of the pool."""
+index_version: int = 1
+
+# Modes of the images which can carry steganography
+usable_modes: tuple[str, ...] = ("RGB", "RGBA")
+
+# Preamble of containers and archives
+container_overhead: int = container_preamble.size
+archive_overhead: int = archive_preamble.size
+# Length of the token of every chunk, outside of the token, and its index and last chunk marker, inside the token
+frame_overhead: int = frame_format.size
+chunk_overhead: int = chunk_format.size
+# Number of members of the table of contents, and the entry of every member, without its name
+toc_overhead: int = count_format.size
+toc_entry_overhead: int = name_format.size + entry_format.size
+
+
+class PoolEntry:
+    """A cover image of a pool."""
+
+    def __init__(self, name: str, width: int, height: int, mode: str, file_size: int, mtime_ns: int) -> None:
+        """Initialises a `PoolEntry` instance.
+
+        Args:
+            name (str): The path to the image, relative to the directory of the pool.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            mode (str): The mode of the image.
+            file_size (int): The size of the file, to tell whether it changed since it was indexed.
+            mtime_ns (int): The modification time of the file, to tell whether it changed since it was indexed.
+        """
+        self.name: str = name
+        self.width: int = width
+        self.height: int = height
+        self.mode: str = mode
+        self.file_size: int = file_size
+        self.mtime_ns: int = mtime_ns
+
+    def __repr__(self) -> str:
+        return f"PoolEntry(name={self.name!r}, width={self.width}, height={self.height}, mode={self.mode!r})"
+
+    def capacity(self, density: int) -> int:
+        """Calculates the number of bytes the image can carry, header included.
+
+        Args:
+            density (int): The density.
+
+        Returns:
+            The capacity, which is 0 for images of modes which cannot carry steganography.
+        """
+        if self.mode not in usable_modes:
+            return 0
+        return self.width * self.height * 3 * density // 8
+
+    def to_dict(self) -> dict[str, ...]:
+        """Serialises the entry.
+
+        Returns:
+            The entry, as a dictionary.
+        """
+        return dict(name=self.name, width=self.width, height=self.height, mode=self.mode, file_size=self.file_size,
+                    mtime_ns=self.mtime_ns)
+
+    @staticmethod
+    def from_dict(d: dict[str, ...]) -> PoolEntry:
+        """Parses the entry.
+
+        Args:
+            d (dict[str, ...]): The serialised entry.
+
+        Returns:
+            A `PoolEntry` instance.
+        """
+        return PoolEntry(d["name"], d["width"], d["height"], d["mode"], d["file_size"], d["mtime_ns"])
+
+
+def load_index(directory: os.PathLike) -> list[PoolEntry]:
+    """Loads the index of a pool.
+
+    Args:
+        directory (os.PathLike): The directory of the pool.
+
+    Returns:
+        A list of `PoolEntry` instances, which is empty if there is no valid index.
+    """
+    try:
+        with open(pathlib.Path(directory) / index_file_name, encoding="utf-8") as fp:
+            index = json.load(fp)
+        if index.get("version") != index_version:
+            return []
+        return [PoolEntry.from_dict(entry) for entry in index["images"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+def save_index(directory: os.PathLike, entries: list[PoolEntry]) -> None:
+    """Saves the index of a pool, replacing the previous index at once.
+
+    Args:
+        directory (os.PathLike): The directory of the pool.
+        entries (list[PoolEntry]): The entries of the index.
+
+    Returns:
+        None
+
+    Raises:
+        OSError: The index cannot be written.
+    """
+    path = pathlib.Path(directory) / index_file_name
+    temp_path = path.with_name(f"{index_file_name}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as fp:
+        json.dump(dict(version=index_version, images=[entry.to_dict() for entry in entries]), fp, indent=1)
+    os.replace(temp_path, path)
+
+
+def update_index(directory: os.PathLike, suffixes: tuple[str, ...] = (".png",)) -> tuple[list[PoolEntry], bool]:
+    """Brings the index of a pool up to date with its images.
+
+    Images which are unchanged since they were indexed are not opened again. Others are opened to read the
+    dimensions in their headers, without decoding their pixels. Files which are not images are left out.
+
+    Args:
+        directory (os.PathLike): The directory of the pool, which is searched recursively.
+        suffixes (tuple[str, ...]): The suffixes of the images, case-insensitive.
+
+    Returns:
+        A 2-tuple of the list of `PoolEntry` instances, ordered by name, and whether the index changed.
+    """
+    directory = pathlib.Path(directory)
+    indexed = {entry.name: entry for entry in load_index(directory)}
+    entries = []
+    changed = False
+    for path in sorted(directory.rglob("*")):
+        if path.suffix.lower() not in suffixes or not path.is_file():
+            continue
+        name = path.relative_to(directory).as_posix()
+        stat = path.stat()
+        entry = indexed.pop(name, None)
+        if entry is None or (entry.file_size, entry.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            try:
+                with Image.open(path) as image:
+                    new_entry = PoolEntry(name, image.size[0], image.size[1], image.mode, stat.st_size,
+                                          stat.st_mtime_ns)
+            except (OSError, ValueError):
+                changed = changed or entry is not None
+                continue
+            entry, changed = new_entry, True
+        entries.append(entry)
+    # Images which were removed since they were indexed
+    changed = changed or bool(indexed)
+    return entries, changed
+
+
+def choose_carrier(entries: list[PoolEntry], length: int, density: int) -> Optional[PoolEntry]:
+    """Chooses the smallest carrier of a pool that fits the data.
+
+    Args:
+        entries (list[PoolEntry]): The entries of the pool.
+        length (int): The number of bytes to embed, header included.
+        density (int): The density.
+
+    Returns:
+        The `PoolEntry` instance of the carrier with the least capacity that fits, or None if none fits.
+    """
+    fitting = [entry for entry in entries if entry.capacity(density) >= length]
+    if not fitting:
+        return None
+    return min(fitting, key=lambda entry: (entry.capacity(density), entry.name))
+
+
+def _predict_compressed_length(input_file: io.IOBase, codec: str, compression: int, margin: float) -> int:
+    # Compresses a sample of the file, which is exact if the sample is the whole file
+    start = input_file.tell()
+    length = input_file.seek(0, io.SEEK_END) - start
+    input_file.seek(start)
+    sample = sample_file(input_file)
+    if codec == "auto":
+        codec, compression = choose_codec(sample, compression, available_codecs())
+    if compression == 0 or not sample:
+        return length
+    compressed_length = len(compress(sample, codec, compression))
+    if len(sample) == length:
+        return compressed_length
+    return math.ceil(compressed_length / len(sample) * length * (1 + margin))
+
+
+def predict_length(input_files: list[io.IOBase], codec: str, compression: int, aead: bool, chunk_size: int,
+                   header_length: int, margin: float = 0.05) -> int:
+    """Predicts the number of bytes that the steganography of input files takes, header included.
+
+    The compressed size is predicted from a sample of every file, see `sample_file`, and is exact for files no
+    bigger than the sample.
+
+    Args:
+        input_files (list[io.IOBase]): The seekable input files, embedded as an archive if there are many of them.
+        codec (str): The name of the compression codec, or 'auto'.
+        compression (int): The compression level, 0 for no compression.
+        aead (bool): Whether the data is encrypted into binary AEAD tokens instead of Fernet tokens.
+        chunk_size (int): The number of bytes per chunk of a chunked container, 0 for a single token.
+        header_length (int): The length of the header.
+        margin (float): The fraction added to the compressed size predicted from a sample.
+
+    Returns:
+        The predicted number of bytes.
+    """
+    lengths = [_predict_compressed_length(input_file, codec, compression, margin) for input_file in input_files]
+    if len(input_files) > 1:
+        names = [len(pathlib.Path(getattr(input_file, "name", "member")).name.encode("utf-8"))
+                 for input_file in input_files]
+        toc_length = toc_overhead + sum(name_length + toc_entry_overhead for name_length in names)
+        return header_length + archive_overhead + token_length(toc_length, aead) + \
+            sum(token_length(length, aead) for length in lengths)
+    if chunk_size > 0:
+        input_file = input_files[0]
+        start = input_file.tell()
+        no_of_chunk = max(math.ceil((input_file.seek(0, io.SEEK_END) - start) / chunk_size), 1)
+        input_file.seek(start)
+        chunk_length = math.ceil(lengths[0] / no_of_chunk) + chunk_overhead
+        return header_length + container_overhead + no_of_chunk * (frame_overhead + token_length(chunk_length, aead))
+    return header_length + token_length(lengths[0], aead)
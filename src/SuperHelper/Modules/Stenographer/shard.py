@@ -0,0 +1,113 @@
+# This module defines the sharding, which splits a payload across many carrier images.
+from __future__ import annotations
+
+import hashlib
+import math
+
+__all__ = [
+    "payload_digest",
+    "token_length",
+    "shard_capacity",
+    "split_payload",
+]
+
+# Version (1 byte), timestamp (8 bytes), IV (16 bytes) and HMAC (32 bytes) of a Fernet token, before Base64 encoding
+fernet_overhead: int = 57
+# Padding appended to Fernet tokens by `fix`
+fernet_padding: int = 2
+# Nonce (12 bytes) and tag (16 bytes) of a binary AEAD token
+aead_overhead: int = 28
+
+
+def payload_digest(data: bytes, length: int = 8) -> bytes:
+    """Computes the digest of the whole payload of the shards, recorded in every header.
+
+    Args:
+        data (bytes): The raw payload, before compression.
+        length (int): The length of the digest, i.e. the truncated SHA-256.
+
+    Returns:
+        The digest.
+    """
+    return hashlib.sha256(data).digest()[:length]
+
+
+def token_length(data_length: int, aead: bool) -> int:
+    """Computes the number of bytes embedded for the encrypted data.
+
+    Args:
+        data_length (int): The length of the data before encryption.
+        aead (bool): Whether the data is encrypted into a binary AEAD token instead of a Fernet token.
+
+    Returns:
+        The length of the token, including the padding of Fernet tokens.
+    """
+    if aead:
+        return data_length + aead_overhead
+    # AES-CBC always pads to the next whole block
+    ciphertext_length = 16 * (data_length // 16 + 1)
+    return 4 * math.ceil((fernet_overhead + ciphertext_length) / 3) + fernet_padding
+
+
+def shard_capacity(image_size: tuple[int, int], density: int, header_length: int, aead: bool) -> int:
+    """Computes the number of bytes of data that a carrier image can hold, before encryption.
+
+    Args:
+        image_size (tuple[int, int]): The width and the height of the image.
+        density (int): The density.
+        header_length (int): The length of the header.
+        aead (bool): Whether the data is encrypted into a binary AEAD token instead of a Fernet token.
+
+    Returns:
+        The capacity, or -1 if the image cannot even hold an empty shard.
+    """
+    width, height = image_size
+    available = width * height * 3 * density // 8 - header_length
+    if token_length(0, aead) > available:
+        return -1
+    # The token length grows with the data length, hence search for the longest data which fits
+    low, high = 0, available
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_length(middle, aead) <= available:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def split_payload(data: bytes, capacities: list[int]) -> list[bytes]:
+    """Splits data into shards in proportion to the capacities of the carriers.
+
+    Every carrier is filled to about the same fraction of its capacity, so that the shards take about the same time
+    to embed and none of the carriers stands out by its density of data.
+
+    Args:
+        data (bytes): The data to split.
+        capacities (list[int]): The capacities of the carriers, see `shard_capacity`.
+
+    Returns:
+        A list of shards, one per carrier, which are empty for carriers without capacity.
+
+    Raises:
+        ValueError: The data is too big to be stored in all the carriers.
+    """
+    capacities = [max(capacity, 0) for capacity in capacities]
+    total_capacity = sum(capacities)
+    if len(data) > total_capacity:
+        raise ValueError("Data is too big to be stored!")
+    lengths = [len(data) * capacity // max(total_capacity, 1) for capacity in capacities]
+    # Hand the remaining bytes to the carriers with capacity left, one byte each
+    remainder = len(data) - sum(lengths)
+    for i, capacity in enumerate(capacities):
+        if remainder == 0:
+            break
+        if lengths[i] < capacity:
+            lengths[i] += 1
+            remainder -= 1
+    shards = []
+    position = 0
+    for length in lengths:
+        shards.append(data[position:position + length])
+        position += length
+    return shards
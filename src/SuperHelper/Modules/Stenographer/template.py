@@ -0,0 +1,130 @@
+# This module defines the carrier template, a cover image decoded once and reused for many payloads.
+from __future__ import annotations
+
+import contextlib
+import os
+from multiprocessing import shared_memory
+from typing import Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+__all__ = [
+    "CarrierTemplate",
+    "shared_templates",
+]
+
+
+class CarrierTemplate:
+    """A cover image decoded once, whose pristine pixels are the starting point of every embedding.
+
+    The pixels are read-only. Every embedding starts from `new_image`, which copies them (or maps them copy-on-write
+    for RGBA images), hence only the pixels of the payload and the PNG encoding remain to be done per embedding.
+    """
+
+    def __init__(self, pixels: np.ndarray, shm: Optional[shared_memory.SharedMemory] = None) -> None:
+        """Initialises a `CarrierTemplate` instance.
+
+        Args:
+            pixels (np.ndarray): The `uint8` pixel array of shape (height, width, bands), which must not be modified.
+            shm (Optional[shared_memory.SharedMemory]): The shared memory block holding the pixels, if any.
+        """
+        self.pixels: Optional[np.ndarray] = pixels
+        self.pixels.flags.writeable = False
+        self.shm: Optional[shared_memory.SharedMemory] = shm
+
+    def __repr__(self) -> str:
+        return f"CarrierTemplate(size={self.size}, shared={self.shm is not None})"
+
+    def __reduce__(self) -> tuple:
+        # Templates in shared memory are sent to worker processes by name, without their pixels
+        if self.shm is not None:
+            return CarrierTemplate._attach, (self.shm.name, self.pixels.shape)
+        return CarrierTemplate, (np.array(self.pixels),)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """The width and the height of the image."""
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @staticmethod
+    def open(path: os.PathLike) -> CarrierTemplate:
+        """Decodes a cover image into a template.
+
+        Args:
+            path (os.PathLike): The path to the cover image.
+
+        Returns:
+            A `CarrierTemplate` instance.
+        """
+        with Image.open(path) as image:
+            return CarrierTemplate(np.array(image))
+
+    @staticmethod
+    def _attach(name: str, shape: tuple[int, ...]) -> CarrierTemplate:
+        shm = shared_memory.SharedMemory(name)
+        return CarrierTemplate(np.ndarray(shape, np.uint8, shm.buf), shm)
+
+    def new_image(self) -> Image.Image:
+        """Makes a new image from the pristine pixels, to embed one payload into.
+
+        Returns:
+            An `Image.Image` instance, which leaves the template unchanged when modified.
+        """
+        return Image.fromarray(self.pixels)
+
+    def to_shared_memory(self) -> CarrierTemplate:
+        """Copies the template into a new shared memory block, which the caller must release with `release`.
+
+        Returns:
+            A `CarrierTemplate` instance backed by shared memory, which is pickled by name.
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(self.pixels.nbytes, 1))
+        pixels = np.ndarray(self.pixels.shape, np.uint8, shm.buf)
+        pixels[...] = self.pixels
+        return CarrierTemplate(pixels, shm)
+
+    def release(self, unlink: bool = False) -> None:
+        """Releases the shared memory block of the template, if any, after which the template cannot be used.
+
+        Args:
+            unlink (bool): Whether to destroy the block, which only its creator should do.
+
+        Returns:
+            None
+        """
+        if self.shm is None:
+            return
+        # The array must not outlive the buffer it is a view of
+        self.pixels = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        self.shm = None
+
+
+@contextlib.contextmanager
+def shared_templates(paths: list[str]) -> Iterator[dict[str, CarrierTemplate]]:
+    """Decodes cover images once into templates in shared memory, which worker processes attach to.
+
+    Images which cannot be decoded are skipped, and left to fail where they are used.
+
+    Args:
+        paths (list[str]): The paths to the cover images, duplicates are decoded once.
+
+    Returns:
+        A context manager of a dictionary mapping every path to its template, whose shared memory is destroyed on
+        exit.
+    """
+    templates = dict()
+    try:
+        for path in dict.fromkeys(paths):
+            try:
+                template = CarrierTemplate.open(path)
+            except (OSError, ValueError):
+                continue
+            templates[path] = template.to_shared_memory()
+        yield templates
+    finally:
+        for template in templates.values():
+            template.release(unlink=True)
@@ -1,6 +1,30 @@
+import asyncio
+import bz2
+import concurrent.futures
+import io
+import os
+import pickle
+import threading
+
+import numpy as np
 import pytest
+from PIL import Image
 
+from SuperHelper.Core.Utils import Cryptographer
 from SuperHelper.Tests import *
+from SuperHelper.Modules.Stenographer.api import EmbedParams, embed, extract, read_header
+from SuperHelper.Modules.Stenographer import async_api
+from SuperHelper.Modules.Stenographer.async_api import AsyncStenographer
+from SuperHelper.Modules.Stenographer.bit_plane import BitPlane
+from SuperHelper.Modules.Stenographer.carrier import MappedCarrier, decode_rows, open_carrier
+from SuperHelper.Modules.Stenographer.compression import choose_codec, compress_bz2_parallel, estimate_entropy
+from SuperHelper.Modules.Stenographer.header import BinaryHeader, Header, KdfCostError, acceptable_kdf_costs, \
+    kdf_cost_factor, parse_header
+from SuperHelper.Modules.Stenographer.pool import PoolEntry, choose_carrier, index_file_name, load_index, \
+    predict_length, update_index
+from SuperHelper.Modules.Stenographer.png_writer import PNGWriter, filter_types, png_presets, save_png
+from SuperHelper.Modules.Stenographer.shard import shard_capacity, split_payload, token_length
+from SuperHelper.Modules.Stenographer.template import CarrierTemplate, shared_templates
 
 
 class TestStenographer:
@@ -9,6 +33,21 @@ class TestStenographer:
     def setup():
         run("add Stenographer")
 
+    @staticmethod
+    @pytest.fixture()
+    def carrier(tmp_path):
+        path = tmp_path / "carrier.png"
+        pixels = np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        return path
+
+    @staticmethod
+    @pytest.fixture()
+    def payload(tmp_path):
+        path = tmp_path / "payload.bin"
+        path.write_bytes(b"SuperHelper" * 100)
+        return path
+
     @staticmethod
     def test_validate_setup(setup):
         assert "Stenographer" in run("list").output
@@ -16,3 +55,799 @@ class TestStenographer:
     @staticmethod
     def test_help():
         assert run("steg --help").exit_code == 0
+
+    @staticmethod
+    @pytest.mark.parametrize("density", [1, 2, 3])
+    def test_create_and_extract(setup, carrier, payload, tmp_path, density):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} -d {density} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+
+    @staticmethod
+    @pytest.mark.parametrize("preset", ["fast", "small"])
+    def test_create_and_extract_png_preset(setup, carrier, payload, tmp_path, preset):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} --png-preset {preset} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+
+    @staticmethod
+    @pytest.mark.parametrize("suffix", ["bmp", "ppm", "pam", "rgb"])
+    @pytest.mark.parametrize("args", ["", "-s 256 --aead"])
+    def test_create_and_extract_mapped(setup, payload, tmp_path, suffix, args):
+        carrier, stego, output = tmp_path / f"carrier.{suffix}", tmp_path / f"stego.{suffix}", tmp_path / "output.bin"
+        pixels = np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+        raw_size = ""
+        if suffix == "pam":
+            carrier.write_bytes(b"P7\nWIDTH 90\nHEIGHT 120\nDEPTH 3\nMAXVAL 255\nTUPLTYPE RGB\nENDHDR\n" +
+                                pixels.tobytes())
+        elif suffix == "rgb":
+            carrier.write_bytes(pixels.tobytes())
+            raw_size = "--raw-size 90x120"
+        else:
+            Image.fromarray(pixels).save(carrier)
+        assert run(f"steg create -i {carrier} {args} {raw_size} -o {stego} {payload}").exit_code == 0
+        # The carrier is embedded into in its own format, leaving everything but the low bits as they are
+        assert stego.stat().st_size == carrier.stat().st_size
+        assert run(f"steg extract {raw_size} -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        if not args:
+            # Updating rewrites the payload in place, keeping the format of the steganography
+            magic = stego.read_bytes()[:2]
+            new_payload = tmp_path / "new_payload.bin"
+            new_payload.write_bytes(b"updated payload")
+            assert run(f"steg update {raw_size} {stego} {new_payload}").exit_code == 0
+            assert stego.stat().st_size == carrier.stat().st_size and stego.read_bytes()[:2] == magic
+            assert run(f"steg extract {raw_size} -o {output} {stego}").exit_code == 0
+            assert output.read_bytes() == new_payload.read_bytes()
+        assert run(f"steg create -i {carrier} {args} {raw_size} -o {tmp_path / 'stego.png'} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {tmp_path / 'stego.png'}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+
+    @staticmethod
+    @pytest.mark.parametrize("output_name", ["stego", "stego.dat"])
+    def test_create_mapped_as_png(setup, payload, tmp_path, monkeypatch, output_name):
+        from SuperHelper.Modules.Stenographer.__main__ import open_create_carrier
+
+        carrier, stego, output = tmp_path / "carrier.bmp", tmp_path / output_name, tmp_path / "output.bin"
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)).save(carrier)
+        # Outputs without the suffix of the carrier format are PNG images
+        assert run(f"steg create -i {carrier} -o {stego} {payload}").exit_code == 0
+        assert Image.open(stego).format == "PNG"
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        # So is the standard output, which is named '<stdout>'
+        monkeypatch.chdir(tmp_path)
+        stdout = io.BytesIO()
+        stdout.name = "<stdout>"
+        with open(carrier, "rb") as fp:
+            assert isinstance(open_create_carrier(fp, stdout, None), Image.Image)
+        assert not stdout.closed and not (tmp_path / "<stdout>").exists()
+
+    @staticmethod
+    @pytest.mark.parametrize("header", ["--text-header", "--binary-header"])
+    def test_create_and_extract_aead(setup, carrier, payload, tmp_path, header):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} -d 3 --aead {header} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run(f"steg extract -k wrong -o {output} {stego}").exit_code == 1
+
+    @staticmethod
+    @pytest.mark.parametrize("compress", [0, 9])
+    @pytest.mark.parametrize("cipher", ["--fernet", "--aead"])
+    @pytest.mark.parametrize("header", ["--text-header", "--binary-header"])
+    def test_create_and_extract_chunked(setup, carrier, payload, tmp_path, compress, cipher, header):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        args = f"-c {compress} -s 256 {cipher} {header}"
+        assert run(f"steg create -i {carrier} {args} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run(f"steg extract -k wrong -o {output} {stego}").exit_code == 1
+
+    @staticmethod
+    @pytest.mark.parametrize("codec", ["zlib", "lzma", "auto"])
+    @pytest.mark.parametrize("chunk_size", [0, 256])
+    def test_create_and_extract_codec(setup, carrier, payload, tmp_path, codec, chunk_size):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} --codec {codec} -s {chunk_size} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+
+    @staticmethod
+    def test_create_codec_requires_binary_header(setup, carrier, payload, tmp_path):
+        stego = tmp_path / "stego.png"
+        assert run(f"steg create -i {carrier} --codec zlib --text-header -o {stego} {payload}").exit_code == 1
+
+    @staticmethod
+    @pytest.mark.parametrize("header", ["--text-header", "--binary-header"])
+    @pytest.mark.parametrize("args", ["--fernet -s 0", "--aead -s 0", "--fernet -s 256"])
+    def test_extract_with_keys_file(setup, carrier, payload, tmp_path, header, args):
+        stego, output, keys = tmp_path / "stego.png", tmp_path / "output.bin", tmp_path / "keys.txt"
+        assert run(f"steg create -i {carrier} -k right {header} {args} -o {stego} {payload}").exit_code == 0
+        keys.write_text("".join(f"wrong{i}\n" for i in range(20)) + "right\n")
+        result = run(f"steg extract --keys-file {keys} -j 2 -o {output} {stego}")
+        assert result.exit_code == 0 and "right" in result.output
+        assert output.read_bytes() == payload.read_bytes()
+        keys.write_text("wrong\n")
+        assert run(f"steg extract --keys-file {keys} -o {output} {stego}").exit_code == 1
+        assert run(f"steg extract -k right --keys-file {keys} -o {output} {stego}").exit_code != 0
+
+    @staticmethod
+    @pytest.mark.parametrize("kdf", ["--kdf pbkdf2 --kdf-cost 1000", "--kdf scrypt --kdf-cost 10"])
+    def test_create_and_extract_kdf(setup, carrier, payload, tmp_path, kdf):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} {kdf} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run(f"steg create -i {carrier} {kdf} --text-header -o {stego} {payload}").exit_code == 1
+        assert run(f"steg create -i {carrier} --kdf scrypt --kdf-cost 99 -o {stego} {payload}").exit_code == 1
+
+    @staticmethod
+    def test_extract_kdf_cost_ceiling(setup, carrier, payload, tmp_path):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        # Costs far above the default are rejected from the header, before any key is derived
+        assert run(f"steg create -i {carrier} --kdf pbkdf2 --kdf-cost 50000 -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 1
+
+    @staticmethod
+    def test_extract_default_cost_after_low_calibration(setup, carrier, payload, tmp_path):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        assert run(f"steg create -i {carrier} --binary-header --kdf pbkdf2 -o {stego} {payload}").exit_code == 0
+        # A calibration below the default cost on a slow machine still accepts steganography of the default cost
+        result = run("steg calibrate --kdf pbkdf2 -t 0.0001 --save")
+        assert result.exit_code == 0 and int(result.output.split()[1]) * kdf_cost_factor < 10000
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run("steg calibrate --reset").exit_code == 0
+
+    @staticmethod
+    def test_calibrate(setup, carrier, payload, tmp_path):
+        stego, output = tmp_path / "stego.png", tmp_path / "output.bin"
+        result = run("steg calibrate --kdf scrypt -t 0.001 --save")
+        assert result.exit_code == 0 and result.output.startswith("scrypt ")
+        assert run(f"steg create -i {carrier} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run(f"steg calibrate --kdf pbkdf2 --kdf-cost 10000 --save").exit_code != 0
+        result = run(f"steg calibrate --kdf pbkdf2 -t 0.01")
+        assert result.exit_code == 0 and result.output.startswith("pbkdf2 ")
+        assert run("steg calibrate --reset").exit_code == 0
+        assert run(f"steg create -i {carrier} --text-header -o {stego} {payload}").exit_code == 0
+
+    @staticmethod
+    @pytest.mark.parametrize("cipher", ["--fernet", "--aead"])
+    @pytest.mark.parametrize("header", ["--text-header", "--binary-header"])
+    def test_update(setup, carrier, payload, tmp_path, cipher, header):
+        stego, copy, output, update = tmp_path / "stego.png", tmp_path / "copy.png", tmp_path / "output.bin", \
+                                      tmp_path / "update.bin"
+        assert run(f"steg create -i {carrier} -c 0 {cipher} {header} -o {stego} {payload}").exit_code == 0
+        for data in [b"A shorter payload", b"A longer payload" * 100]:
+            update.write_bytes(data)
+            assert run(f"steg update {stego} {update}").exit_code == 0
+            assert run(f"steg extract -o {output} {stego}").exit_code == 0
+            assert output.read_bytes() == data
+        original = stego.read_bytes()
+        assert run(f"steg update -k wrong {stego} {update}").exit_code == 1
+        update.write_bytes(os.urandom(5000))
+        assert run(f"steg update {stego} {update}").exit_code == 1
+        assert stego.read_bytes() == original
+        update.write_bytes(b"Another payload")
+        assert run(f"steg update -o {copy} {stego} {update}").exit_code == 0
+        assert run(f"steg extract -o {output} {copy}").exit_code == 0
+        assert output.read_bytes() == b"Another payload"
+        assert stego.read_bytes() == original
+        assert sorted(path.name for path in tmp_path.iterdir() if path.name.startswith(".")) == []
+
+    @staticmethod
+    @pytest.mark.parametrize("cipher", ["--fernet", "--aead"])
+    @pytest.mark.parametrize("header", ["--text-header", "--binary-header"])
+    def test_create_and_extract_archive(setup, carrier, payload, tmp_path, cipher, header):
+        stego, output, other, keys = tmp_path / "stego.png", tmp_path / "output.bin", tmp_path / "other.txt", \
+                                     tmp_path / "keys.txt"
+        other.write_text("Another member")
+        assert run(f"steg create -i {carrier} {cipher} {header} -o {stego} {payload} {other}").exit_code == 0
+        result = run(f"steg extract --list {stego}")
+        assert result.exit_code == 0 and result.output == f"payload.bin\t{payload.stat().st_size}\nother.txt\t14\n"
+        assert run(f"steg extract -m other.txt -o {output} {stego}").exit_code == 0
+        assert output.read_text() == "Another member"
+        assert run(f"steg extract -m payload.bin -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        keys.write_text("wrong\nbGs21Gt@31\n")
+        assert run(f"steg extract -m other.txt --keys-file {keys} -o {output} {stego}").exit_code == 0
+        assert output.read_text() == "Another member"
+        assert run(f"steg extract -m missing -o {output} {stego}").exit_code == 1
+        assert run(f"steg extract -k wrong -m other.txt -o {output} {stego}").exit_code == 1
+        assert run(f"steg extract -o {output} {stego}").exit_code == 1
+        assert run(f"steg create -i {carrier} -o {stego} {payload}").exit_code == 0
+        assert run(f"steg extract -m payload.bin -o {output} {stego}").exit_code == 1
+        assert run(f"steg create -i {carrier} -o {stego} {payload} {payload}").exit_code == 1
+
+    @staticmethod
+    @pytest.mark.parametrize("cipher", ["--fernet", "--aead"])
+    def test_create_and_extract_sharded(setup, carrier, tmp_path, cipher):
+        payload, output, shards = tmp_path / "payload.bin", tmp_path / "output.bin", tmp_path / "shards"
+        # Too big for one carrier, hence only fits across all of them
+        payload.write_bytes(np.random.default_rng(1).bytes(8000))
+        images = " ".join(f"-i {carrier}" for _ in range(3))
+        assert run(f"steg create -i {carrier} -c 0 -o {tmp_path / 'stego.png'} {payload}").exit_code == 1
+        assert run(f"steg create-sharded {images} -c 0 {cipher} -o {shards} {payload}").exit_code == 0
+        paths = [shards / f"payload.bin.{i}.png" for i in range(3)]
+        assert run(f"steg extract-sharded -o {output} {paths[2]} {paths[0]} {paths[1]}").exit_code == 0
+        assert output.read_bytes() == payload.read_bytes()
+        assert run(f"steg extract-sharded -k wrong -o {output} {' '.join(map(str, paths))}").exit_code == 1
+        assert run(f"steg extract-sharded -o {output} {paths[0]} {paths[1]}").exit_code == 1
+        assert run(f"steg extract-sharded -o {output} {paths[0]} {paths[0]} {paths[1]}").exit_code == 1
+        assert run(f"steg extract -o {output} {paths[0]}").exit_code == 1
+        assert run(f"steg create-sharded -i {carrier} -i {carrier} -c 0 -o {shards} {payload}").exit_code == 1
+
+    @staticmethod
+    @pytest.mark.parametrize("args", ["-c 0 --fernet", "-c 9 --aead", "-c 0 -s 512", "--codec auto"])
+    def test_create_with_pool(setup, payload, tmp_path, args):
+        pool, stego, output, random = tmp_path / "pool", tmp_path / "stego.png", tmp_path / "output.bin", \
+                                      tmp_path / "random.bin"
+        pool.mkdir()
+        for width in [20, 40, 80, 160]:
+            pixels = np.random.default_rng(width).integers(0, 256, (100, width, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(pool / f"carrier{width}.png")
+        (pool / "broken.png").write_bytes(b"Not an image")
+        random.write_bytes(np.random.default_rng(0).bytes(2000))
+        result = run(f"steg pool index {pool}")
+        assert result.exit_code == 0 and result.output == "4 images indexed\n"
+        result = run(f"steg create -p {pool} {args} -o {stego} {random}")
+        # 2000 incompressible bytes need 3000 pixels at density 1, and more with Fernet tokens
+        assert result.exit_code == 0 and ("carrier80.png" in result.output or "carrier160.png" in result.output)
+        assert run(f"steg extract -o {output} {stego}").exit_code == 0
+        assert output.read_bytes() == random.read_bytes()
+        random.write_bytes(np.random.default_rng(0).bytes(20000))
+        assert run(f"steg create -p {pool} {args} -o {stego} {random}").exit_code == 1
+        assert run(f"steg create -p {pool} -i {pool / 'carrier20.png'} -o {stego} {payload}").exit_code != 0
+
+    @staticmethod
+    def test_extract_without_steganography(setup, carrier, tmp_path):
+        assert run(f"steg extract -o {tmp_path / 'output.bin'} {carrier}").exit_code == 1
+
+    @staticmethod
+    def test_create_and_extract_batch(setup, carrier, tmp_path):
+        inputs, stegos, outputs = tmp_path / "inputs", tmp_path / "stegos", tmp_path / "outputs"
+        inputs.mkdir()
+        for i in range(3):
+            (inputs / f"payload{i}.bin").write_bytes(os.urandom(100 * (i + 1)))
+        # An empty file fails without aborting the batch
+        (inputs / "empty.bin").write_bytes(b"")
+        result = run(f"steg create-batch -i {carrier} -j 2 {inputs} {stegos}")
+        assert result.exit_code == 1
+        assert "3 succeeded, 1 failed" in result.output
+        assert run(f"steg extract-batch -j 2 {stegos} {outputs}").exit_code == 0
+        for i in range(3):
+            assert (outputs / f"payload{i}.bin").read_bytes() == (inputs / f"payload{i}.bin").read_bytes()
+
+    @staticmethod
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_scan(setup, carrier, payload, tmp_path, jobs):
+        stego = tmp_path / "stego.png"
+        assert run(f"steg create -i {carrier} -d 2 -c 5 -o {stego} {payload}").exit_code == 0
+        result = run(f"steg scan -j {jobs} {tmp_path}")
+        assert result.exit_code == 0
+        lines = [line for line in result.output.splitlines() if "\t" in line]
+        assert len(lines) == 1 and lines[0].startswith(f"{stego}\t2\t5\t")
+        result = run(f"steg scan -a -j {jobs} {tmp_path}")
+        assert len([line for line in result.output.splitlines() if "\t" in line]) == 2
+
+    @staticmethod
+    def test_create_and_extract_batch_manifest(setup, carrier, payload, tmp_path):
+        manifest = tmp_path / "create.csv"
+        manifest.write_text(f"# input_file,image_file,output_file\n{payload},{carrier},stego.png\n")
+        assert run(f"steg create-batch -m {manifest} --aead").exit_code == 0
+        manifest = tmp_path / "extract.csv"
+        manifest.write_text("stego.png,output.bin\n")
+        assert run(f"steg extract-batch -m {manifest}").exit_code == 0
+        assert (tmp_path / "output.bin").read_bytes() == payload.read_bytes()
+        assert run(f"steg extract-batch -k wrong -m {manifest}").exit_code == 1
+        assert run(f"steg extract-batch -m {manifest} {tmp_path} {tmp_path}").exit_code != 0
+
+
+class TestCompression:
+    @staticmethod
+    def test_estimate_entropy():
+        assert estimate_entropy(b"") == 0
+        assert estimate_entropy(b"a" * 100) == 0
+        assert estimate_entropy(bytes(range(256))) == 8
+
+    @staticmethod
+    def test_choose_codec():
+        assert choose_codec(os.urandom(1 << 16), 9) == ("bz2", 0)
+        assert choose_codec(b"SuperHelper" * 1000, 0) == ("bz2", 0)
+        codec, level = choose_codec(b"SuperHelper" * 1000, 9, ["zlib", "lzma"])
+        assert codec in ["zlib", "lzma"] and level == 9
+
+    @staticmethod
+    def test_compress_bz2_parallel():
+        data = os.urandom(1000) * 100
+        assert compress_bz2_parallel(data, 9, block_size=len(data)) == bz2.compress(data, 9)
+        assert bz2.decompress(compress_bz2_parallel(data, 9, block_size=4096, workers=4)) == data
+
+
+class TestBinaryHeader:
+    @staticmethod
+    def test_round_trip():
+        header = BinaryHeader(12345, 9, 2, "AAAAAAAAAAAAAAAAAAAAAA==", chunked=True)
+        b = header.to_bytes()
+        assert len(b) == BinaryHeader.header_length
+        parsed = BinaryHeader.from_bytes(b + b"trailing")
+        assert (parsed.data_length, parsed.compression, parsed.density, parsed.salt, parsed.chunked, parsed.aead) == \
+               (12345, 9, 2, "AAAAAAAAAAAAAAAAAAAAAA==", True, False)
+
+    @staticmethod
+    def test_key_check():
+        header = BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==", key_check=b"\x01\x02\x03\x04")
+        assert BinaryHeader.from_bytes(header.to_bytes()).key_check == b"\x01\x02\x03\x04"
+        assert BinaryHeader.from_bytes(BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==").to_bytes()).key_check is None
+        with pytest.raises(ValueError):
+            BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==", key_check=b"\x01")
+
+    @staticmethod
+    def test_shard():
+        header = BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==", shard_index=2, shard_count=3, digest=bytes(range(8)))
+        parsed = BinaryHeader.from_bytes(header.to_bytes())
+        assert (parsed.shard_index, parsed.shard_count, parsed.digest) == (2, 3, bytes(range(8)))
+        parsed = BinaryHeader.from_bytes(BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==").to_bytes())
+        assert (parsed.shard_count, parsed.digest) == (0, None)
+        with pytest.raises(ValueError):
+            BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==", shard_index=3, shard_count=3)
+
+    @staticmethod
+    def test_layout():
+        # Version 2 headers of every release must keep parsing, hence a change of the layout must bump the version
+        b = bytes.fromhex("5348021e26000003e8000102030405060708090a0b0c0d0e0f01020304010000000f0001000300010203040506"
+                          "074dcff879")
+        header = BinaryHeader.from_bytes(b)
+        assert (header.data_length, header.compression, header.density, header.salt, header.chunked, header.aead,
+                header.codec, header.key_check, header.kdf, header.kdf_cost, header.shard_index, header.shard_count,
+                header.digest) == (1000, 9, 2, "AAECAwQFBgcICQoLDA0ODw==", False, True, "zlib", b"\x01\x02\x03\x04",
+                                   "scrypt", 15, 1, 3, bytes(range(8)))
+        assert header.to_bytes() == b
+
+    @staticmethod
+    def test_kdf_cost_ceiling():
+        assert acceptable_kdf_costs(4) == {"pbkdf2": 40000, "scrypt": 16}
+        assert acceptable_kdf_costs(8, {"pbkdf2": 100000}) == {"pbkdf2": 800000, "scrypt": 17}
+        # A calibrated cost below the default does not lower the ceiling below the default
+        assert acceptable_kdf_costs(4, {"pbkdf2": 2000, "scrypt": 10}) == {"pbkdf2": 40000, "scrypt": 16}
+        b = BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==", kdf="scrypt", kdf_cost=22).to_bytes()
+        with pytest.raises(KdfCostError):
+            BinaryHeader.from_bytes(b)
+        assert BinaryHeader.from_bytes(b, acceptable_kdf_costs(1 << 8)).kdf_cost == 22
+
+    @staticmethod
+    def test_parse_header():
+        salt = "AAAAAAAAAAAAAAAAAAAAAA=="
+        header = parse_header(Header(123, 9, 3, salt, aead=True).to_bytes() + b"trailing", 1)
+        assert isinstance(header, Header)
+        assert (header.data_length, header.compression, header.density, header.salt, header.aead) == \
+               (123, 9, 3, salt, True)
+        b = BinaryHeader(123, 9, 2, salt).to_bytes()
+        assert isinstance(parse_header(b, 2), BinaryHeader)
+        with pytest.raises(ValueError):
+            parse_header(b, 1)
+        with pytest.raises(ValueError):
+            parse_header(Header(123, 9, 0, salt).to_bytes())
+
+    @staticmethod
+    def test_invalid():
+        b = BinaryHeader(1, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==").to_bytes()
+        with pytest.raises(ValueError):
+            BinaryHeader.from_bytes(b[:-1] + bytes([b[-1] ^ 1]))
+        with pytest.raises(ValueError):
+            BinaryHeader.from_bytes(b"12345?39?")
+        with pytest.raises(ValueError):
+            BinaryHeader(1 << 32, 0, 1, "AAAAAAAAAAAAAAAAAAAAAA==")
+
+
+class TestShard:
+    @staticmethod
+    @pytest.mark.parametrize("aead", [False, True])
+    def test_token_length(aead):
+        from SuperHelper.Core.Utils import Cryptographer
+
+        crypto = Cryptographer.make_encrypter(Cryptographer.encode_salt(Cryptographer.make_salt()), "key")
+        for n in [0, 1, 15, 16, 17, 100, 1000]:
+            token = crypto.encrypt_aead(bytes(n)) if aead else crypto.encrypt(bytes(n)) + b"++"
+            assert token_length(n, aead) == len(token)
+
+    @staticmethod
+    @pytest.mark.parametrize("aead", [False, True])
+    def test_shard_capacity(aead):
+        capacity = shard_capacity((90, 120), 1, BinaryHeader.header_length, aead)
+        assert BinaryHeader.header_length + token_length(capacity, aead) <= 90 * 120 * 3 // 8
+        assert BinaryHeader.header_length + token_length(capacity + 16, aead) > 90 * 120 * 3 // 8
+        assert shard_capacity((4, 4), 1, BinaryHeader.header_length, aead) == -1
+
+    @staticmethod
+    def test_split_payload():
+        data = bytes(range(200))
+        shards = split_payload(data, [100, 50, 0, 50])
+        assert b"".join(shards) == data
+        assert [len(shard) for shard in shards] == [100, 50, 0, 50]
+        assert [len(shard) for shard in split_payload(data[:101], [100, 100])] == [51, 50]
+        with pytest.raises(ValueError):
+            split_payload(data, [100, 99])
+
+
+class TestPool:
+    @staticmethod
+    def test_update_index(tmp_path):
+        Image.new("RGB", (30, 20)).save(tmp_path / "a.png")
+        Image.new("L", (10, 10)).save(tmp_path / "b.png")
+        entries, changed = update_index(tmp_path)
+        assert changed and [(entry.name, entry.width, entry.height, entry.mode) for entry in entries] == \
+               [("a.png", 30, 20, "RGB"), ("b.png", 10, 10, "L")]
+        assert load_index(tmp_path) == []
+        from SuperHelper.Modules.Stenographer.pool import save_index
+
+        save_index(tmp_path, entries)
+        assert (tmp_path / index_file_name).exists() and len(load_index(tmp_path)) == 2
+        assert update_index(tmp_path)[1] is False
+        (tmp_path / "b.png").unlink()
+        entries, changed = update_index(tmp_path)
+        assert changed and [entry.name for entry in entries] == ["a.png"]
+
+    @staticmethod
+    def test_choose_carrier():
+        entries = [PoolEntry("big", 100, 100, "RGB", 0, 0), PoolEntry("small", 10, 10, "RGB", 0, 0),
+                   PoolEntry("grey", 50, 50, "L", 0, 0)]
+        assert choose_carrier(entries, 37, 1).name == "small"
+        assert choose_carrier(entries, 38, 1).name == "big"
+        assert choose_carrier(entries, 38, 3).name == "small"
+        assert choose_carrier(entries, 20000, 3) is None
+
+    @staticmethod
+    @pytest.mark.parametrize("aead", [False, True])
+    def test_predict_length(tmp_path, aead):
+        path = tmp_path / "payload.bin"
+        path.write_bytes(b"SuperHelper" * 100)
+        with open(path, "rb") as fp:
+            length = predict_length([fp], "bz2", 9, aead, 0, BinaryHeader.header_length)
+            assert fp.tell() == 0
+        assert length == BinaryHeader.header_length + token_length(len(bz2.compress(path.read_bytes(), 9)), aead)
+
+
+class TestCarrierTemplate:
+    @staticmethod
+    @pytest.mark.parametrize("bands", [3, 4])
+    def test_new_image(tmp_path, bands):
+        path = tmp_path / "carrier.png"
+        pixels = np.random.default_rng(0).integers(0, 256, (12, 9, bands), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        template = CarrierTemplate.open(path)
+        assert template.size == (9, 12)
+        image = template.new_image()
+        image.paste(Image.new(image.mode, (9, 12)), (0, 0))
+        assert not np.array(image).any()
+        assert np.array_equal(template.pixels, pixels)
+        assert np.array_equal(np.array(template.new_image()), pixels)
+
+    @staticmethod
+    def test_shared_templates(tmp_path):
+        path = tmp_path / "carrier.png"
+        pixels = np.random.default_rng(0).integers(0, 256, (12, 9, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        (tmp_path / "broken.png").write_bytes(b"Not an image")
+        with shared_templates([str(path), str(path), str(tmp_path / "broken.png")]) as templates:
+            assert list(templates) == [str(path)]
+            # Attached by name, as in a worker process
+            attached = pickle.loads(pickle.dumps(templates[str(path)]))
+            assert attached.shm.name == templates[str(path)].shm.name
+            assert np.array_equal(np.array(attached.new_image()), pixels)
+            attached.release()
+        assert templates[str(path)].shm is None
+
+
+class TestApi:
+    @staticmethod
+    @pytest.fixture()
+    def setup_steg():
+        run("add Stenographer")
+
+    @staticmethod
+    @pytest.fixture()
+    def pixels():
+        return np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+
+    @staticmethod
+    @pytest.mark.parametrize("options", [dict(), dict(aead=True), dict(binary_header=False), dict(density=3),
+                                         dict(codec="zlib", compression=0)])
+    def test_embed_and_extract(pixels, options):
+        stego = embed(memoryview(b"SuperHelper" * 100), pixels, EmbedParams("key", **options))
+        assert not np.array_equal(stego, pixels)
+        assert extract(stego, "key") == b"SuperHelper" * 100
+        assert extract(Image.fromarray(stego), "key") == b"SuperHelper" * 100
+        assert read_header(pixels) is None
+        with pytest.raises(Exception):
+            extract(stego, "wrong")
+
+    @staticmethod
+    def test_out(pixels):
+        params = EmbedParams("key", salt=Cryptographer.encode_salt(Cryptographer.make_salt()))
+        out = np.empty_like(pixels)
+        for payload in [b"A longer payload" * 50, b"A shorter payload"]:
+            assert embed(payload, pixels, params, out) is out
+            assert extract(out, "key") == payload
+        original = pixels.copy()
+        assert embed(b"In place", pixels, params, pixels) is pixels
+        assert extract(pixels, "key") == b"In place"
+        assert ((pixels ^ original) >> 1).sum() == 0
+        with pytest.raises(ValueError):
+            embed(b"Data", pixels, params, np.empty((5, 5, 3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            embed(os.urandom(5000), pixels, params)
+
+    @staticmethod
+    def test_kdf_cost_ceiling(pixels):
+        stego = embed(b"SuperHelper", pixels, EmbedParams("key", kdf="pbkdf2", kdf_cost=50000))
+        with pytest.raises(KdfCostError):
+            extract(stego, "key")
+        assert extract(stego, "key", maximum_kdf_costs=acceptable_kdf_costs(8)) == b"SuperHelper"
+
+    @staticmethod
+    def test_params():
+        with pytest.raises(ValueError):
+            EmbedParams("key", density=4)
+        with pytest.raises(ValueError):
+            EmbedParams("key", codec="zlib", binary_header=False)
+        with pytest.raises(ValueError):
+            EmbedParams("key", kdf="scrypt", binary_header=False)
+
+    @staticmethod
+    @pytest.mark.parametrize("args", ["-s 256", "-s 0 --aead --text-header"])
+    def test_extract_steganography(setup_steg, tmp_path, args):
+        carrier, payload, stego = tmp_path / "carrier.png", tmp_path / "payload.bin", tmp_path / "stego.png"
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)).save(carrier)
+        payload.write_bytes(b"SuperHelper" * 100)
+        assert run(f"steg create -i {carrier} -k key {args} -o {stego} {payload}").exit_code == 0
+        assert extract(Image.open(stego), "key") == payload.read_bytes()
+        # Archives are extracted one member at a time
+        other = tmp_path / "other.bin"
+        other.write_bytes(b"Other")
+        assert run(f"steg create -i {carrier} -k key -o {stego} {payload} {other}").exit_code == 0
+        assert extract(Image.open(stego), "key", "other.bin") == b"Other"
+        with pytest.raises(ValueError):
+            extract(Image.open(stego), "key")
+
+
+class TestAsyncStenographer:
+    @staticmethod
+    @pytest.fixture()
+    def pixels():
+        return np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+
+    @staticmethod
+    @pytest.mark.parametrize("processes", [False, True])
+    def test_create_and_extract(pixels, processes):
+        async def main(executor):
+            async with AsyncStenographer(executor, max_concurrency=2) as stenographer:
+                params = EmbedParams("key", aead=True)
+                png = await stenographer.create(b"SuperHelper" * 100, Image.fromarray(pixels), params, "fast")
+                stego = await stenographer.embed(b"SuperHelper", pixels, params)
+                return await asyncio.gather(stenographer.extract(png, "key"), stenographer.extract(stego, "key"))
+
+        executor = concurrent.futures.ProcessPoolExecutor(1) if processes else None
+        try:
+            assert asyncio.run(main(executor)) == [b"SuperHelper" * 100, b"SuperHelper"]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    @staticmethod
+    def test_backpressure(pixels):
+        async def main():
+            async with AsyncStenographer(max_concurrency=1, max_pending=1) as stenographer:
+                stego = embed(b"SuperHelper", pixels, EmbedParams("key"))
+                first = asyncio.create_task(stenographer.extract(stego, "key"))
+                second = asyncio.create_task(stenographer.extract(stego, "key"))
+                await asyncio.sleep(0)
+                assert (stenographer.running, stenographer.pending) == (1, 1)
+                # Beyond the waiting operations, operations are rejected
+                with pytest.raises(asyncio.QueueFull):
+                    await stenographer.extract(stego, "key")
+                assert await asyncio.gather(first, second) == [b"SuperHelper"] * 2
+                assert (stenographer.running, stenographer.pending) == (0, 0)
+                with pytest.raises(ValueError):
+                    await stenographer.extract(pixels, "key")
+
+        asyncio.run(main())
+
+
+    @staticmethod
+    def test_cancel(pixels, monkeypatch):
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_extract(*_):
+            started.set()
+            finish.wait(10)
+            return b"SuperHelper"
+
+        monkeypatch.setattr(async_api, "extract", slow_extract)
+
+        async def main():
+            async with AsyncStenographer(max_concurrency=1, max_pending=0) as stenographer:
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(stenographer.extract(pixels, "key"), 0.1)
+                # The job of the cancelled operation keeps running in the executor, hence keeps its slot
+                assert started.is_set() and stenographer.running == 1
+                with pytest.raises(asyncio.QueueFull):
+                    await stenographer.extract(pixels, "key")
+                finish.set()
+                for _ in range(100):
+                    if stenographer.running == 0:
+                        break
+                    await asyncio.sleep(0.01)
+                assert stenographer.running == 0
+                assert await stenographer.extract(pixels, "key") == b"SuperHelper"
+
+        asyncio.run(main())
+
+
+class TestMappedCarrier:
+    @staticmethod
+    @pytest.mark.parametrize("bands", [3, 4])
+    @pytest.mark.parametrize("suffix", ["bmp", "ppm"])
+    def test_open(tmp_path, bands, suffix):
+        path = tmp_path / f"carrier.{suffix}"
+        pixels = np.random.default_rng(bands).integers(0, 256, (7, 5, bands), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        original = path.read_bytes()
+        with open(path, "rb") as fp:
+            carrier = open_carrier(fp)
+        assert isinstance(carrier, MappedCarrier) and carrier.size == (5, 7)
+        assert np.array_equal(carrier.pixels, pixels[..., :3])
+        # The pixels are a view over the mapping, not a copy
+        assert not carrier.pixels.flags.writeable
+        copy = carrier.copy_to(tmp_path / f"copy.{suffix}")
+        copy.pixels[0, 0] = [1, 2, 3]
+        copy.pixels[6, 4] = [4, 5, 6]
+        copy.close()
+        saved = np.array(Image.open(tmp_path / f"copy.{suffix}"))
+        assert saved[0, 0, :3].tolist() == [1, 2, 3] and saved[6, 4, :3].tolist() == [4, 5, 6]
+        assert path.read_bytes() == original
+
+    @staticmethod
+    @pytest.mark.parametrize("suffix", ["bmp", "pam", "rgba"])
+    def test_to_image(tmp_path, suffix):
+        path = tmp_path / f"carrier.{suffix}"
+        pixels = np.random.default_rng(0).integers(0, 256, (7, 5, 4), dtype=np.uint8)
+        if suffix == "pam":
+            path.write_bytes(b"P7\nWIDTH 5\nHEIGHT 7\nDEPTH 4\nMAXVAL 255\nTUPLTYPE RGB_ALPHA\nENDHDR\n" +
+                             pixels.tobytes())
+        elif suffix == "rgba":
+            path.write_bytes(pixels.tobytes())
+        else:
+            Image.fromarray(pixels).save(path)
+        carrier = MappedCarrier.open(path, raw_size=(5, 7) if suffix == "rgba" else None, raw_mode="RGBA")
+        # The alpha channel is kept
+        image = carrier.to_image()
+        assert image.mode == "RGBA" and np.array_equal(np.array(image), pixels)
+
+    @staticmethod
+    def test_unsupported(tmp_path):
+        path = tmp_path / "carrier.png"
+        Image.new("RGB", (5, 7)).save(path)
+        with open(path, "rb") as fp:
+            assert isinstance(open_carrier(fp), Image.Image)
+        Image.new("L", (5, 7)).save(tmp_path / "grey.bmp")
+        with pytest.raises(ValueError):
+            MappedCarrier.open(tmp_path / "grey.bmp")
+        (tmp_path / "carrier.rgb").write_bytes(bytes(100))
+        with pytest.raises(ValueError):
+            MappedCarrier.open(tmp_path / "carrier.rgb", raw_size=(5, 7))
+
+
+class TestPNGWriter:
+    @staticmethod
+    @pytest.mark.parametrize("bands", [3, 4])
+    @pytest.mark.parametrize("filter_type", filter_types)
+    def test_filters(bands, filter_type):
+        pixels = np.random.default_rng(bands).integers(0, 256, (23, 17, bands), dtype=np.uint8)
+        pixels[5:15] //= 32
+        fp = io.BytesIO()
+        # Small segments, written in uneven blocks of rows, span many deflate segments
+        with PNGWriter(fp, (17, 23), "RGBA" if bands == 4 else "RGB", 6, filter_type, workers=3,
+                       segment_size=100) as writer:
+            writer.write_rows(pixels[:4])
+            writer.write_rows(pixels[4:])
+        assert np.array_equal(np.array(Image.open(io.BytesIO(fp.getvalue()))), pixels)
+
+    @staticmethod
+    @pytest.mark.parametrize("preset", list(png_presets))
+    def test_save_png(preset):
+        pixels = np.random.default_rng(0).integers(0, 256, (300, 40, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels)
+        image.info["transparency"] = (1, 2, 3)
+        fp = io.BytesIO()
+        save_png(image, fp, preset, block_rows=64)
+        saved = Image.open(io.BytesIO(fp.getvalue()))
+        assert np.array_equal(np.array(saved), pixels)
+        assert saved.info["transparency"] == (1, 2, 3)
+        # Modes the writer does not support are saved by Pillow
+        fp = io.BytesIO()
+        save_png(image.convert("L"), fp, preset)
+        assert np.array_equal(np.array(Image.open(io.BytesIO(fp.getvalue()))), np.array(image.convert("L")))
+
+    @staticmethod
+    def test_rows():
+        writer = PNGWriter(io.BytesIO(), (4, 2), "RGB")
+        with pytest.raises(ValueError):
+            writer.write_rows(np.zeros((1, 5, 3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            writer.write_rows(np.zeros((3, 4, 3), dtype=np.uint8))
+        writer.write_rows(np.zeros((1, 4, 3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            writer.close()
+        with pytest.raises(ValueError):
+            PNGWriter(io.BytesIO(), (4, 2), "L")
+
+
+class TestBitPlane:
+    @staticmethod
+    def test_layout():
+        pixels = np.zeros((2, 2, 3), dtype=np.uint8)
+        BitPlane(pixels, 2).write(b"\x06\x0f")
+        # Bits are consumed from the LSB and stored column by column
+        assert pixels[0, 0].tolist() == [1, 2, 0]
+        assert pixels[1, 0].tolist() == [0, 3, 3]
+        assert pixels[:, 1].sum() == 0
+
+    @staticmethod
+    @pytest.mark.parametrize("density", [1, 2, 3])
+    def test_read_and_write(density):
+        pixels = np.random.default_rng(density).integers(0, 256, (7, 5, 4), dtype=np.uint8)
+        original = pixels.copy()
+        plane = BitPlane(pixels, density)
+        plane.write(b"data", offset=5)
+        assert plane.read(4, offset=5) == b"data"
+        assert (pixels[..., 3] == original[..., 3]).all()
+        assert ((pixels ^ original) >> density).sum() == 0
+
+    @staticmethod
+    def test_read_leading():
+        pixels = np.random.default_rng(0).integers(0, 256, (9, 4, 3), dtype=np.uint8)
+        leading = BitPlane.read_leading(pixels, 10, [1, 2, 3])
+        for density in [1, 2, 3]:
+            assert leading[density] == BitPlane(pixels, density).read(10)
+        assert len(BitPlane.read_leading(pixels, 50, [1, 3])[1]) < 50
+
+    @staticmethod
+    @pytest.mark.parametrize("density, height", [(1, 5), (2, 8), (3, 7)])
+    def test_stripes(density, height):
+        pixels = np.random.default_rng(density).integers(0, 256, (height, 40, 3), dtype=np.uint8)
+        serial_pixels, striped_pixels = pixels.copy(), pixels.copy()
+        data = np.random.default_rng(height).bytes(BitPlane(pixels, density).capacity // 8 - 4)
+        serial = BitPlane(serial_pixels, density, workers=1)
+        striped = BitPlane(striped_pixels, density, workers=4, minimum_stripe_bits=64)
+        assert len(striped._stripes(16, len(data) * 8 - 3)) > 1
+        serial.write(data, offset=16, n_bits=len(data) * 8 - 3)
+        striped.write(data, offset=16, n_bits=len(data) * 8 - 3)
+        assert (serial_pixels == striped_pixels).all()
+        assert striped.read(len(data) - 1, offset=16) == serial.read(len(data) - 1, offset=16)
+        assert striped.read(len(data) - 1, offset=16) == data[:-1]
+
+    @staticmethod
+    def test_capacity():
+        plane = BitPlane(np.zeros((2, 2, 3), dtype=np.uint8), 1)
+        with pytest.raises(ValueError):
+            plane.write(b"ab")
+        with pytest.raises(ValueError):
+            BitPlane(np.zeros((2, 2), dtype=np.uint8), 1)
+
+
+class TestCarrier:
+    @staticmethod
+    def test_decode_rows(tmp_path):
+        path = tmp_path / "carrier.png"
+        pixels = np.random.default_rng(0).integers(0, 256, (300, 40, 4), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        with Image.open(path) as image:
+            assert (decode_rows(image, 25) == pixels[:25]).all()
+            # The image is still lazily loadable
+            assert (np.array(image) == pixels).all()
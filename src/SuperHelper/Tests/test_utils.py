@@ -1,6 +1,9 @@
+import io
+import os
 import sys
 
 import pytest
+from cryptography.fernet import InvalidToken
 
 from SuperHelper.Core.Utils import BitOps, Cryptographer, FileOps, FP, TypeCheck
 
@@ -114,6 +117,92 @@ class TestCryptographer:
     def test_decrypted_data(decrypted_data):
         assert decrypted_data is not None
 
+    @staticmethod
+    def test_aead(encrypter, decrypter, string_salt, false_key, data):
+        token = encrypter.encrypt_aead(data.encode())
+        assert len(token) == len(data) + Cryptographer.nonce_length + Cryptographer.tag_length
+        assert decrypter.decrypt_aead(token) == data.encode()
+        with pytest.raises(InvalidToken):
+            Cryptographer.make_decrypter(string_salt, false_key).decrypt_aead(token)
+        with pytest.raises(ValueError):
+            encrypter.decrypt_aead(token)
+
+    @staticmethod
+    def test_make_kdf_scrypt(binary_salt, true_key):
+        key = Cryptographer.make_kdf(binary_salt, "scrypt", 10).derive(true_key.encode())
+        assert len(key) == 32 and key != Cryptographer.make_kdf(binary_salt).derive(true_key.encode())
+        with pytest.raises(ValueError):
+            Cryptographer.make_kdf(binary_salt, "argon2")
+        with pytest.raises(ValueError):
+            Cryptographer.make_kdf(binary_salt, "scrypt", 99)
+
+    @staticmethod
+    def test_kdf(string_salt, true_key, data):
+        token = Cryptographer.make_encrypter(string_salt, true_key, "scrypt", 10).encrypt(data.encode())
+        assert Cryptographer.make_decrypter(string_salt, true_key, "scrypt", 10).decrypt(token) == data.encode()
+        with pytest.raises(InvalidToken):
+            Cryptographer.make_decrypter(string_salt, true_key).decrypt(token)
+
+    @staticmethod
+    def test_calibrate():
+        assert 1 <= Cryptographer.calibrate("pbkdf2", 0.01) <= Cryptographer.maximum_kdf_costs["pbkdf2"]
+        assert 1 <= Cryptographer.calibrate("scrypt", 0.01) <= Cryptographer.maximum_kdf_costs["scrypt"]
+
+    @staticmethod
+    @pytest.mark.parametrize("length", [0, 1, 64, 64 * 3 + 5])
+    def test_stream(encrypter, decrypter, string_salt, false_key, length):
+        raw = os.urandom(length)
+        encrypted, decrypted = io.BytesIO(), io.BytesIO()
+        assert encrypter.encrypt_stream(io.BytesIO(raw), encrypted, 64) == length
+        assert decrypter.decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted) == length
+        assert decrypted.getvalue() == raw
+        with pytest.raises(InvalidToken):
+            Cryptographer.make_decrypter(string_salt, false_key).decrypt_stream(io.BytesIO(encrypted.getvalue()),
+                                                                                io.BytesIO())
+        with pytest.raises(ValueError):
+            decrypter.encrypt_stream(io.BytesIO(raw), io.BytesIO())
+
+    @staticmethod
+    def test_stream_tampered(encrypter, decrypter):
+        encrypted = io.BytesIO()
+        encrypter.encrypt_stream(io.BytesIO(os.urandom(64 * 3)), encrypted, 64)
+        stream = encrypted.getvalue()
+        header, frames = stream[:11], [stream[11 + i * 80:11 + (i + 1) * 80] for i in range(3)] + [stream[11 + 240:]]
+        truncated = header + b"".join(frames[:2])
+        reordered = header + frames[1] + frames[0] + b"".join(frames[2:])
+        flipped = stream[:20] + bytes([stream[20] ^ 1]) + stream[21:]
+        for tampered in [stream[:-1], truncated, reordered, flipped]:
+            with pytest.raises(InvalidToken):
+                decrypter.decrypt_stream(io.BytesIO(tampered), io.BytesIO())
+
+    @staticmethod
+    def test_key_cache(string_salt, true_key, false_key):
+        Cryptographer.clear_key_cache()
+        key = Cryptographer.make_decrypter(string_salt, true_key).key
+        assert len(Cryptographer._key_cache) == 1
+        assert Cryptographer.make_decrypter(string_salt, true_key).key == key
+        assert len(Cryptographer._key_cache) == 1
+        assert Cryptographer.make_decrypter(string_salt, false_key).key != key
+        Cryptographer.set_key_cache_size(1)
+        assert len(Cryptographer._key_cache) == 1
+        Cryptographer.set_key_cache_size(0)
+        assert len(Cryptographer._key_cache) == 0
+        assert Cryptographer.make_decrypter(string_salt, true_key).key == key
+        assert len(Cryptographer._key_cache) == 0
+        Cryptographer.set_key_cache_size(32)
+
+    @staticmethod
+    def test_make_future(encrypted_data, string_salt, true_key, data):
+        crypto = Cryptographer.make_future(string_salt, true_key, False).result()
+        assert crypto.decrypt(encrypted_data) == data.encode()
+
+    @staticmethod
+    def test_key_check(encrypter, decrypter, string_salt, false_key):
+        key_check = encrypter.get_key_check()
+        assert len(key_check) == Cryptographer.key_check_length
+        assert decrypter.verify_key_check(key_check)
+        assert not Cryptographer.make_decrypter(string_salt, false_key).verify_key_check(key_check)
+
     @staticmethod
     def test_encrypt_with_decrypter(decrypter, data):
         with pytest.raises(ValueError):